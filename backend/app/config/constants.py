@@ -17,6 +17,13 @@ def load_table_configs():
 
 SHARED_TABLE_CONFIGS = load_table_configs()
 
+# Database tables that share their column config with another entry
+TABLE_CONFIG_ALIASES = {
+    "master_sheet_test": "master_sheet",
+}
+for alias, source in TABLE_CONFIG_ALIASES.items():
+    SHARED_TABLE_CONFIGS.setdefault(alias, SHARED_TABLE_CONFIGS[source])
+
 # Generate TABLE_COLUMNS from JSON
 TABLE_COLUMNS = {
     table_name: [col['displayName'] for col in config['requiredColumns']]
@@ -31,4 +38,10 @@ COLUMN_ALIASES = {
         if col.get('aliases')
     }
     for table_name, config in SHARED_TABLE_CONFIGS.items()
+}
+
+# Columns the backend computes itself, so uploads may omit them
+DERIVED_COLUMNS = {
+    table_name: [col['displayName'] for col in config['requiredColumns'] if col.get('derived')]
+    for table_name, config in SHARED_TABLE_CONFIGS.items()
 }
\ No newline at end of file
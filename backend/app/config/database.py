@@ -1,9 +1,18 @@
 from prisma import Prisma
+from contextlib import asynccontextmanager
+from app.services.traced_prisma import TracedPrisma
 
-async def get_db():
+@asynccontextmanager
+async def db_session():
+    """Connected Prisma client for work outside a request, e.g. background jobs."""
     db = Prisma()
     await db.connect()
     try:
         yield db
     finally:
-        await db.disconnect()
\ No newline at end of file
+        await db.disconnect()
+
+async def get_db():
+    async with db_session() as db:
+        # Queries made for a request show up as spans of its trace
+        yield TracedPrisma(db)
@@ -0,0 +1,91 @@
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+from pathlib import Path
+from typing import List, Optional
+from app.services.tracing import RequestIdFilter
+
+class LoggingConfig:
+    LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+    FILE = os.getenv("LOG_FILE", "logs/app.log")
+    FORMAT = "%(asctime)s - %(levelname)s - %(name)s - [%(request_id)s] %(message)s"
+    # Per-row messages logged individually per upload; the rest are only counted
+    ROW_SAMPLE = int(os.getenv("LOG_ROW_SAMPLE", "5"))
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_handlers: List[logging.Handler] = []
+
+def setup_logging() -> None:
+    """
+    Route all records through a QueueHandler so callers only enqueue; a
+    QueueListener thread formats them and writes the log file. Idempotent.
+    """
+    global _listener, _handlers
+    if _listener is not None:
+        return
+
+    Path(LoggingConfig.FILE).parent.mkdir(parents=True, exist_ok=True)
+    file_handler = logging.FileHandler(LoggingConfig.FILE)
+    file_handler.setFormatter(logging.Formatter(LoggingConfig.FORMAT))
+    # Stamped again here for records that skip the queue (forked workers)
+    file_handler.addFilter(RequestIdFilter())
+    _handlers = [file_handler]
+
+    log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(-1)
+    root = logging.getLogger()
+    root.setLevel(LoggingConfig.LEVEL)
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    # The request id lives in a contextvar of the calling task, so stamp it before enqueueing
+    queue_handler.addFilter(RequestIdFilter())
+    root.addHandler(queue_handler)
+
+    _listener = logging.handlers.QueueListener(log_queue, *_handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+    # Forked workers (the consolidation pool) have no listener thread; they write directly
+    os.register_at_fork(after_in_child=_log_directly)
+
+def stop_logging() -> None:
+    """Flush queued records and stop the listener thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+def _log_directly() -> None:
+    global _listener
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        if isinstance(handler, logging.handlers.QueueHandler):
+            root.removeHandler(handler)
+    for handler in _handlers:
+        root.addHandler(handler)
+    _listener = None
+
+class RowLogSampler:
+    """
+    Log the first ROW_SAMPLE per-row messages of one upload in full and count
+    the rest, so a file with many bad rows costs one summary line instead of
+    one formatted record per row.
+    """
+
+    def __init__(self, logger: logging.Logger, level: int = logging.WARNING, limit: Optional[int] = None):
+        self.logger = logger
+        self.level = level
+        self.limit = LoggingConfig.ROW_SAMPLE if limit is None else limit
+        self.count = 0
+
+    def log(self, msg: str, *args) -> None:
+        self.count += 1
+        if self.count <= self.limit:
+            self.logger.log(self.level, msg, *args)
+
+    def summary(self, what: str, *args) -> None:
+        """Log how many messages were suppressed; what is a %-format describing them."""
+        suppressed = self.count - self.limit
+        if suppressed > 0:
+            self.logger.log(self.level, what + " (%d of %d not logged individually)", *args, suppressed, self.count)
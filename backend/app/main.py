@@ -1,28 +1,36 @@
+import time
+# Taken before the other imports so the startup report covers them
+_import_started_at = time.perf_counter()
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 from app.routers.upload import router as upload_router
 from app.routers.consolidated import router as consolidated_router
+from app.routers.export import router as export_router
+from app.routers.summary import router as summary_router
+from app.routers.jobs import router as jobs_router
+from app.routers.progress import router as progress_router
+from app.routers.admission import router as admission_router
+from app.routers.metrics import router as metrics_router
+from app.services.job_queue import get_job_queue
+from app.config.logging_config import setup_logging, stop_logging
+from app.services.tracing import TracingConfig, finish_trace, start_trace
+from app.services.traced_prisma import check_round_trip_budget
+from app.services.profiling import profile_session, profiling_requested
+from app.services.startup import StartupTimer, start_warm_up, stop_warm_up
 from dotenv import load_dotenv
 from starlette.middleware.base import BaseHTTPMiddleware
 import os
+import sys
 import logging
 import traceback
-import time
-from pathlib import Path
 from fastapi.routing import APIRoute
 
-# Create logs directory if it doesn't exist
-logs_dir = Path("logs")
-logs_dir.mkdir(exist_ok=True)
-
-# Configure logging
-logging.basicConfig(
-    filename="logs/app.log",
-    level=logging.DEBUG,
-    format="%(asctime)s - %(levelname)s - %(name)s - %(message)s"
-)
+# Configure logging: records are queued and written by a background thread (LOG_LEVEL, LOG_FILE)
+setup_logging()
 logger = logging.getLogger(__name__)
+startup_timer = StartupTimer(_import_started_at)
+startup_timer.mark("imports")
 
 load_dotenv("../.env")
 
@@ -62,6 +70,13 @@ app.add_middleware(
 # Include routers
 app.include_router(upload_router)
 app.include_router(consolidated_router)
+app.include_router(export_router)
+app.include_router(summary_router)
+app.include_router(jobs_router)
+app.include_router(progress_router)
+app.include_router(admission_router)
+app.include_router(metrics_router)
+startup_timer.mark("app setup")
 
 @app.get("/")
 async def root():
@@ -77,6 +92,12 @@ async def api_root():
             "upload": "/api/upload/",
             "replace": "/api/replace/",
             "data_summary": "/api/data-summary/{qcode}",
+            "export": "/api/export/{table}",
+            "summary": "/api/summary/{qcode}/tradebook-pnl",
+            "jobs": "/api/jobs/{job_id}",
+            "upload_progress": "/api/uploads/{upload_id}/progress",
+            "admission_stats": "/api/admission/stats",
+            "metrics": "/metrics",
             "health": "/api/upload/health"
         }
     }
@@ -101,26 +122,53 @@ async def list_routes():
 
 @app.middleware("http")
 async def log_requests(request: Request, call_next):
-    """Log all incoming requests"""
+    """
+    Log all incoming requests, trace them and report the stage breakdown in Server-Timing.
+    Requests carrying the profiling token run under the sampler and tracemalloc.
+    """
     start_time = time.time()
+    trace = start_trace(request.headers.get(TracingConfig.REQUEST_ID_HEADER))
     
     logger.info(f"Incoming request: {request.method} {request.url.path}")
     
-    response = await call_next(request)
+    # Checked here rather than in a middleware of its own, so unprofiled requests pay nothing extra
+    profile_mode = profiling_requested(request)
+    if profile_mode:
+        with profile_session(trace.request_id, profile_mode) as profile:
+            response = await call_next(request)
+        response.headers["X-Profile-Status"] = "saved" if profile else "busy"
+    else:
+        response = await call_next(request)
     
     process_time = time.time() - start_time
     logger.info(f"Request completed: {request.method} {request.url.path} - {response.status_code} - {process_time:.3f}s")
+    response.headers[TracingConfig.REQUEST_ID_HEADER] = trace.request_id
+    response.headers["Server-Timing"] = trace.server_timing()
+    finish_trace(trace, request.method, request.url.path, response.status_code)
+    check_round_trip_budget(trace, request.method, request.url.path)
     
     return response
 
 @app.on_event("startup")
 async def startup():
-    logger.info("Application startup")
-    # List routes to confirm what's live
-    routes = [r for r in app.router.routes if isinstance(r, APIRoute)]
-    logger.info(f"Total routes registered: {len(routes)}")
-    for r in routes:
-        logger.info(f"Route: {','.join(r.methods)} {r.path} -> {r.name}")
+    startup_timer.mark("server start")
+    get_job_queue().start()
+    startup_timer.mark("startup hooks")
+    # Routes are listed at /api/routes; only the count is logged
+    startup_timer.report(sum(isinstance(r, APIRoute) for r in app.router.routes))
+    # pandas and the Excel engines load in the background while requests are served
+    start_warm_up()
+
+@app.on_event("shutdown")
+async def shutdown():
+    logger.info("Application shutdown")
+    await get_job_queue().stop()
+    await stop_warm_up()
+    # The processor (and its pool) only exists once a consolidation or the warm-up imported it
+    consolidated_processor = sys.modules.get("app.services.consolidated_processor")
+    if consolidated_processor is not None:
+        consolidated_processor.shutdown_process_pool()
+    stop_logging()
 
 @app.exception_handler(404)
 async def not_found_handler(request: Request, exc: HTTPException):
@@ -0,0 +1,9 @@
+from fastapi import APIRouter
+from app.services.admission import get_admission_controller
+
+router = APIRouter(prefix="/api", tags=["admission"])
+
+@router.get("/admission/stats")
+async def admission_stats():
+    """Current ingest slots, in-flight bytes, queue depth, DB writer usage and recent wait times."""
+    return get_admission_controller().stats()
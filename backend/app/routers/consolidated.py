@@ -1,14 +1,20 @@
 
-from fastapi import APIRouter, UploadFile, File, HTTPException, BackgroundTasks
+from fastapi import APIRouter, UploadFile, File, HTTPException, Query, Depends
 from fastapi.responses import StreamingResponse
-from app.services.consolidated_processor import process_and_consolidate_csv
+from prisma import Prisma
+from prisma.errors import PrismaError
+from app.services.admission import AdmissionRejected, get_admission_controller
+from app.services.progress import UploadIdInUse, UploadProgress, create_progress
+from app.routers.upload import _enqueue_upload, _validate_upload_id
+from app.config.database import get_db
 import logging
 import traceback
+from functools import partial
+from io import BytesIO
+from typing import Optional, Dict, Any, Tuple, List
 from python_multipart.exceptions import MultipartParseError
 import time
-import csv
 import os
-from io import StringIO
 
 logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/upload", tags=["consolidated"])
@@ -22,10 +28,106 @@ def cleanup_file(file_path: str):
     except Exception as e:
         logger.warning(f"Failed to delete temporary file {file_path}: {str(e)}")
 
+async def _consolidate(
+    db: Prisma,
+    transaction_file: UploadFile,
+    holding_file: UploadFile,
+    incremental: bool
+) -> Tuple[Any, List[Dict[str, Any]], bool, Optional[Any]]:
+    """Parse and consolidate both uploads; returns (data, failed_rows, cache_hit, initial_state)."""
+    from app.services.consolidated_processor import consolidate_uploads
+    from app.services.consolidated_state import load_account_state
+
+    # Read, parse (in parallel workers) and consolidate, reusing cached results for identical inputs
+    logger.info("Parsing transaction and holding files...")
+    initial_state = None
+
+    async def load_state(account_codes):
+        nonlocal initial_state
+        initial_state = await load_account_state(db, account_codes)
+        return initial_state
+
+    consolidated_data, failed_rows, cache_hit = await consolidate_uploads(
+        transaction_file, holding_file, load_state if incremental else None
+    )
+    if consolidated_data.empty:
+        raise HTTPException(
+            status_code=400, 
+            detail="No valid data found to consolidate. Please check your file formats and data."
+        )
+    return consolidated_data, failed_rows, cache_hit, initial_state
+
+async def _process_persist(
+    db: Prisma,
+    transaction_file: UploadFile,
+    holding_file: UploadFile,
+    incremental: bool,
+    system_tag: str,
+    progress: UploadProgress
+) -> Dict[str, Any]:
+    """Consolidate both uploads and write the rows into the master sheet; shared by the request and job paths."""
+    from app.services.consolidated_state import build_account_state, save_account_state
+    from app.services.consolidated_persist import persist_consolidated, written_rows
+
+    start_time = time.time()
+    try:
+        progress.set_stage("parsing")
+        consolidated_data, failed_rows, _, initial_state = await _consolidate(
+            db, transaction_file, holding_file, incremental
+        )
+        progress.total_rows = len(consolidated_data)
+        progress.parsed(len(consolidated_data), len(failed_rows))
+
+        persisted = await persist_consolidated(db, consolidated_data, system_tag, progress)
+        if incremental:
+            written = written_rows(consolidated_data, persisted)
+            if not written.empty:
+                await save_account_state(db, build_account_state(written, initial_state))
+    except Exception as e:
+        progress.finish(error=str(e))
+        raise
+    progress.finish()
+
+    processing_time = (time.time() - start_time) * 1000
+    logger.info(f"Consolidated and persisted {persisted['inserted_rows']} records in {processing_time:.2f}ms")
+    return {
+        "message": f"{persisted['inserted_rows']} rows inserted for {len(persisted['accounts'])} accounts",
+        "total_rows": len(consolidated_data),
+        "failed_rows": failed_rows,
+        "upload_id": progress.upload_id,
+        **persisted,
+    }
+
+async def _process_persist_job(
+    db: Prisma,
+    transaction_file: bytes,
+    holding_file: bytes,
+    filenames: Dict[str, str],
+    incremental: bool,
+    system_tag: str,
+    progress: UploadProgress
+) -> Dict[str, Any]:
+    """Background job form of _process_persist, run on the spooled uploads."""
+    return await _process_persist(
+        db,
+        UploadFile(BytesIO(transaction_file), filename=filenames["transaction_file"]),
+        UploadFile(BytesIO(holding_file), filename=filenames["holding_file"]),
+        incremental,
+        system_tag,
+        progress,
+    )
+
 @router.post("/consolidated-sheet/")
 async def upload_and_generate_consolidated(
     transaction_file: UploadFile = File(..., description="Transaction Class CSV/Excel file"),
-    holding_file: UploadFile = File(..., description="Holding Asset Class CSV/Excel file")
+    holding_file: UploadFile = File(..., description="Holding Asset Class CSV/Excel file"),
+    gzip: bool = Query(False, description="Gzip-compress the streamed CSV (Content-Encoding: gzip)"),
+    incremental: bool = Query(False, description="Continue each account from its stored state and only emit new days"),
+    persist: bool = Query(False, description="Write the rows into the master sheet instead of returning a CSV"),
+    system_tag: Optional[str] = Query(None, description="System Tag for persisted master sheet rows (required with persist=true)"),
+    background: bool = Query(False, description="Persist in a background job and return 202 (requires persist=true)"),
+    upload_id: Optional[str] = Query(None, description="Id for following a persist on /api/uploads/{upload_id}/progress"),
+    db: Prisma = Depends(get_db)
 ):
     """
     Upload Transaction Class and Holding Asset Class files to generate a consolidated portfolio sheet.
@@ -37,7 +139,26 @@ async def upload_and_generate_consolidated(
     - pnl: Profit and Loss
     - drawdown: Maximum drawdown percentage
     - date: Date of the record
+
+    With incremental=true, each account's previous nav and running peak are loaded
+    from consolidated_account_state, only days after its stored last date are
+    emitted, and the state is advanced afterwards. With persist=true as well, the
+    state only advances over the days each account actually had written, so a
+    failed persist is redone by the next incremental run.
+
+    With persist=true, account codes are mapped to qcodes through
+    account_custodian_codes and the rows are inserted into the master sheet
+    directly, replacing any rows already stored for the covered dates; the
+    response lists insert counts per account instead of a CSV. A system_tag is
+    required, as every master sheet row carries one. Adding background=true
+    queues the work like the other uploads and returns 202 with the job's
+    status and progress URLs; the CSV response cannot be deferred, so
+    background requires persist.
     """
+    # Imported here so pandas loads on first use (or in the startup warm-up) rather than at app import
+    from app.services.consolidated_processor import iter_consolidated_csv
+    from app.services.consolidated_state import build_account_state, save_account_state
+
     start_time = time.time()
     logger.info(f"Processing files: {transaction_file.filename}, {holding_file.filename}")
 
@@ -57,75 +178,82 @@ async def upload_and_generate_consolidated(
                 detail=f"Holding file must be CSV, XLSX, or XLS format. Got: {holding_file.filename}"
             )
 
-        # Read file contents
-        logger.info("Reading transaction file...")
-        transaction_content = await transaction_file.read()
-        if not transaction_content:
-            raise HTTPException(status_code=400, detail="Transaction file is empty")
-        
-        logger.info("Reading holding file...")
-        holding_content = await holding_file.read()
-        if not holding_content:
-            raise HTTPException(status_code=400, detail="Holding file is empty")
-
-        # Process and generate consolidated data
-        logger.info("Processing and consolidating data...")
-        consolidated_data = process_and_consolidate_csv(
-            transaction_content, 
-            holding_content,
-            transaction_file.filename,
-            holding_file.filename
-        )
+        # Without a tag every row would fail master sheet validation and nothing would be written
+        if persist and not (system_tag and system_tag.strip()):
+            raise HTTPException(status_code=400, detail="system_tag is required when persist=true")
+        if background and not persist:
+            raise HTTPException(status_code=400, detail="background=true requires persist=true")
+        _validate_upload_id(upload_id)
 
-        if not consolidated_data:
-            raise HTTPException(
-                status_code=400, 
-                detail="No valid data found to consolidate. Please check your file formats and data."
+        upload_bytes = (transaction_file.size or 0) + (holding_file.size or 0)
+        if persist:
+            progress = create_progress(upload_id)
+            if background:
+                files = {"transaction_file": transaction_file, "holding_file": holding_file}
+                process = partial(
+                    _process_persist_job,
+                    filenames={name: file.filename for name, file in files.items()},
+                    incremental=incremental, system_tag=system_tag.strip(), progress=progress
+                )
+                return await _enqueue_upload(
+                    files,
+                    "consolidated_sheet",
+                    {
+                        "table": "master_sheet_test", "incremental": incremental, "system_tag": system_tag.strip(),
+                        "filenames": [transaction_file.filename, holding_file.filename],
+                    },
+                    process,
+                    progress,
+                )
+            try:
+                async with get_admission_controller().ingest(upload_bytes):
+                    return await _process_persist(
+                        db, transaction_file, holding_file, incremental, system_tag.strip(), progress
+                    )
+            except AdmissionRejected as e:
+                progress.finish(error=str(e))
+                raise
+
+        async with get_admission_controller().ingest(upload_bytes):
+            consolidated_data, failed_rows, cache_hit, initial_state = await _consolidate(
+                db, transaction_file, holding_file, incremental
             )
 
-        # Create CSV content
-        logger.info(f"Generating CSV with {len(consolidated_data)} records...")
-        output = StringIO()
-        writer = csv.writer(output)
-        
-        # Write header
-        writer.writerow(["account_code", "portfolio_value", "nav", "pnl", "drawdown", "date"])
-        
-        # Write data rows
-        for row in consolidated_data:
-            writer.writerow([
-                row["account_code"],
-                row["portfolio_value"],
-                row["nav"],
-                row["pnl"],
-                row["drawdown"],
-                row["date"]
-            ])
-        
-        # Get CSV content
-        csv_content = output.getvalue()
-        output.close()
-        
+        if incremental:
+            await save_account_state(db, build_account_state(consolidated_data, initial_state))
+
         processing_time = (time.time() - start_time) * 1000
-        logger.info(f"Successfully generated consolidated sheet in {processing_time:.2f}ms")
+        logger.info(f"Consolidated {len(consolidated_data)} records in {processing_time:.2f}ms, streaming CSV...")
 
-        # Return as streaming response
-        def generate():
-            yield csv_content.encode('utf-8')
+        headers = {
+            "Content-Disposition": "attachment; filename=consolidated_portfolio_sheet.csv",
+            "X-Processing-Time-MS": str(round(processing_time, 2)),
+            "X-Records-Count": str(len(consolidated_data)),
+            "X-Failed-Rows-Count": str(len(failed_rows)),
+            "X-Cache": "HIT" if cache_hit else "MISS"
+        }
+        if gzip:
+            headers["Content-Encoding"] = "gzip"
 
+        # Rows are encoded and sent chunk by chunk instead of building the whole CSV first
         return StreamingResponse(
-            generate(),
+            iter_consolidated_csv(consolidated_data, compress=gzip),
             media_type="text/csv",
-            headers={
-                "Content-Disposition": "attachment; filename=consolidated_portfolio_sheet.csv",
-                "X-Processing-Time-MS": str(round(processing_time, 2)),
-                "X-Records-Count": str(len(consolidated_data))
-            }
+            headers=headers
         )
 
     except HTTPException:
         # Re-raise HTTP exceptions as-is
         raise
+    except AdmissionRejected as e:
+        logger.warning(f"Consolidation rejected by admission control: {str(e)}")
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except UploadIdInUse as e:
+        logger.warning(str(e))
+        raise HTTPException(status_code=409, detail=str(e))
+    except PrismaError as e:
+        logger.error(f"Database error: {str(e)}\n{traceback.format_exc()}")
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
     except ValueError as e:
         logger.error(f"Data processing error: {str(e)}\n{traceback.format_exc()}")
         raise HTTPException(status_code=400, detail=f"Data processing error: {str(e)}")
@@ -0,0 +1,147 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import FileResponse, StreamingResponse
+from starlette.background import BackgroundTask
+from prisma import Prisma
+from prisma.errors import PrismaError
+from app.services.export_service import EXPORT_FORMATS, write_parquet, stream_arrow_ipc
+from app.services.db_operations import DatabaseOperationError
+from app.config.database import get_db
+import logging
+import re
+import os
+import tempfile
+import traceback
+import time
+from datetime import datetime
+from typing import Optional, List
+
+logger = logging.getLogger(__name__)
+router = APIRouter(prefix="/api", tags=["export"])
+
+# URL slug → database table name
+EXPORT_TABLES = {
+    "master-sheet": "master_sheet_test",
+    "tradebook": "tradebook",
+}
+
+def cleanup_file(file_path: str):
+    """Background task to clean up temporary files"""
+    try:
+        if os.path.exists(file_path):
+            os.remove(file_path)
+            logger.info(f"Cleaned up temporary file: {file_path}")
+    except Exception as e:
+        logger.warning(f"Failed to delete temporary file {file_path}: {str(e)}")
+
+def _validate_export_request(
+    table: str,
+    qcodes: str,
+    startDate: Optional[str],
+    endDate: Optional[str],
+    format: str,
+) -> tuple[str, List[str]]:
+    table_name = EXPORT_TABLES.get(table)
+    if not table_name:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unsupported export table: {table}. Use one of: {', '.join(EXPORT_TABLES)}"
+        )
+
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported format: {format}. Use parquet or arrow")
+
+    qcode_list = [q.strip() for q in qcodes.split(",") if q.strip()]
+    if not qcode_list:
+        raise HTTPException(status_code=400, detail="At least one qcode is required")
+    for qcode in qcode_list:
+        if not re.match(r"^[a-z0-9_]+$", qcode.lower()):
+            logger.error(f"Invalid qcode format: {qcode}")
+            raise HTTPException(status_code=400, detail=f"Invalid qcode format: {qcode}")
+
+    for value in (startDate, endDate):
+        if value is None:
+            continue
+        try:
+            datetime.strptime(value, "%Y-%m-%d")
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD")
+    if startDate and endDate and startDate > endDate:
+        raise HTTPException(status_code=400, detail="startDate cannot be after endDate")
+
+    return table_name, qcode_list
+
+@router.get("/export/{table}")
+async def export_table(
+    table: str,
+    qcodes: str = Query(..., description="Comma-separated list of qcodes"),
+    startDate: Optional[str] = Query(None),
+    endDate: Optional[str] = Query(None),
+    format: str = Query("parquet", description="parquet or arrow (Arrow IPC stream)"),
+    db: Prisma = Depends(get_db)
+):
+    """
+    Export account history as typed, compressed Parquet or an Arrow IPC stream.
+
+    Rows are read from the database in keyset-paginated batches and written as
+    record batches, keeping the Decimal precision of the source columns.
+    """
+    start_time = time.time()
+    table_name, qcode_list = _validate_export_request(table, qcodes, startDate, endDate, format)
+    logger.debug(f"Received export request for {table_name}: qcodes={qcode_list}, startDate={startDate}, endDate={endDate}, format={format}")
+
+    try:
+        accounts = await db.accounts.find_many(where={"qcode": {"in": qcode_list}})
+        found = {account.qcode for account in accounts}
+        missing = [q for q in qcode_list if q not in found]
+        if missing:
+            logger.error(f"Invalid qcodes: {missing}")
+            raise HTTPException(status_code=400, detail=f"Invalid qcode(s): {', '.join(missing)}")
+
+        if format == "arrow":
+            # The request-scoped client is closed before a streaming body is sent,
+            # so the stream owns its own connection.
+            async def generate():
+                stream_db = Prisma()
+                await stream_db.connect()
+                try:
+                    async for chunk in stream_arrow_ipc(stream_db, table_name, qcode_list, startDate, endDate):
+                        yield chunk
+                finally:
+                    await stream_db.disconnect()
+
+            return StreamingResponse(
+                generate(),
+                media_type="application/vnd.apache.arrow.stream",
+                headers={"Content-Disposition": f"attachment; filename={table_name}.arrows"}
+            )
+
+        fd, path = tempfile.mkstemp(suffix=".parquet")
+        os.close(fd)
+        try:
+            row_count = await write_parquet(db, table_name, qcode_list, startDate, endDate, path)
+        except Exception:
+            cleanup_file(path)
+            raise
+
+        processing_time = (time.time() - start_time) * 1000
+        logger.info(f"Exported {row_count} rows from {table_name} in {processing_time:.2f}ms")
+
+        return FileResponse(
+            path,
+            media_type="application/vnd.apache.parquet",
+            filename=f"{table_name}.parquet",
+            headers={
+                "X-Processing-Time-MS": str(round(processing_time, 2)),
+                "X-Records-Count": str(row_count)
+            },
+            background=BackgroundTask(cleanup_file, path)
+        )
+
+    except HTTPException:
+        raise
+    except (PrismaError, DatabaseOperationError) as e:
+        logger.error(f"Database error during export: {str(e)}\n{traceback.format_exc()}")
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+    except Exception as e:
+        logger.error(f"Unexpected error during export: {str(e)}\n{traceback.format_exc()}")
+        raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
@@ -0,0 +1,15 @@
+from fastapi import APIRouter, HTTPException
+from app.services.job_queue import get_job_queue
+import logging
+
+logger = logging.getLogger(__name__)
+router = APIRouter(prefix="/api", tags=["jobs"])
+
+@router.get("/jobs/{job_id}")
+async def get_job_status(job_id: str):
+    """State, row counts and (once finished) the result or error of a background upload job."""
+    job = get_job_queue().get(job_id)
+    if not job:
+        logger.warning(f"Unknown job id: {job_id}")
+        raise HTTPException(status_code=404, detail=f"Job not found: {job_id}")
+    return job.to_dict()
@@ -0,0 +1,10 @@
+from fastapi import APIRouter, Response
+from app.services.metrics import render_metrics
+
+# Served at /metrics, where Prometheus scrapes by default
+router = APIRouter(tags=["metrics"])
+
+@router.get("/metrics", include_in_schema=False)
+async def metrics():
+    payload, content_type = render_metrics()
+    return Response(content=payload, media_type=content_type)
@@ -0,0 +1,59 @@
+from fastapi import APIRouter, Request
+from fastapi.responses import StreamingResponse
+from app.services.progress import ProgressConfig, get_progress
+import asyncio
+import json
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+router = APIRouter(prefix="/api", tags=["progress"])
+
+def _event(name: str, payload: dict) -> str:
+    return f"event: {name}\ndata: {json.dumps(payload)}\n\n"
+
+@router.get("/uploads/{upload_id}/progress")
+async def upload_progress(upload_id: str, request: Request):
+    """
+    Server-Sent Events stream of an upload's stage, row counts and throughput.
+
+    A "progress" event is sent whenever the counters changed, at most every
+    EMIT_INTERVAL seconds, and a final "done" (or "error") event ends the stream.
+    The stream may be opened before the upload is posted (pass the same
+    upload_id to the upload route); it waits WAIT_FOR_START seconds for it.
+    """
+    async def stream():
+        opened_at = time.time()
+        last_sent = None
+        last_write = opened_at
+
+        while True:
+            if await request.is_disconnected():
+                return
+
+            progress = get_progress(upload_id)
+            if progress is None:
+                if time.time() - opened_at > ProgressConfig.WAIT_FOR_START:
+                    yield _event("error", {"upload_id": upload_id, "error": "Unknown upload_id"})
+                    return
+            else:
+                snapshot = progress.snapshot()
+                # Throughput changes every tick; only resend when the counters moved
+                state = {k: v for k, v in snapshot.items() if k not in ("rows_per_second", "elapsed_ms")}
+                if progress.done:
+                    yield _event("error" if progress.error else "done", snapshot)
+                    return
+                if state != last_sent:
+                    yield _event("progress", snapshot)
+                    last_sent, last_write = state, time.time()
+
+            if time.time() - last_write > ProgressConfig.HEARTBEAT_SECONDS:
+                yield ": keep-alive\n\n"
+                last_write = time.time()
+            await asyncio.sleep(ProgressConfig.EMIT_INTERVAL)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
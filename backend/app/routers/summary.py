@@ -0,0 +1,93 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from prisma import Prisma
+from prisma.errors import PrismaError
+from app.services.rollups import get_tradebook_pnl_summary, get_exposure_summary, rebuild_all_rollups
+from app.services.master_sheet_series import recompute_master_sheet_series
+from app.services.write_locks import WriteLockTimeout, write_lock
+from app.config.database import get_db
+import logging
+import re
+import traceback
+from datetime import datetime
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+router = APIRouter(prefix="/api", tags=["summary"])
+
+async def _validate_summary_request(
+    db: Prisma,
+    qcode: str,
+    startDate: Optional[str],
+    endDate: Optional[str],
+):
+    if not re.match(r"^[a-z0-9_]+$", qcode.lower()):
+        logger.error(f"Invalid qcode format: {qcode}")
+        raise HTTPException(status_code=400, detail="Invalid qcode format")
+
+    for value in (startDate, endDate):
+        if value is None:
+            continue
+        try:
+            datetime.strptime(value, "%Y-%m-%d")
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD")
+
+    account = await db.accounts.find_first(where={"qcode": qcode})
+    if not account:
+        logger.error(f"Invalid qcode: {qcode}")
+        raise HTTPException(status_code=400, detail=f"Invalid qcode: {qcode}")
+
+@router.get("/summary/{qcode}/tradebook-pnl")
+async def tradebook_pnl_summary(
+    qcode: str,
+    startDate: Optional[str] = Query(None),
+    endDate: Optional[str] = Query(None),
+    db: Prisma = Depends(get_db)
+):
+    """Realized PnL per day and symbol from the tradebook rollup."""
+    await _validate_summary_request(db, qcode, startDate, endDate)
+    try:
+        rows = await get_tradebook_pnl_summary(db, qcode, startDate, endDate)
+        return {"qcode": qcode, "rows": rows}
+    except PrismaError as e:
+        logger.error(f"Database error reading tradebook rollup: {str(e)}\n{traceback.format_exc()}")
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+
+@router.get("/summary/{qcode}/exposure")
+async def exposure_summary(
+    qcode: str,
+    startDate: Optional[str] = Query(None),
+    endDate: Optional[str] = Query(None),
+    db: Prisma = Depends(get_db)
+):
+    """Exposure per day and mastersheet tag from the holdings rollup."""
+    await _validate_summary_request(db, qcode, startDate, endDate)
+    try:
+        rows = await get_exposure_summary(db, qcode, startDate, endDate)
+        return {"qcode": qcode, "rows": rows}
+    except PrismaError as e:
+        logger.error(f"Database error reading exposure rollup: {str(e)}\n{traceback.format_exc()}")
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+
+@router.post("/summary/{qcode}/rebuild")
+async def rebuild_summary(
+    qcode: str,
+    db: Prisma = Depends(get_db)
+):
+    """
+    Rebuild all rollup buckets for a qcode from the raw tables, and recompute its
+    master sheet series (prev_* columns, daily P&L, drawdown, peak_nav) over the
+    full history, e.g. to backfill peak_nav on rows written before it existed.
+    """
+    await _validate_summary_request(db, qcode, None, None)
+    try:
+        refreshed = await rebuild_all_rollups(db, qcode)
+        async with write_lock(db, "master_sheet_test", qcode):
+            recomputed = await recompute_master_sheet_series(db, qcode)
+        return {"qcode": qcode, "refreshed_rows": refreshed, "recomputed_master_sheet_rows": recomputed}
+    except WriteLockTimeout as e:
+        logger.warning(f"Rebuild for {qcode} waited too long for a running write: {str(e)}")
+        raise HTTPException(status_code=409, detail=str(e))
+    except PrismaError as e:
+        logger.error(f"Database error rebuilding rollups: {str(e)}\n{traceback.format_exc()}")
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
@@ -1,12 +1,19 @@
 from fastapi import APIRouter, UploadFile, File, Form, Depends, HTTPException
+from fastapi.responses import JSONResponse
 from prisma import Prisma
 from prisma.errors import PrismaError
 from app.services.csv_processor import process_csv
 from app.services.db_operations import insert_data, delete_data, replace_data
-from app.config.database import get_db
+from app.services.job_queue import get_job_queue
+from app.services.progress import UploadIdInUse, UploadProgress, create_progress
+from app.services.admission import AdmissionRejected, get_admission_controller
+from app.services.write_locks import WriteLockTimeout
+from app.config.database import get_db, db_session
+import asyncio
 import logging
 import re
-from typing import Optional, Dict, Any
+from functools import partial
+from typing import Optional, Dict, Any, Callable, Awaitable
 from datetime import datetime
 import traceback
 from python_multipart.exceptions import MultipartParseError
@@ -16,15 +23,154 @@ from app.config.constants import TABLE_COLUMNS
 logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/api", tags=["upload"])
 
+UPLOAD_ID_PATTERN = r"^[A-Za-z0-9_-]{1,64}$"
+
+async def _enqueue_upload(
+    files: Dict[str, UploadFile],
+    kind: str,
+    params: Dict[str, Any],
+    process: Callable[..., Awaitable[Dict[str, Any]]],
+    progress: UploadProgress
+) -> JSONResponse:
+    """
+    Spool validated uploads and queue process(db, **contents) for a background
+    worker, each file's bytes passed under its key in files; returns 202.
+    """
+    async def handler(job):
+        try:
+            # Waiting jobs are bounded by JobQueueConfig.MAX_QUEUED, so only the slot limits apply here
+            async with get_admission_controller().ingest(job.size, bounded=False):
+                contents = {name: job.read_spool(name) for name in files}
+                async with db_session() as db:
+                    return await process(db, **contents)
+        except Exception as e:
+            if not progress.done:
+                progress.finish(error=str(e))
+            raise
+
+    try:
+        job = await get_job_queue().submit(
+            kind,
+            handler,
+            {name: file.file for name, file in files.items()},
+            {**params, "upload_id": progress.upload_id},
+            progress,
+        )
+    except AdmissionRejected as e:
+        progress.finish(error=str(e))
+        raise
+    return JSONResponse(
+        status_code=202,
+        content={
+            "job_id": job.id,
+            "state": job.state,
+            "status_url": f"/api/jobs/{job.id}",
+            "upload_id": progress.upload_id,
+            "progress_url": f"/api/uploads/{progress.upload_id}/progress",
+        }
+    )
+
+async def _admit_and_process(
+    db: Prisma,
+    file: UploadFile,
+    size: int,
+    process: Callable[[Prisma, bytes], Awaitable[Dict[str, Any]]],
+    progress: UploadProgress
+) -> Dict[str, Any]:
+    """
+    Run process(db, content) once the admission controller grants an ingest
+    slot for the upload's size; the body is only read into memory once admitted.
+    """
+    try:
+        async with get_admission_controller().ingest(size):
+            content = await file.read()
+            return await process(db, content)
+    except AdmissionRejected as e:
+        progress.finish(error=str(e))
+        raise
+
+def _rejected(e: AdmissionRejected) -> HTTPException:
+    logger.warning(f"Upload rejected by admission control: {str(e)}")
+    return HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+def _locked(e: WriteLockTimeout) -> HTTPException:
+    logger.warning(f"Write lock wait timed out: {str(e)}")
+    return HTTPException(status_code=409, detail=str(e))
+
+def _upload_id_in_use(e: UploadIdInUse) -> HTTPException:
+    logger.warning(str(e))
+    return HTTPException(status_code=409, detail=str(e))
+
+def _upload_size(file: UploadFile) -> int:
+    """Size of the spooled upload, known without reading it into memory."""
+    if file.size is not None:
+        return file.size
+    position = file.file.tell()
+    size = file.file.seek(0, 2)
+    file.file.seek(position)
+    return size
+
+def _validate_upload_id(upload_id: Optional[str]) -> None:
+    if upload_id and not re.match(UPLOAD_ID_PATTERN, upload_id):
+        logger.error(f"Invalid upload_id format: {upload_id}")
+        raise HTTPException(status_code=400, detail="Invalid upload_id format")
+
+async def _process_upload(
+    db: Prisma,
+    content: bytes,
+    qcode: str,
+    startDate: Optional[str],
+    endDate: Optional[str],
+    table_name: str,
+    progress: UploadProgress
+) -> Dict[str, Any]:
+    """
+    Parse an uploaded CSV and insert its rows; shared by the request and job paths.
+    Parsing runs in a worker thread so progress streams stay live meanwhile.
+    """
+    start_time = time.time()
+    try:
+        progress.set_stage("parsing")
+        data, failed_rows = await asyncio.to_thread(
+            process_csv, content, qcode, table_name, startDate, endDate, progress
+        )
+        progress.total_rows = len(data) + len(failed_rows)
+
+        # Insert data
+        success_count, insert_failed_rows = await insert_data(db, data, table_name, qcode, progress=progress)
+        failed_rows.extend(insert_failed_rows)
+    except Exception as e:
+        progress.finish(error=str(e))
+        raise
+    progress.finish()
+
+    total_duration = (time.time() - start_time) * 1000  # Convert to ms
+    logger.info(f"Uploaded {success_count} records for {table_name} with qcode {qcode} in {total_duration:.2f}ms")
+
+    # Log details of failed rows
+    if failed_rows:
+        logger.warning(f"Failed to process {len(failed_rows)} rows: {failed_rows[:5]}")
+
+    return {
+        "message": f"{success_count} rows inserted, {len(failed_rows)} failed",
+        "total_rows": len(data) + len(failed_rows),
+        "inserted_rows": success_count,
+        "column_names": TABLE_COLUMNS[table_name],
+        "first_error": failed_rows[0] if failed_rows else None,
+        "failed_rows": failed_rows,
+        "upload_id": progress.upload_id
+    }
+
 async def upload_csv(
     file: UploadFile,
     qcode: str,
     startDate: Optional[str],
     endDate: Optional[str],
     db: Prisma,
-    table_name: str
+    table_name: str,
+    background: bool = False,
+    upload_id: Optional[str] = None
 ):
-    start_time = time.time()
     logger.debug(f"Received upload request for {table_name}: qcode={qcode}, startDate={startDate}, endDate={endDate}, file={file.filename}")
 
     try:
@@ -37,6 +183,7 @@ async def upload_csv(
         if not re.match(r"^[a-z0-9_]+$", qcode.lower()):
             logger.error(f"Invalid qcode format: {qcode}")
             raise HTTPException(status_code=400, detail="Invalid qcode format")
+        _validate_upload_id(upload_id)
 
         # Validate date range
         if (startDate and not endDate) or (endDate and not startDate):
@@ -77,33 +224,36 @@ async def upload_csv(
             logger.error(f"Invalid qcode: {qcode}")
             raise HTTPException(status_code=400, detail=f"Invalid qcode: {qcode}")
 
-        # Process CSV
-        content = await file.read()
-        if not content:
+        # Process CSV; admission is checked on the spooled size before the body is read
+        size = _upload_size(file)
+        if not size:
             logger.error("Uploaded file is empty")
             raise HTTPException(status_code=400, detail="Uploaded file is empty")
-        
-        data, failed_rows = process_csv(content, qcode, table_name, startDate, endDate)
-
-        # Insert data
-        success_count, insert_failed_rows = await insert_data(db, data, table_name, qcode)
-        failed_rows.extend(insert_failed_rows)
-
-        total_duration = (time.time() - start_time) * 1000  # Convert to ms
-        logger.info(f"Uploaded {success_count} records for {table_name} with qcode {qcode} in {total_duration:.2f}ms")
-
-        # Log details of failed rows
-        if failed_rows:
-            logger.warning(f"Failed to process {len(failed_rows)} rows: {failed_rows[:5]}")
 
-        return {
-            "message": f"{success_count} rows inserted, {len(failed_rows)} failed",
-            "total_rows": len(data) + len(failed_rows),
-            "inserted_rows": success_count,
-            "column_names": TABLE_COLUMNS[table_name],
-            "first_error": failed_rows[0] if failed_rows else None,
-            "failed_rows": failed_rows
-        }
+        progress = create_progress(upload_id)
+        process = partial(
+            _process_upload,
+            qcode=qcode, startDate=startDate, endDate=endDate, table_name=table_name, progress=progress
+        )
+        if background:
+            return await _enqueue_upload(
+                {"content": file},
+                table_name,
+                {
+                    "qcode": qcode, "table": table_name, "startDate": startDate, "endDate": endDate,
+                    "filename": file.filename,
+                },
+                process,
+                progress,
+            )
+
+        return await _admit_and_process(db, file, size, process, progress)
+    except AdmissionRejected as e:
+        raise _rejected(e)
+    except WriteLockTimeout as e:
+        raise _locked(e)
+    except UploadIdInUse as e:
+        raise _upload_id_in_use(e)
     except MultipartParseError as e:
         logger.error(f"Multipart parsing error: {str(e)}\n{traceback.format_exc()}")
         raise HTTPException(status_code=400, detail=f"Failed to parse multipart form data: {str(e)}")
@@ -178,6 +328,8 @@ async def delete_records(
             "message": f"Deleted {deleted_count} records",
             "deleted_count": deleted_count
         }
+    except WriteLockTimeout as e:
+        raise _locked(e)
     except PrismaError as e:
         logger.error(f"Database error during deletion: {str(e)}\n{traceback.format_exc()}")
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
@@ -188,12 +340,47 @@ async def delete_records(
         logger.error(f"Unexpected error during deletion: {str(e)}\n{traceback.format_exc()}")
         raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
 
+async def _process_replace(db: Prisma, content: bytes, qcode: str, progress: UploadProgress) -> Dict[str, Any]:
+    """Parse an uploaded master sheet and replace the qcode's rows with it."""
+    start_time = time.time()
+    try:
+        progress.set_stage("parsing")
+        data, failed_rows = await asyncio.to_thread(
+            process_csv, content, qcode, "master_sheet_test", None, None, progress
+        )
+        progress.total_rows = len(data) + len(failed_rows)
+
+        # Replace data (delete all existing and insert new)
+        success_count, insert_failed_rows = await replace_data(
+            db, data, "master_sheet_test", qcode, progress=progress
+        )
+        failed_rows.extend(insert_failed_rows)
+    except Exception as e:
+        progress.finish(error=str(e))
+        raise
+    progress.finish()
+
+    total_duration = (time.time() - start_time) * 1000  # Convert to ms
+    logger.info(f"Replaced {success_count} records in master_sheet_test with qcode {qcode} in {total_duration:.2f}ms")
+
+    return {
+        "message": f"{success_count} rows inserted, {len(failed_rows)} failed",
+        "total_rows": len(data) + len(failed_rows),
+        "inserted_rows": success_count,
+        "failed_count": len(failed_rows),  # Failed count
+        "column_names": TABLE_COLUMNS["master_sheet_test"],
+        "first_error": failed_rows[0] if failed_rows else None,
+        "failed_rows": failed_rows,
+        "upload_id": progress.upload_id
+    }
+
 async def replace_master_sheet(
     file: UploadFile,
     qcode: str,
-    db: Prisma
+    db: Prisma,
+    background: bool = False,
+    upload_id: Optional[str] = None
 ):
-    start_time = time.time()
     logger.debug(f"Received replace request for master_sheet_test: qcode={qcode}, file={file.filename}")
 
     try:
@@ -206,6 +393,7 @@ async def replace_master_sheet(
         if not re.match(r"^[a-z0-9_]+$", qcode.lower()):
             logger.error(f"Invalid qcode format: {qcode}")
             raise HTTPException(status_code=400, detail="Invalid qcode format")
+        _validate_upload_id(upload_id)
 
         # Check if table exists
         table_exists = await db.query_first(
@@ -228,30 +416,30 @@ async def replace_master_sheet(
             logger.error(f"Invalid qcode: {qcode}")
             raise HTTPException(status_code=400, detail=f"Invalid qcode: {qcode}")
 
-        # Process CSV
-        content = await file.read()
-        if not content:
+        # Process CSV; admission is checked on the spooled size before the body is read
+        size = _upload_size(file)
+        if not size:
             logger.error("Uploaded file is empty")
             raise HTTPException(status_code=400, detail="Uploaded file is empty")
-        
-        data, failed_rows = process_csv(content, qcode, "master_sheet_test", None, None)
 
-        # Replace data (delete all existing and insert new)
-        success_count, insert_failed_rows = await replace_data(db, data, "master_sheet_test", qcode)
-        failed_rows.extend(insert_failed_rows)
-
-        total_duration = (time.time() - start_time) * 1000  # Convert to ms
-        logger.info(f"Replaced {success_count} records in master_sheet_test with qcode {qcode} in {total_duration:.2f}ms")
-
-        return {
-            "message": f"{success_count} rows inserted, {len(failed_rows)} failed",
-            "total_rows": len(data) + len(failed_rows),
-            "inserted_rows": success_count,
-            "failed_count": len(failed_rows),  # Failed count
-            "column_names": TABLE_COLUMNS["master_sheet_test"],
-            "first_error": failed_rows[0] if failed_rows else None,
-            "failed_rows": failed_rows
-        }
+        progress = create_progress(upload_id)
+        process = partial(_process_replace, qcode=qcode, progress=progress)
+        if background:
+            return await _enqueue_upload(
+                {"content": file},
+                "replace_master_sheet_test",
+                {"qcode": qcode, "table": "master_sheet_test", "filename": file.filename},
+                process,
+                progress,
+            )
+
+        return await _admit_and_process(db, file, size, process, progress)
+    except AdmissionRejected as e:
+        raise _rejected(e)
+    except WriteLockTimeout as e:
+        raise _locked(e)
+    except UploadIdInUse as e:
+        raise _upload_id_in_use(e)
     except MultipartParseError as e:
         logger.error(f"Multipart parsing error: {str(e)}\n{traceback.format_exc()}")
         raise HTTPException(status_code=400, detail=f"Failed to parse multipart form data: {str(e)}")
@@ -272,9 +460,11 @@ async def upload_master_sheet(
     qcode: str = Form(...),
     startDate: Optional[str] = Form(None),
     endDate: Optional[str] = Form(None),
+    background: bool = Form(False),
+    upload_id: Optional[str] = Form(None),
     db: Prisma = Depends(get_db)
 ):
-    return await upload_csv(file, qcode, startDate, endDate, db, "master_sheet_test")
+    return await upload_csv(file, qcode, startDate, endDate, db, "master_sheet_test", background, upload_id)
 
 @router.post("/upload/tradebook/")
 async def upload_tradebook(
@@ -282,9 +472,11 @@ async def upload_tradebook(
     qcode: str = Form(...),
     startDate: Optional[str] = Form(None),
     endDate: Optional[str] = Form(None),
+    background: bool = Form(False),
+    upload_id: Optional[str] = Form(None),
     db: Prisma = Depends(get_db)
 ):
-    return await upload_csv(file, qcode, startDate, endDate, db, "tradebook")
+    return await upload_csv(file, qcode, startDate, endDate, db, "tradebook", background, upload_id)
 
 @router.post("/upload/slippage/")
 async def upload_slippage(
@@ -292,9 +484,11 @@ async def upload_slippage(
     qcode: str = Form(...),
     startDate: Optional[str] = Form(None),
     endDate: Optional[str] = Form(None),
+    background: bool = Form(False),
+    upload_id: Optional[str] = Form(None),
     db: Prisma = Depends(get_db)
 ):
-    return await upload_csv(file, qcode, startDate, endDate, db, "slippage")
+    return await upload_csv(file, qcode, startDate, endDate, db, "slippage", background, upload_id)
 
 @router.post("/upload/mutual-fund-holding/")
 async def upload_mutual_fund_holding(
@@ -302,9 +496,11 @@ async def upload_mutual_fund_holding(
     qcode: str = Form(...),
     startDate: Optional[str] = Form(None),
     endDate: Optional[str] = Form(None),
+    background: bool = Form(False),
+    upload_id: Optional[str] = Form(None),
     db: Prisma = Depends(get_db)
 ):
-    return await upload_csv(file, qcode, startDate, endDate, db, "mutual_fund_holding")
+    return await upload_csv(file, qcode, startDate, endDate, db, "mutual_fund_holding", background, upload_id)
 
 @router.post("/upload/gold-tradebook/")
 async def upload_gold_tradebook(
@@ -312,9 +508,11 @@ async def upload_gold_tradebook(
     qcode: str = Form(...),
     startDate: Optional[str] = Form(None),
     endDate: Optional[str] = Form(None),
+    background: bool = Form(False),
+    upload_id: Optional[str] = Form(None),
     db: Prisma = Depends(get_db)
 ):
-    return await upload_csv(file, qcode, startDate, endDate, db, "gold_tradebook")
+    return await upload_csv(file, qcode, startDate, endDate, db, "gold_tradebook", background, upload_id)
 
 @router.post("/upload/liquidbees-tradebook/")
 async def upload_liquidbees_tradebook(
@@ -322,9 +520,11 @@ async def upload_liquidbees_tradebook(
     qcode: str = Form(...),
     startDate: Optional[str] = Form(None),
     endDate: Optional[str] = Form(None),
+    background: bool = Form(False),
+    upload_id: Optional[str] = Form(None),
     db: Prisma = Depends(get_db)
 ):
-    return await upload_csv(file, qcode, startDate, endDate, db, "liquidbees_tradebook")
+    return await upload_csv(file, qcode, startDate, endDate, db, "liquidbees_tradebook", background, upload_id)
 
 # Delete route
 @router.post("/replace/delete/")
@@ -342,6 +542,8 @@ async def delete_records_route(
             raise HTTPException(status_code=400, detail="Missing required fields: qcode, startDate, endDate, table")
 
         return await delete_records(qcode, startDate, endDate, table_name, db)
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error in delete route: {str(e)}\n{traceback.format_exc()}")
         raise HTTPException(status_code=500, detail=f"Error processing delete request: {str(e)}")
@@ -351,9 +553,11 @@ async def delete_records_route(
 async def replace_master_sheet_route(
     file: UploadFile = File(...),
     qcode: str = Form(...),
+    background: bool = Form(False),
+    upload_id: Optional[str] = Form(None),
     db: Prisma = Depends(get_db)
 ):
-    return await replace_master_sheet(file, qcode, db)
+    return await replace_master_sheet(file, qcode, db, background, upload_id)
 
 @router.post("/upload/equity-holding/")
 async def upload_equity_holding(
@@ -361,24 +565,30 @@ async def upload_equity_holding(
     qcode: str = Form(...),
     startDate: Optional[str] = Form(None),
     endDate: Optional[str] = Form(None),
+    background: bool = Form(False),
+    upload_id: Optional[str] = Form(None),
     db: Prisma = Depends(get_db)
 ):
-    return await upload_csv(file, qcode, startDate, endDate, db, "equity_holding")
+    return await upload_csv(file, qcode, startDate, endDate, db, "equity_holding", background, upload_id)
 
 @router.post("/upload/equity-holding-test/")
 async def upload_equity_holding_test(
     file: UploadFile = File(...),
     qcode: str = Form(...),
     date: str = Form(...),
+    background: bool = Form(False),
+    upload_id: Optional[str] = Form(None),
     db: Prisma = Depends(get_db)
 ):
-    return await upload_csv(file, qcode, None, None, db, "equity_holding_test")
+    return await upload_csv(file, qcode, None, None, db, "equity_holding_test", background, upload_id)
 
 @router.post("/upload/mutual-fund-holding-test/")
 async def upload_mutual_fund_holding_test(
     file: UploadFile = File(...),
     qcode: str = Form(...),
     date: str = Form(...),
+    background: bool = Form(False),
+    upload_id: Optional[str] = Form(None),
     db: Prisma = Depends(get_db)
 ):
-    return await upload_csv(file, qcode, None, None, db, "mutual_fund_holding_sheet_test")
\ No newline at end of file
+    return await upload_csv(file, qcode, None, None, db, "mutual_fund_holding_sheet_test", background, upload_id)
\ No newline at end of file
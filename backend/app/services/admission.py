@@ -0,0 +1,185 @@
+import asyncio
+import logging
+import math
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, Deque, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+class AdmissionConfig:
+    MAX_CONCURRENT_INGESTS = int(os.getenv("ADMISSION_MAX_INGESTS", "4"))
+    MAX_INFLIGHT_BYTES = int(os.getenv("ADMISSION_MAX_INFLIGHT_BYTES", str(512 * 1024 * 1024)))
+    MAX_DB_WRITERS = int(os.getenv("ADMISSION_MAX_DB_WRITERS", "4"))
+    MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "16"))
+    # Longest a queued request waits for a slot before it is turned away
+    QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "120"))
+    MIN_RETRY_AFTER = 5
+    # Recent waits kept for the percentiles in stats()
+    WAIT_SAMPLES = 200
+
+class AdmissionRejected(Exception):
+    """Raised when an ingest cannot be admitted; retry_after is a hint in seconds."""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class AdmissionController:
+    """
+    Global limits on concurrent ingests, the bytes they hold in memory and the
+    number of concurrent batch writes. Ingests wait in FIFO order in a bounded
+    queue; when it is full, or a wait times out, AdmissionRejected is raised.
+    A single ingest larger than the byte budget is admitted when nothing else runs.
+    """
+
+    def __init__(self, max_ingests: int, max_bytes: int, max_writers: int, max_queue: int):
+        self.max_ingests = max_ingests
+        self.max_bytes = max_bytes
+        self.max_writers = max_writers
+        self.max_queue = max_queue
+        self.active = 0
+        self.inflight_bytes = 0
+        self.writers_busy = 0
+        self.rejected = 0
+        self._waiters: Deque[object] = deque()
+        self._bounded_waiters = 0
+        self._condition = asyncio.Condition()
+        self._writers = asyncio.Semaphore(max_writers)
+        self._ingest_waits: Deque[float] = deque(maxlen=AdmissionConfig.WAIT_SAMPLES)
+        self._writer_waits: Deque[float] = deque(maxlen=AdmissionConfig.WAIT_SAMPLES)
+        self._durations: Deque[float] = deque(maxlen=AdmissionConfig.WAIT_SAMPLES)
+
+    def _fits(self, nbytes: int) -> bool:
+        if self.active >= self.max_ingests:
+            return False
+        return self.active == 0 or self.inflight_bytes + nbytes <= self.max_bytes
+
+    def retry_after(self) -> int:
+        """Rough seconds until a queue slot frees up, from recent ingest durations."""
+        if not self._durations:
+            return AdmissionConfig.MIN_RETRY_AFTER
+        average = sum(self._durations) / len(self._durations)
+        rounds = (len(self._waiters) + 1) / max(self.max_ingests, 1)
+        return max(AdmissionConfig.MIN_RETRY_AFTER, math.ceil(average * rounds))
+
+    async def _wait_for_slot(self, nbytes: int, bounded: bool) -> None:
+        if bounded and self._bounded_waiters >= self.max_queue:
+            self.rejected += 1
+            raise AdmissionRejected(
+                f"Too many uploads in progress ({self.active} running, {len(self._waiters)} queued)",
+                self.retry_after(),
+            )
+
+        token = object()
+        self._waiters.append(token)
+        self._bounded_waiters += bounded
+        try:
+            async with self._condition:
+                await asyncio.wait_for(
+                    self._condition.wait_for(lambda: self._waiters[0] is token and self._fits(nbytes)),
+                    AdmissionConfig.QUEUE_TIMEOUT if bounded else None,
+                )
+                self._waiters.popleft()
+                self.active += 1
+                self.inflight_bytes += nbytes
+                # The next waiter may fit alongside this one
+                self._condition.notify_all()
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise AdmissionRejected(
+                f"Timed out after {AdmissionConfig.QUEUE_TIMEOUT:.0f}s waiting for an upload slot",
+                self.retry_after(),
+            )
+        finally:
+            self._bounded_waiters -= bounded
+            if token in self._waiters:
+                self._waiters.remove(token)
+                async with self._condition:
+                    self._condition.notify_all()
+
+    @asynccontextmanager
+    async def ingest(self, nbytes: int, bounded: bool = True):
+        """
+        Hold an ingest slot and nbytes of the in-flight budget for the block.
+        bounded=False is for callers already queued elsewhere (background jobs):
+        they wait without a queue limit or timeout.
+        """
+        queued_at = time.time()
+        if not self._waiters and self._fits(nbytes):
+            # Nothing queued ahead and room to spare: admit without waiting
+            self.active += 1
+            self.inflight_bytes += nbytes
+        else:
+            await self._wait_for_slot(nbytes, bounded)
+
+        waited = time.time() - queued_at
+        self._ingest_waits.append(waited)
+        if waited > 1:
+            logger.info(f"Ingest of {nbytes} bytes admitted after waiting {waited:.2f}s")
+
+        started_at = time.time()
+        try:
+            yield
+        finally:
+            self._durations.append(time.time() - started_at)
+            async with self._condition:
+                self.active -= 1
+                self.inflight_bytes -= nbytes
+                self._condition.notify_all()
+
+    @asynccontextmanager
+    async def db_writer(self):
+        """Hold one of the DB writer slots shared by all ingests for a batch write."""
+        queued_at = time.time()
+        async with self._writers:
+            self._writer_waits.append(time.time() - queued_at)
+            self.writers_busy += 1
+            try:
+                yield
+            finally:
+                self.writers_busy -= 1
+
+    @staticmethod
+    def _wait_stats(waits: Deque[float]) -> Dict[str, Optional[float]]:
+        if not waits:
+            return {"samples": 0, "avg_ms": None, "p95_ms": None, "max_ms": None}
+        ordered = sorted(waits)
+        return {
+            "samples": len(ordered),
+            "avg_ms": round(sum(ordered) / len(ordered) * 1000, 2),
+            "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 2),
+            "max_ms": round(ordered[-1] * 1000, 2),
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "active_ingests": self.active,
+            "max_ingests": self.max_ingests,
+            "inflight_bytes": self.inflight_bytes,
+            "max_inflight_bytes": self.max_bytes,
+            "queue_depth": len(self._waiters),
+            "max_queue": self.max_queue,
+            "db_writers_busy": self.writers_busy,
+            "max_db_writers": self.max_writers,
+            "rejected": self.rejected,
+            "retry_after_seconds": self.retry_after(),
+            "ingest_wait": self._wait_stats(self._ingest_waits),
+            "db_writer_wait": self._wait_stats(self._writer_waits),
+        }
+
+_controller: Optional[AdmissionController] = None
+
+def get_admission_controller() -> AdmissionController:
+    """Return the process-wide admission controller."""
+    global _controller
+    if _controller is None:
+        _controller = AdmissionController(
+            AdmissionConfig.MAX_CONCURRENT_INGESTS,
+            AdmissionConfig.MAX_INFLIGHT_BYTES,
+            AdmissionConfig.MAX_DB_WRITERS,
+            AdmissionConfig.MAX_QUEUE,
+        )
+    return _controller
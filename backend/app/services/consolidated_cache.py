@@ -0,0 +1,108 @@
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+import threading
+from typing import Any, BinaryIO, Optional
+
+logger = logging.getLogger(__name__)
+
+class CacheConfig:
+    ENABLED = os.getenv("CONSOLIDATED_CACHE_ENABLED", "true").lower() == "true"
+    DIRECTORY = os.getenv("CONSOLIDATED_CACHE_DIR", os.path.join(tempfile.gettempdir(), "consolidated_cache"))
+    MAX_BYTES = int(os.getenv("CONSOLIDATED_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+    # Bump when parsing or consolidation logic changes so stale entries are never served
+    VERSION = "2"
+
+def content_hash(content: bytes) -> str:
+    """SHA-256 of an uploaded file's bytes."""
+    return hashlib.sha256(content).hexdigest()
+
+def file_hash(fileobj: BinaryIO, block_size: int = 1024 * 1024) -> str:
+    """SHA-256 of a seekable file, read in blocks from the start."""
+    digest = hashlib.sha256()
+    fileobj.seek(0)
+    for block in iter(lambda: fileobj.read(block_size), b""):
+        digest.update(block)
+    return digest.hexdigest()
+
+class ConsolidatedCache:
+    """
+    Pickle-per-entry disk cache with size-bounded LRU eviction.
+
+    Recency is tracked through file mtimes (touched on every hit), so the cache
+    survives restarts and can be shared by workers on the same host.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"v{CacheConfig.VERSION}-{key}.pkl")
+
+    def get(self, key: str) -> Optional[Any]:
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                value = pickle.load(f)
+            os.utime(path)
+            return value
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Dropping unreadable cache entry {path}: {e}")
+            self._remove(path)
+            return None
+
+    def put(self, key: str, value: Any) -> None:
+        path = self._path(key)
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.warning(f"Failed to write cache entry {path}: {e}")
+            return
+        self._evict()
+
+    def _evict(self) -> None:
+        with self._lock:
+            entries = []
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith(".pkl"):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                self._remove(path)
+                total -= size
+                logger.debug(f"Evicted cache entry {path}")
+
+    @staticmethod
+    def _remove(path: str) -> None:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+_cache: Optional[ConsolidatedCache] = None
+
+def get_consolidated_cache() -> Optional[ConsolidatedCache]:
+    """Return the process-wide cache, or None when caching is disabled."""
+    global _cache
+    if not CacheConfig.ENABLED:
+        return None
+    if _cache is None:
+        _cache = ConsolidatedCache(CacheConfig.DIRECTORY, CacheConfig.MAX_BYTES)
+    return _cache
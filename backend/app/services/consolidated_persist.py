@@ -0,0 +1,164 @@
+from prisma import Prisma
+from prisma.errors import PrismaError
+from app.services.db_operations import insert_data, DatabaseConfig, DatabaseOperationError
+from app.services.progress import UploadProgress
+from app.services.write_locks import WriteLockTimeout, write_lock
+import logging
+from collections import defaultdict
+from typing import List, Dict, Any, Optional
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+MASTER_SHEET_TABLE = "master_sheet_test"
+
+# Only the persisted system tag's rows are replaced; other tags on the same dates are kept
+DELETE_TAGGED_RANGE_QUERY = """
+DELETE FROM master_sheet_test
+WHERE qcode = $1 AND date BETWEEN $2::date AND $3::date AND system_tag = $4
+"""
+
+async def load_custodian_mapping(db: Prisma, account_codes: List[str]) -> Dict[str, List[str]]:
+    """Map each custodian account code to the qcodes registered for it in account_custodian_codes."""
+    rows = await db.query_raw(
+        """
+        SELECT custodian_code, qcode
+        FROM account_custodian_codes
+        WHERE custodian_code = ANY($1::text[])
+        """,
+        account_codes,
+    )
+    mapping: Dict[str, List[str]] = defaultdict(list)
+    for row in rows:
+        mapping[row["custodian_code"]].append(row["qcode"])
+    return mapping
+
+def _master_sheet_rows(account_df: pd.DataFrame, system_tag: str) -> List[Dict[str, Any]]:
+    """Shape one account's consolidated rows like a parsed master sheet upload."""
+    return [
+        {
+            "Date": row_date,
+            "Portfolio Value": portfolio_value,
+            "NAV": nav,
+            "PnL": pnl,
+            "Drawdown %": drawdown,
+            "System Tag": system_tag,
+        }
+        for row_date, portfolio_value, nav, pnl, drawdown in zip(
+            account_df["date"],
+            account_df["portfolio_value"],
+            account_df["nav"],
+            account_df["pnl"],
+            account_df["drawdown"],
+        )
+    ]
+
+def _written_through(account_df: pd.DataFrame, failed_rows: List[Dict[str, Any]]) -> Optional[str]:
+    """
+    Last date up to which every one of the account's rows was written, or None.
+    Failed rows carry either the input row (Date) or the serialized one (date).
+    """
+    if not failed_rows:
+        return account_df["date"].max()
+    failed_dates = [str(f["row"].get("Date") or f["row"].get("date") or "")[:10] for f in failed_rows]
+    if not all(failed_dates):
+        return None
+    written = account_df["date"][account_df["date"] < min(failed_dates)]
+    return written.max() if len(written) else None
+
+def written_rows(result: pd.DataFrame, persisted: Dict[str, Any]) -> pd.DataFrame:
+    """The rows of a consolidated frame that persist_consolidated actually wrote, in order."""
+    written_through = pd.Series({
+        account_code: entry["written_through"]
+        for account_code, entry in persisted["accounts"].items()
+        if entry.get("written_through")
+    }, dtype=object)
+    limit = result["account_code"].map(written_through)
+    return result[limit.notna() & (result["date"] <= limit.fillna(""))]
+
+async def persist_consolidated(
+    db: Prisma,
+    result: pd.DataFrame,
+    system_tag: str,
+    progress: Optional[UploadProgress] = None
+) -> Dict[str, Any]:
+    """
+    Write a consolidated frame into the master sheet through insert_data, one
+    call per account, so rows go through the same validation, batched inserts
+    and derived-column recompute as an uploaded master sheet. Each account's
+    existing rows with this system_tag in the covered date range are deleted
+    first, under the same write lock, so re-running an upload (or serving it
+    from the result cache) replaces those days instead of appending duplicates.
+    The series is recomputed once, by insert_data, from the start of the range.
+    Each account reports written_through, the last date before its first failed
+    row, so callers can advance state only over days that were stored.
+
+    Accounts without a qcode mapping, or mapped to several qcodes, are skipped
+    and reported. So are accounts whose qcode is shared with another account in
+    this upload: their rows would land on the same qcode and dates.
+
+    When progress is given, it is advanced once per account, counting an
+    account that failed as a whole as failed rows.
+    """
+    account_codes = result["account_code"].unique().tolist()
+    mapping = await load_custodian_mapping(db, account_codes)
+
+    unmapped = [code for code in account_codes if code not in mapping]
+    ambiguous = {code: qcodes for code, qcodes in mapping.items() if len(qcodes) > 1}
+    accounts_by_qcode: Dict[str, List[str]] = defaultdict(list)
+    for code, qcodes in mapping.items():
+        if len(qcodes) == 1:
+            accounts_by_qcode[qcodes[0]].append(code)
+    conflicting = {qcode: codes for qcode, codes in accounts_by_qcode.items() if len(codes) > 1}
+
+    if unmapped:
+        logger.warning(f"No qcode mapping for {len(unmapped)} accounts: {unmapped[:10]}")
+    if ambiguous or conflicting:
+        logger.warning(f"Skipping ambiguous accounts {ambiguous} and qcodes with several accounts {conflicting}")
+
+    writable = []
+    for account_code, account_df in result.groupby("account_code", sort=False):
+        qcodes = mapping.get(account_code)
+        if qcodes and len(qcodes) == 1 and qcodes[0] not in conflicting:
+            writable.append((account_code, account_df, qcodes[0]))
+    if progress:
+        progress.batches_total = len(writable)
+        progress.set_stage("inserting")
+
+    accounts: Dict[str, Dict[str, Any]] = {}
+    for account_code, account_df, qcode in writable:
+        # Dates are YYYY-MM-DD strings, so they order like the dates they stand for
+        start_date, end_date = account_df["date"].min(), account_df["date"].max()
+        try:
+            batches = (len(account_df) + DatabaseConfig.BATCH_SIZE - 1) // DatabaseConfig.BATCH_SIZE
+            async with write_lock(db, MASTER_SHEET_TABLE, qcode, batches=batches):
+                replaced = await db.execute_raw(DELETE_TAGGED_RANGE_QUERY, qcode, start_date, end_date, system_tag)
+                inserted, failed_rows = await insert_data(
+                    db, _master_sheet_rows(account_df, system_tag), MASTER_SHEET_TABLE, qcode,
+                    recompute_from=start_date,
+                )
+            accounts[account_code] = {
+                "qcode": qcode,
+                "replaced_rows": replaced,
+                "inserted_rows": inserted,
+                "failed_count": len(failed_rows),
+                "first_error": failed_rows[0] if failed_rows else None,
+                "written_through": _written_through(account_df, failed_rows),
+            }
+            if progress:
+                progress.batch_inserted(inserted, len(failed_rows))
+        except (DatabaseOperationError, PrismaError, WriteLockTimeout) as e:
+            logger.error(f"Failed to persist consolidated rows for {account_code} ({qcode}): {str(e)}")
+            accounts[account_code] = {"qcode": qcode, "inserted_rows": 0, "error": str(e)}
+            if progress:
+                progress.batch_inserted(0, len(account_df))
+
+    total_inserted = sum(entry["inserted_rows"] for entry in accounts.values())
+    logger.info(f"Persisted {total_inserted} consolidated rows into {MASTER_SHEET_TABLE} for {len(accounts)} accounts")
+    return {
+        "inserted_rows": total_inserted,
+        "accounts": accounts,
+        "unmapped_accounts": unmapped,
+        "ambiguous_accounts": ambiguous,
+        "conflicting_qcodes": conflicting,
+    }
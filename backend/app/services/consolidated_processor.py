@@ -1,143 +1,365 @@
 import pandas as pd
-from io import BytesIO
-from typing import List, Dict, Any
-from datetime import datetime
+from io import BytesIO, StringIO
+from typing import List, Dict, Any, Optional, Iterator, Callable, Awaitable, BinaryIO, Union
+import asyncio
+import csv
+import itertools
+import os
+import zlib
 import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from app.services.consolidated_cache import get_consolidated_cache, file_hash
 
 logger = logging.getLogger(__name__)
 
-def process_and_consolidate_csv(
-    transaction_content: bytes, 
-    holding_content: bytes,
-    transaction_filename: str = "transaction.csv",
-    holding_filename: str = "holding.csv"
-) -> List[Dict[str, Any]]:
+CONSOLIDATED_COLUMNS = ["account_code", "portfolio_value", "nav", "pnl", "drawdown", "date"]
+CSV_CHUNK_ROWS = 10_000
+
+# File contents, or a seekable binary file such as an UploadFile's spool
+Source = Union[bytes, BinaryIO]
+
+class ConsolidationConfig:
+    # Worker processes that reduce parsed chunks to daily totals; 1 keeps everything in-process.
+    # Every web process gets its own pool, so the default stays small
+    WORKERS = int(os.getenv("CONSOLIDATION_WORKERS", str(min(4, os.cpu_count() or 1))))
+    # Workers are started from a clean server process rather than forked from the
+    # app, whose logging, to_thread and aggregation threads may hold locks mid-fork
+    START_METHOD = os.getenv(
+        "CONSOLIDATION_START_METHOD",
+        "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn",
+    )
+    # Rows per CSV read; bounds the memory held by parsed rows during aggregation
+    PARSE_CHUNK_ROWS = int(os.getenv("CONSOLIDATION_PARSE_CHUNK_ROWS", "100000"))
+
+# Updated required columns based on your actual data
+REQUIRED_COLUMNS = {
+    "transaction_class": [
+        "WS CLIENT ID",
+        "WS ACCOUNT CODE", 
+        "CLIENT NAME",
+        "TRANDATE",
+        "QTY",
+        "RATE", 
+        "NET AMOUNT",
+        "SECURITY NAME",
+        "SECURITY TYPE",
+        "ISIN"
+    ],
+    "holding_asset_class": [
+        "WS CLIENT ID",
+        "WS ACCOUNT CODE",
+        "CLIENT NAME", 
+        "HOLDINGDATE",
+        "HOLDING QTY",
+        "UNITCOST",
+        "MKTVALUE", 
+        "SECURITY NAME",
+        "ASTCLS"
+    ]
+}
+
+# Required columns converted to floats while parsing
+NUMERIC_COLUMNS = {
+    "transaction_class": ["QTY", "RATE", "NET AMOUNT"],
+    "holding_asset_class": ["HOLDING QTY", "UNITCOST", "MKTVALUE"],
+}
+
+# (date column, value column, total name, label) summed per account and day
+DAILY_TOTALS = {
+    "transaction_class": ("TRANDATE", "NET AMOUNT", "capital_flows", "transaction"),
+    "holding_asset_class": ("HOLDINGDATE", "MKTVALUE", "portfolio_value", "holding"),
+}
+
+def _aggregate_file_cached(
+    source: Source,
+    filename: str,
+    table_name: str,
+    digest: Optional[str]
+) -> tuple[pd.Series, List[Dict[str, Any]]]:
+    """_aggregate_file, reusing the daily totals of identical content when cached."""
+    cache = get_consolidated_cache()
+    ext = filename.lower().rsplit(".", 1)[-1] if "." in filename else ""
+    key = f"totals-{table_name}-{ext}-{digest}"
+
+    if cache and digest:
+        cached = cache.get(key)
+        if cached is not None:
+            logger.info(f"Reusing cached totals of {filename}")
+            return cached
+
+    aggregated = _aggregate_file(source, filename, table_name)
+    if cache and digest:
+        cache.put(key, aggregated)
+    return aggregated
+
+async def consolidate_uploads(
+    transaction_file,
+    holding_file,
+    load_state: Optional[Callable[[List[str]], Awaitable[pd.DataFrame]]] = None
+) -> tuple[pd.DataFrame, List[Dict[str, Any]], bool]:
     """
-    Process Transaction Class and Holding Asset Class files (CSV, XLSX, XLS) and generate a consolidated sheet.
-    Returns a list of dictionaries with account_code, portfolio_value, nav, pnl, and drawdown.
+    Parse and consolidate both uploads. Returns (result, failed_rows, cache_hit).
+
+    Each upload is hashed and reduced to daily totals in a worker thread, both
+    files at once. Uploads are read from their spooled files chunk by chunk
+    rather than loaded into memory. Per-file totals and the final result are
+    cached by content hash, so a repeated request is served from disk and a
+    request changing one file reuses the other file's totals.
+    Errors from both files are collected and raised together as a ValueError.
+
+    load_state, when given, is awaited with the parsed account codes and returns
+    the stored per-account state to continue from (see _metrics_from_totals). The
+    result then depends on the database, so the result cache is bypassed.
     """
-    
-    # Updated required columns based on your actual data
-    required_columns = {
-        "transaction_class": [
-            "WS CLIENT ID",
-            "WS ACCOUNT CODE", 
-            "CLIENT NAME",
-            "TRANDATE",
-            "QTY",
-            "RATE", 
-            "NET AMOUNT",
-            "SECURITY NAME",
-            "SECURITY TYPE",
-            "ISIN"
-        ],
-        "holding_asset_class": [
-            "WS CLIENT ID",
-            "WS ACCOUNT CODE",
-            "CLIENT NAME", 
-            "HOLDINGDATE",
-            "HOLDING QTY",
-            "UNITCOST",
-            "MKTVALUE", 
-            "SECURITY NAME",
-            "ASTCLS"
-        ]
-    }
-
-    # Process transaction file
-    transaction_data, transaction_failed = _parse_file(
-        transaction_content,
-        transaction_filename,
-        "transaction_class",
-        required_columns["transaction_class"]
-    )
-    
-    # Process holding file
-    holding_data, holding_failed = _parse_file(
-        holding_content,
-        holding_filename,
-        "holding_asset_class",
-        required_columns["holding_asset_class"]
+    cache = get_consolidated_cache()
+    uploads = [
+        ("Transaction", transaction_file, "transaction_class"),
+        ("Holding", holding_file, "holding_asset_class"),
+    ]
+    digests: Dict[str, Optional[str]] = {}
+    errors: List[str] = []
+
+    for label, upload, _ in uploads:
+        if not await asyncio.to_thread(_source_size, upload.file):
+            errors.append(f"{label} file is empty")
+            continue
+        digests[label] = await asyncio.to_thread(file_hash, upload.file) if cache else None
+
+    # Checked before any parsing starts: worker threads cannot be cancelled once running
+    result_key = None
+    if cache and not errors and load_state is None:
+        result_key = f"result-{digests['Transaction']}-{digests['Holding']}"
+        cached = cache.get(result_key)
+        if cached is not None:
+            logger.info("Serving consolidated sheet from cache")
+            return cached[0], cached[1], True
+
+    tasks = [
+        (label, asyncio.create_task(asyncio.to_thread(
+            _aggregate_file_cached, upload.file, upload.filename, table_name, digests[label]
+        )))
+        for label, upload, table_name in uploads
+        if label in digests
+    ]
+    results = await asyncio.gather(*(task for _, task in tasks), return_exceptions=True)
+
+    totals: Dict[str, tuple[pd.Series, List[Dict[str, Any]]]] = {}
+    for (label, _), result in zip(tasks, results):
+        if isinstance(result, Exception):
+            errors.append(str(result))
+        else:
+            totals[label] = result
+
+    if errors:
+        raise ValueError("; ".join(errors))
+
+    capital_flows, transaction_failed = totals["Transaction"]
+    portfolio_value, holding_failed = totals["Holding"]
+
+    initial_state = None
+    if load_state is not None:
+        account_codes = portfolio_value.index.get_level_values("account_code").union(
+            capital_flows.index.get_level_values("account_code")
+        )
+        initial_state = await load_state(account_codes.tolist())
+
+    logger.info("Processing and consolidating data...")
+    result, failed_rows = await asyncio.to_thread(
+        consolidate_totals, portfolio_value, capital_flows, holding_failed + transaction_failed, initial_state
     )
 
-    # Log failed rows
-    if transaction_failed:
-        logger.warning(f"Failed to process {len(transaction_failed)} transaction rows: {transaction_failed[:5]}")
-    if holding_failed:
-        logger.warning(f"Failed to process {len(holding_failed)} holding rows: {holding_failed[:5]}")
+    if result_key:
+        await asyncio.to_thread(cache.put, result_key, (result, failed_rows))
+    return result, failed_rows, False
+
+def consolidate_totals(
+    portfolio_value: pd.Series,
+    capital_flows: pd.Series,
+    failed_rows: List[Dict[str, Any]],
+    initial_state: Optional[pd.DataFrame] = None
+) -> tuple[pd.DataFrame, List[Dict[str, Any]]]:
+    """
+    The consolidated frame (CONSOLIDATED_COLUMNS) from daily totals (see _aggregate_file).
+    With initial_state, each account continues from its stored last day instead of starting fresh.
+    """
+    result = _metrics_from_totals(portfolio_value, capital_flows, initial_state)
+
+    if failed_rows:
+        logger.warning(f"Skipped {len(failed_rows)} rows with unparseable dates: {failed_rows[:5]}")
 
-    # Generate consolidated data
-    result = _calculate_consolidated_metrics(transaction_data, holding_data)
-    
     logger.info(f"Generated {len(result)} consolidated records")
-    return result
+    return result, failed_rows
 
-def _parse_file(
-    content: bytes,
-    filename: str,
+_process_pool: Optional[ProcessPoolExecutor] = None
+# Both uploads are aggregated in concurrent threads, which would otherwise race to create the pool
+_process_pool_lock = threading.Lock()
+
+def _get_process_pool() -> ProcessPoolExecutor:
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            context = multiprocessing.get_context(ConsolidationConfig.START_METHOD)
+            if ConsolidationConfig.START_METHOD == "forkserver":
+                # Import pandas once in the server instead of in every worker
+                context.set_forkserver_preload([__name__])
+            _process_pool = ProcessPoolExecutor(max_workers=ConsolidationConfig.WORKERS, mp_context=context)
+        return _process_pool
+
+def shutdown_process_pool() -> None:
+    """Stop the consolidation worker processes, if any were started."""
+    global _process_pool
+    with _process_pool_lock:
+        pool, _process_pool = _process_pool, None
+    if pool is not None:
+        pool.shutdown(cancel_futures=True)
+
+def iter_consolidated_csv(
+    result: pd.DataFrame,
+    chunk_rows: int = CSV_CHUNK_ROWS,
+    compress: bool = False
+) -> Iterator[bytes]:
+    """
+    Yield the consolidated sheet as UTF-8 CSV in chunks of chunk_rows rows,
+    optionally gzip-compressed as a single stream.
+    """
+    compressor = zlib.compressobj(wbits=31) if compress else None  # wbits=31 → gzip container
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+
+    def flush() -> bytes:
+        chunk = buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+        return compressor.compress(chunk) if compressor else chunk
+
+    writer.writerow(CONSOLIDATED_COLUMNS)
+    for start in range(0, len(result), chunk_rows):
+        chunk = result.iloc[start:start + chunk_rows]
+        writer.writerows(zip(*(chunk[col].tolist() for col in CONSOLIDATED_COLUMNS)))
+        data = flush()
+        if data:
+            yield data
+
+    tail = flush()
+    if compressor:
+        tail += compressor.flush()
+    if tail:
+        yield tail
+
+def _header_mapping(columns: Any, required_columns: List[str]) -> Dict[str, str]:
+    """Map stripped header names to required names: exact match first, then case-insensitive."""
+    required_by_upper = {expected.upper(): expected for expected in required_columns}
+    mapping = {}
+    for col in (str(c).strip() for c in columns):
+        target = col if col in required_columns else required_by_upper.get(col.upper())
+        if target:
+            mapping[col] = target
+    return mapping
+
+def _clean_chunk(
+    df: pd.DataFrame,
+    mapping: Dict[str, str],
     table_name: str,
-    required_columns: List[str]
-) -> tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    invalid_counts: Dict[str, int]
+) -> pd.DataFrame:
     """
-    Parse a file (CSV, XLSX, XLS) by extension-first, with CSV-then-Excel fallback.
+    Keep only the required columns under their required names, drop fully empty
+    rows, strip string cells, convert numeric columns and categorize account codes.
     """
-    data = []
-    failed_rows = []
-    file_io = BytesIO(content)
+    df.columns = [str(col).strip() for col in df.columns]
+    df = df[[col for col in df.columns if col in mapping]].rename(columns=mapping)
+    df = df.dropna(how="all")
+
+    # Strip string cells per column; non-string cells (numbers, Excel dates) are kept as-is
+    for col in df.columns[df.dtypes == object]:
+        stripped = df[col].str.strip()
+        df[col] = stripped.where(stripped.notna(), df[col])
 
-    # Determine format by extension
+    for col in NUMERIC_COLUMNS[table_name]:
+        numeric = pd.to_numeric(df[col], errors="coerce").astype("float64")
+        invalid_counts[col] = invalid_counts.get(col, 0) + int((numeric.isna() & df[col].notna()).sum())
+        df[col] = numeric
+
+    df["WS ACCOUNT CODE"] = df["WS ACCOUNT CODE"].astype("category")
+    return df
+
+def _open_source(source: Source) -> BinaryIO:
+    """A readable handle positioned at the start of the file."""
+    if isinstance(source, (bytes, bytearray)):
+        return BytesIO(source)
+    source.seek(0)
+    return source
+
+def _source_size(source: Source) -> int:
+    if isinstance(source, (bytes, bytearray)):
+        return len(source)
+    source.seek(0, os.SEEK_END)
+    return source.tell()
+
+def _excel_source(source: Source) -> tuple[Any, Iterator[pd.DataFrame]]:
+    try:
+        df = pd.read_excel(_open_source(source), engine="openpyxl")
+    except Exception:
+        df = pd.read_excel(_open_source(source), engine="xlrd")
+    return df.columns, iter([df])
+
+def _csv_source(
+    source: Source,
+    required_columns: List[str],
+    text_columns: List[str],
+    chunk_rows: int
+) -> tuple[Any, Iterator[pd.DataFrame]]:
+    header = pd.read_csv(_open_source(source), nrows=0).columns
+    wanted = {col.upper() for col in required_columns}
+    # Account codes and dates stay text so every chunk is typed the same way
+    text_upper = {col.upper() for col in text_columns}
+    reader = pd.read_csv(
+        _open_source(source),
+        usecols=lambda col: str(col).strip().upper() in wanted,
+        dtype={col: str for col in header if str(col).strip().upper() in text_upper},
+        chunksize=chunk_rows,
+    )
+    return header, iter(reader)
+
+def _iter_file_chunks(
+    source: Source,
+    filename: str,
+    table_name: str,
+    required_columns: List[str],
+    chunk_rows: Optional[int] = None
+) -> Iterator[pd.DataFrame]:
+    """
+    Parse a file (CSV, XLSX, XLS) by extension-first, with CSV-then-Excel fallback,
+    yielding cleaned frames (see _clean_chunk) in original row order. CSV files are
+    read chunk_rows rows at a time and only their required columns are parsed;
+    Excel sheets are read whole. Row labels keep the file's 0-based row numbers.
+    """
+    chunk_rows = chunk_rows or ConsolidationConfig.PARSE_CHUNK_ROWS
+    text_columns = ["WS ACCOUNT CODE", DAILY_TOTALS[table_name][0]]
     ext = filename.lower().rsplit(".", 1)[-1] if "." in filename else ""
-    is_csv = ext == "csv"
-    is_excel = ext in ("xls", "xlsx")
 
-    # Read into DataFrame
     try:
-        if is_csv:
-            df = pd.read_csv(file_io)
-        elif is_excel:
-            try:
-                df = pd.read_excel(file_io, engine="openpyxl")
-            except Exception:
-                file_io.seek(0)
-                df = pd.read_excel(file_io, engine="xlrd")
+        if ext in ("xls", "xlsx"):
+            header, chunks = _excel_source(source)
+        elif ext == "csv":
+            header, chunks = _csv_source(source, required_columns, text_columns, chunk_rows)
         else:
             # Unknown extension → try CSV first, then Excel
             try:
-                df = pd.read_csv(file_io)
+                header, chunks = _csv_source(source, required_columns, text_columns, chunk_rows)
+                first = next(chunks, None)
+                chunks = itertools.chain([first] if first is not None else [], chunks)
             except Exception:
-                file_io.seek(0)
-                try:
-                    df = pd.read_excel(file_io, engine="openpyxl")
-                except Exception:
-                    file_io.seek(0)
-                    df = pd.read_excel(file_io, engine="xlrd")
+                header, chunks = _excel_source(source)
     except Exception as e:
         raise ValueError(f"Failed to parse {table_name} file '{filename}': {e}")
 
-    # Clean and normalize column names
-    df.columns = [str(col).strip() for col in df.columns]
-    
-    # Create header mapping for case-insensitive matching
-    header_mapping = {}
-    available_columns = list(df.columns)
-    
-    for col in df.columns:
-        # Try exact match first
-        if col in required_columns:
-            header_mapping[col] = col
-        else:
-            # Try case-insensitive match
-            for expected in required_columns:
-                if col.upper() == expected.upper():
-                    header_mapping[col] = expected
-                    break
-            else:
-                header_mapping[col] = col
-
     # Validate required columns are present
-    normalized_columns = [header_mapping.get(c, c) for c in df.columns]
-    missing_columns = [c for c in required_columns if c not in normalized_columns]
-    
+    available_columns = [str(col).strip() for col in header]
+    mapping = _header_mapping(header, required_columns)
+    missing_columns = [c for c in required_columns if c not in mapping.values()]
     if missing_columns:
         logger.error(f"Available columns in {filename}: {available_columns}")
         raise ValueError(
@@ -145,211 +367,255 @@ def _parse_file(
             f"Available columns: {available_columns}"
         )
 
-    # Build row dictionaries
-    for idx, row in df.iterrows():
+    invalid_counts: Dict[str, int] = {}
+    rows = 0
+    while True:
         try:
-            # Skip empty rows
-            if row.isna().all():
-                continue
-                
-            normalized_row = {}
-            for col in df.columns:
-                mapped_col = header_mapping.get(col, col)
-                value = row[col]
-                
-                # Handle NaN values
-                if pd.isna(value):
-                    normalized_row[mapped_col] = None
-                else:
-                    # Convert to string for consistent handling
-                    normalized_row[mapped_col] = str(value).strip() if isinstance(value, str) else value
-            
-            data.append(normalized_row)
-            
+            raw = next(chunks, None)
         except Exception as e:
-            failed_rows.append({
-                "row_index": idx + 2,  # +2 because pandas is 0-indexed and we have header
-                "error": str(e),
-                "row": row.to_dict(),
-            })
-
-    logger.info(f"Successfully parsed {len(data)} rows from {filename}")
-    return data, failed_rows
-
-def _calculate_consolidated_metrics(
-    transaction_data: List[Dict[str, Any]], 
-    holding_data: List[Dict[str, Any]]
-) -> List[Dict[str, Any]]:
+            raise ValueError(f"Failed to parse {table_name} file '{filename}': {e}")
+        if raw is None:
+            break
+        chunk = _clean_chunk(raw, mapping, table_name, invalid_counts)
+        rows += len(chunk)
+        yield chunk
+
+    for col, count in invalid_counts.items():
+        if count:
+            logger.warning(f"Treating {count} invalid {col} values as missing in {table_name} ('{filename}')")
+    logger.info(f"Successfully parsed {rows} rows from {filename}")
+
+def _aggregate_file(
+    source: Source,
+    filename: str,
+    table_name: str
+) -> tuple[pd.Series, List[Dict[str, Any]]]:
     """
-    Calculate consolidated metrics: portfolio_value, nav, pnl, drawdown
+    Reduce a file to its daily totals per (account_code, date) chunk by chunk, so
+    only one parsed chunk and the running totals are held in memory. The date
+    format is inferred once, from the first chunk with string dates. Chunks after
+    the first go to the process pool when more than one worker is configured.
+    Returns the totals and the rows skipped for unparseable dates, in file order.
     """
-    
-    # Group data by account code and date
-    account_data: Dict[str, Dict[str, Any]] = {}
-    
-    # Process holding data first (for portfolio values)
-    for row in holding_data:
-        try:
-            account_code = str(row.get("WS ACCOUNT CODE", "")).strip()
-            if not account_code:
-                continue
-                
-            holding_date = row.get("HOLDINGDATE")
-            mkt_value = row.get("MKTVALUE")
-            
-            # Parse and validate date
-            if not holding_date:
-                continue
-                
-            try:
-                # Handle various date formats
-                if isinstance(holding_date, str):
-                    date_obj = pd.to_datetime(holding_date, errors='coerce', dayfirst=True)
-                else:
-                    date_obj = pd.to_datetime(holding_date, errors='coerce')
-                    
-                if pd.isna(date_obj):
-                    logger.warning(f"Invalid holding date: {holding_date}")
-                    continue
-                    
-                date_key = date_obj.strftime("%Y-%m-%d")
-            except Exception as e:
-                logger.warning(f"Date parsing error for {holding_date}: {e}")
-                continue
-            
-            # Parse market value
-            try:
-                mkt_value = float(mkt_value or 0)
-            except (ValueError, TypeError):
-                logger.warning(f"Invalid MKTVALUE: {mkt_value}")
-                mkt_value = 0
-            
-            # Initialize account data structure
-            if account_code not in account_data:
-                account_data[account_code] = {
-                    "dates": {},
-                    "peak_portfolio_value": 0
-                }
-            
-            # Initialize date data
-            if date_key not in account_data[account_code]["dates"]:
-                account_data[account_code]["dates"][date_key] = {
-                    "portfolio_value": 0,
-                    "capital_flows": 0,  # Net capital in/out from transactions
-                }
-            
-            # Accumulate portfolio value for the date
-            account_data[account_code]["dates"][date_key]["portfolio_value"] += mkt_value
-            
-        except Exception as e:
-            logger.warning(f"Error processing holding row: {e}, row: {row}")
-            continue
-    
-    # Process transaction data (for capital flows)
-    for row in transaction_data:
-        try:
-            account_code = str(row.get("WS ACCOUNT CODE", "")).strip()
-            if not account_code:
-                continue
-                
-            tran_date = row.get("TRANDATE")
-            net_amount = row.get("NET AMOUNT")
-            
-            # Parse and validate date
-            if not tran_date:
-                continue
-                
-            try:
-                if isinstance(tran_date, str):
-                    date_obj = pd.to_datetime(tran_date, errors='coerce', dayfirst=True)
-                else:
-                    date_obj = pd.to_datetime(tran_date, errors='coerce')
-                    
-                if pd.isna(date_obj):
-                    logger.warning(f"Invalid transaction date: {tran_date}")
-                    continue
-                    
-                date_key = date_obj.strftime("%Y-%m-%d")
-            except Exception as e:
-                logger.warning(f"Date parsing error for {tran_date}: {e}")
-                continue
-            
-            # Parse net amount
-            try:
-                net_amount = float(net_amount or 0)
-            except (ValueError, TypeError):
-                logger.warning(f"Invalid NET AMOUNT: {net_amount}")
-                net_amount = 0
-            
-            # Initialize account data if not exists
-            if account_code not in account_data:
-                account_data[account_code] = {
-                    "dates": {},
-                    "peak_portfolio_value": 0
-                }
-            
-            # Initialize date data if not exists
-            if date_key not in account_data[account_code]["dates"]:
-                account_data[account_code]["dates"][date_key] = {
-                    "portfolio_value": 0,
-                    "capital_flows": 0,
-                }
-            
-            # Accumulate capital flows (positive for money in, negative for money out)
-            account_data[account_code]["dates"][date_key]["capital_flows"] += net_amount
-            
-        except Exception as e:
-            logger.warning(f"Error processing transaction row: {e}, row: {row}")
-            continue
-    
-    # Calculate metrics and generate result
-    result = []
-    
-    for account_code, data in account_data.items():
-        if not data["dates"]:
+    date_column, value_column, total_name, label = DAILY_TOTALS[table_name]
+    date_formats: Optional[Dict[str, Optional[str]]] = None
+    pool = _get_process_pool() if ConsolidationConfig.WORKERS > 1 else None
+    pending: List[Any] = []
+    partials: List[pd.Series] = []
+    failed_rows: List[Dict[str, Any]] = []
+
+    def collect(result: tuple[pd.Series, List[Dict[str, Any]]]) -> None:
+        partials.append(result[0])
+        failed_rows.extend(result[1])
+
+    for chunk in _iter_file_chunks(source, filename, table_name, REQUIRED_COLUMNS[table_name]):
+        chunk = chunk[["WS ACCOUNT CODE", date_column, value_column]]
+        if date_formats is None and (chunk[date_column].map(type) == str).any():
+            date_formats = {date_column: _column_date_format(chunk[date_column], date_column)}
+
+        if pool is None or not partials and not pending:
+            collect(_chunk_totals(chunk, table_name, date_formats))
             continue
-            
-        # Sort dates chronologically
-        sorted_dates = sorted(data["dates"].keys())
-        
-        # Calculate running metrics
-        previous_nav = 0
-        peak_portfolio_value = 0
-        
-        for date_key in sorted_dates:
-            date_data = data["dates"][date_key]
-            
-            portfolio_value = date_data["portfolio_value"]
-            capital_flows = date_data["capital_flows"]
-            
-            # NAV calculation: current portfolio value
-            nav = portfolio_value
-            
-            # PnL calculation: change in portfolio value minus capital flows
-            pnl = nav - previous_nav - capital_flows
-            
-            # Update peak for drawdown calculation
-            peak_portfolio_value = max(peak_portfolio_value, portfolio_value)
-            
-            # Drawdown calculation: percentage decline from peak
-            if peak_portfolio_value > 0:
-                drawdown = (peak_portfolio_value - portfolio_value) / peak_portfolio_value
-            else:
-                drawdown = 0
-            
-            result.append({
-                "account_code": account_code,
-                "portfolio_value": round(portfolio_value, 4),
-                "nav": round(nav, 4),
-                "pnl": round(pnl, 4),
-                "drawdown": round(drawdown * 100, 4),  # Convert to percentage
-                "date": date_key
-            })
-            
-            # Update previous NAV for next iteration
-            previous_nav = nav
-    
-    # Sort result by account code and date
-    result.sort(key=lambda x: (x["account_code"], x["date"]))
-    
-    return result
\ No newline at end of file
+
+        # Keep a bounded number of chunks in flight so memory stays flat
+        pending.append(pool.submit(_chunk_totals, chunk, table_name, date_formats))
+        if len(pending) >= 2 * ConsolidationConfig.WORKERS:
+            collect(pending.pop(0).result())
+
+    for future in pending:
+        collect(future.result())
+
+    if not partials:
+        totals = pd.Series([], name=total_name, dtype=float, index=pd.MultiIndex.from_arrays(
+            [pd.Index([], dtype=object), pd.DatetimeIndex([])], names=["account_code", "date"]
+        ))
+    else:
+        totals = pd.concat(partials).groupby(level=["account_code", "date"], sort=False).sum()
+    return totals, failed_rows
+
+def _chunk_totals(
+    chunk: pd.DataFrame,
+    table_name: str,
+    date_formats: Optional[Dict[str, Optional[str]]]
+) -> tuple[pd.Series, List[Dict[str, Any]]]:
+    """Worker entry point: daily totals and failed rows of one parsed chunk."""
+    date_column, value_column, total_name, label = DAILY_TOTALS[table_name]
+    failed_rows: List[Dict[str, Any]] = []
+    totals = _daily_totals(chunk, date_column, value_column, total_name, label, failed_rows, date_formats)
+    return totals, failed_rows
+
+# Candidate formats for custodian date columns. Day-first and month-first variants
+# are kept apart so an ambiguous sample (every day <= 12) can be detected.
+_DAY_FIRST_FORMATS = ["%d-%m-%Y", "%d/%m/%Y", "%d.%m.%Y", "%d-%m-%y", "%d/%m/%y"]
+_MONTH_FIRST_FORMATS = ["%m-%d-%Y", "%m/%d/%Y", "%m.%d.%Y", "%m-%d-%y", "%m/%d/%y"]
+_UNAMBIGUOUS_FORMATS = ["%Y-%m-%d", "%Y/%m/%d", "%d-%b-%Y", "%d %b %Y", "%d-%b-%y", "%d-%B-%Y", "%Y%m%d"]
+_TIME_SUFFIXES = ["", " %H:%M:%S", " %H:%M", "T%H:%M:%S"]
+DATE_SAMPLE_SIZE = 500
+
+def _infer_date_format(sample: pd.Series, column: str) -> Optional[str]:
+    """
+    Pick the format that parses the largest share of a sample of date strings.
+    When a day-first and a month-first format both parse the whole sample the
+    dates are ambiguous; day-first wins, matching custodian exports.
+    """
+    best_format, best_count = None, 0
+    full_matches = {"day_first": [], "month_first": []}
+
+    for family, bases in (
+        ("unambiguous", _UNAMBIGUOUS_FORMATS),
+        ("day_first", _DAY_FIRST_FORMATS),
+        ("month_first", _MONTH_FIRST_FORMATS),
+    ):
+        for base in bases:
+            for suffix in _TIME_SUFFIXES:
+                fmt = base + suffix
+                count = int(pd.to_datetime(sample, format=fmt, errors="coerce").notna().sum())
+                if count == len(sample) and family in full_matches:
+                    full_matches[family].append(fmt)
+                if count > best_count:
+                    best_format, best_count = fmt, count
+
+    if full_matches["day_first"] and full_matches["month_first"]:
+        logger.warning(
+            f"Ambiguous {column} values (day and month both <= 12 in sample); "
+            f"assuming day-first format {full_matches['day_first'][0]}"
+        )
+        return full_matches["day_first"][0]
+    return best_format
+
+def _column_date_format(values: pd.Series, column: str) -> Optional[str]:
+    """Infer the format of a date column's string cells from a sample of distinct values."""
+    strings = values[values.map(type) == str]
+    if strings.empty:
+        return None
+    sample = pd.Series(strings.unique()[:DATE_SAMPLE_SIZE])
+    fmt = _infer_date_format(sample, column)
+    logger.debug(f"Inferred {column} format: {fmt}")
+    return fmt
+
+def _parse_dates(
+    values: pd.Series,
+    column: str,
+    date_formats: Optional[Dict[str, Optional[str]]] = None
+) -> pd.Series:
+    """
+    Parse a whole date column at once: native datetimes (Excel) as-is, strings with
+    a format inferred from a sample (or taken from date_formats), and any leftovers
+    with a day-first fallback.
+    """
+    is_str = values.map(type) == str
+    parsed = pd.Series(pd.NaT, index=values.index, dtype="datetime64[ns]")
+
+    if (~is_str).any():
+        parsed[~is_str] = pd.to_datetime(values[~is_str], errors="coerce")
+
+    if is_str.any():
+        strings = values[is_str]
+        if date_formats is not None and column in date_formats:
+            fmt = date_formats[column]
+        else:
+            fmt = _column_date_format(strings, column)
+
+        string_dates = (
+            pd.to_datetime(strings, format=fmt, errors="coerce")
+            if fmt else pd.Series(pd.NaT, index=strings.index, dtype="datetime64[ns]")
+        )
+        leftover = string_dates.isna() & (strings != "")
+        if leftover.any():
+            string_dates[leftover] = pd.to_datetime(
+                strings[leftover], errors="coerce", dayfirst=True, format="mixed"
+            )
+        parsed[is_str] = string_dates
+
+    return parsed
+
+def _daily_totals(
+    df: pd.DataFrame,
+    date_column: str,
+    value_column: str,
+    total_name: str,
+    label: str,
+    failed_rows: List[Dict[str, Any]],
+    date_formats: Optional[Dict[str, Optional[str]]] = None
+) -> pd.Series:
+    """
+    Sum value_column per (account_code, day), skipping rows without an account or a
+    valid date. Rows whose date cannot be parsed are appended to failed_rows.
+    """
+    df = df[df["WS ACCOUNT CODE"].notna()]
+    frame = pd.DataFrame({
+        "account_code": df["WS ACCOUNT CODE"].astype(str).str.strip(),
+        "date": _parse_dates(df[date_column], date_column, date_formats).dt.normalize(),
+        total_name: pd.to_numeric(df[value_column], errors="coerce"),
+    })
+
+    invalid_dates = frame["date"].isna() & df[date_column].notna() & (df[date_column].astype(str) != "")
+    if invalid_dates.any():
+        bad = df.loc[invalid_dates, ["WS ACCOUNT CODE", date_column]]
+        failed_rows.extend(
+            {
+                "row_index": int(idx) + 2,  # +2 because pandas is 0-indexed and we have header
+                "error": f"Unparseable {date_column} in {label} data",
+                "row": {"WS ACCOUNT CODE": account, date_column: value},
+            }
+            for idx, account, value in zip(bad.index, bad["WS ACCOUNT CODE"], bad[date_column])
+        )
+
+    frame[total_name] = frame[total_name].fillna(0.0)
+    frame = frame[(frame["account_code"] != "") & frame["date"].notna()]
+    return frame.groupby(["account_code", "date"], sort=False)[total_name].sum()
+
+def _metrics_from_totals(
+    portfolio_value: pd.Series,
+    capital_flows: pd.Series,
+    initial_state: Optional[pd.DataFrame] = None
+) -> pd.DataFrame:
+    """
+    Consolidated rows from daily portfolio_value and capital_flows totals per
+    (account_code, date): the totals are outer-joined, then nav, pnl and the
+    running-peak drawdown are computed with shift/cummax within each account.
+    Rows are ordered by (account_code, date).
+
+    initial_state (indexed by account_code with last_date, last_nav and
+    peak_portfolio_value) continues each account's series from a previous run:
+    days up to last_date are dropped, and previous nav and the running peak start
+    from the stored values instead of 0.
+    """
+    daily = pd.concat([portfolio_value, capital_flows], axis=1).fillna(0.0).sort_index()
+
+    accounts = daily.index.get_level_values("account_code")
+    seed_nav = pd.Series(0.0, index=daily.index)
+    seed_peak = pd.Series(0.0, index=daily.index)
+    if initial_state is not None and not initial_state.empty and not daily.empty:
+        state = initial_state.reindex(accounts)
+        already_done = daily.index.get_level_values("date") <= state["last_date"].to_numpy()
+        if already_done.any():
+            logger.warning(f"Skipping {int(already_done.sum())} account-days already covered by the stored state")
+        seed_nav = pd.Series(state["last_nav"].fillna(0.0).to_numpy(), index=daily.index)[~already_done]
+        seed_peak = pd.Series(state["peak_portfolio_value"].fillna(0.0).to_numpy(), index=daily.index)[~already_done]
+        daily = daily[~already_done]
+
+    if daily.empty:
+        return pd.DataFrame(columns=CONSOLIDATED_COLUMNS)
+
+    by_account = daily.groupby(level="account_code", sort=False)["portfolio_value"]
+
+    # NAV calculation: current portfolio value
+    nav = daily["portfolio_value"]
+
+    # PnL calculation: change in portfolio value minus capital flows
+    previous_nav = by_account.shift(1).fillna(seed_nav)
+    pnl = nav - previous_nav - daily["capital_flows"]
+
+    # Drawdown calculation: percentage decline from the running peak (which starts at 0)
+    peak_portfolio_value = by_account.cummax().clip(lower=seed_peak)
+    drawdown = ((peak_portfolio_value - nav) / peak_portfolio_value).where(peak_portfolio_value > 0, 0.0)
+
+    return pd.DataFrame({
+        "account_code": daily.index.get_level_values("account_code"),
+        "portfolio_value": nav.round(4).to_numpy(),
+        "nav": nav.round(4).to_numpy(),
+        "pnl": pnl.round(4).to_numpy(),
+        "drawdown": (drawdown * 100).round(4).to_numpy(),  # Convert to percentage
+        "date": daily.index.get_level_values("date").strftime("%Y-%m-%d"),
+    })
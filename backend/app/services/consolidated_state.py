@@ -0,0 +1,71 @@
+from prisma import Prisma
+from prisma.errors import PrismaError
+import logging
+from typing import List, Optional
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+STATE_COLUMNS = ["last_date", "last_nav", "peak_portfolio_value"]
+
+async def load_account_state(db: Prisma, account_codes: List[str]) -> pd.DataFrame:
+    """
+    Load the persisted running state of the given accounts, indexed by account_code.
+    Accounts without stored state are simply absent.
+    """
+    rows = await db.query_raw(
+        """
+        SELECT account_code, last_date, last_nav, peak_portfolio_value
+        FROM consolidated_account_state
+        WHERE account_code = ANY($1::text[])
+        """,
+        account_codes,
+    )
+    state = pd.DataFrame(rows, columns=["account_code"] + STATE_COLUMNS).set_index("account_code")
+    state["last_date"] = pd.to_datetime(state["last_date"].astype(str).str[:10], errors="coerce")
+    state["last_nav"] = pd.to_numeric(state["last_nav"], errors="coerce").astype(float)
+    state["peak_portfolio_value"] = pd.to_numeric(state["peak_portfolio_value"], errors="coerce").astype(float)
+    logger.info(f"Loaded consolidated state for {len(state)} of {len(account_codes)} accounts")
+    return state
+
+def build_account_state(result: pd.DataFrame, initial_state: Optional[pd.DataFrame] = None) -> pd.DataFrame:
+    """Derive each account's new running state from a consolidated result sorted by (account_code, date)."""
+    grouped = result.groupby("account_code", sort=False)
+    state = pd.DataFrame({
+        "last_date": grouped["date"].last(),
+        "last_nav": grouped["nav"].last(),
+        "peak_portfolio_value": grouped["portfolio_value"].max().clip(lower=0),
+    })
+    if initial_state is not None and not initial_state.empty:
+        previous_peak = initial_state["peak_portfolio_value"].reindex(state.index).fillna(0.0)
+        state["peak_portfolio_value"] = state["peak_portfolio_value"].combine(previous_peak, max)
+    return state
+
+async def save_account_state(db: Prisma, state: pd.DataFrame) -> int:
+    """Upsert the running state per account in one statement; older states never overwrite newer ones."""
+    if state.empty:
+        return 0
+    try:
+        updated = await db.execute_raw(
+            """
+            INSERT INTO consolidated_account_state (account_code, last_date, last_nav, peak_portfolio_value, updated_at)
+            SELECT account_code, last_date, last_nav, peak_portfolio_value, NOW()
+            FROM unnest($1::text[], $2::date[], $3::numeric[], $4::numeric[])
+                AS s(account_code, last_date, last_nav, peak_portfolio_value)
+            ON CONFLICT (account_code) DO UPDATE SET
+                last_date = EXCLUDED.last_date,
+                last_nav = EXCLUDED.last_nav,
+                peak_portfolio_value = EXCLUDED.peak_portfolio_value,
+                updated_at = EXCLUDED.updated_at
+            WHERE consolidated_account_state.last_date < EXCLUDED.last_date
+            """,
+            state.index.tolist(),
+            [str(d)[:10] for d in state["last_date"]],
+            state["last_nav"].astype(float).tolist(),
+            state["peak_portfolio_value"].astype(float).tolist(),
+        )
+        logger.info(f"Saved consolidated state for {updated} accounts")
+        return updated
+    except PrismaError as e:
+        logger.error(f"Error saving consolidated account state: {str(e)}")
+        raise
@@ -3,8 +3,12 @@ from io import StringIO
 from typing import List, Dict, Any, Optional
 from datetime import datetime
 import re
+import time
 import logging
-from app.config.constants import TABLE_COLUMNS, COLUMN_ALIASES, SHARED_TABLE_CONFIGS
+from app.config.constants import TABLE_COLUMNS, COLUMN_ALIASES, SHARED_TABLE_CONFIGS, TABLE_CONFIG_ALIASES, DERIVED_COLUMNS
+from app.services.progress import UploadProgress, ProgressConfig
+from app.config.logging_config import RowLogSampler
+from app.services.metrics import INGEST_ROWS, observe_stage, record_stage, record_throughput
 from decimal import Decimal, InvalidOperation
 
 logger = logging.getLogger(__name__)
@@ -36,6 +40,7 @@ def process_csv(
     table_name: str,
     start_date: Optional[str],
     end_date: Optional[str],
+    progress: Optional[UploadProgress] = None,
 ) -> tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
     data: List[Dict[str, Any]] = []
     failed_rows: List[Dict[str, Any]] = []
@@ -43,17 +48,21 @@ def process_csv(
     required_columns = TABLE_COLUMNS.get(table_name, [])
     column_aliases = COLUMN_ALIASES.get(table_name, {})
 
-    csv_text = _decode_csv(content)
-    logger.debug(f"First 100 bytes of CSV content: {csv_text[:100]}")
+    with observe_stage("decode", table_name):
+        csv_text = _decode_csv(content)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("First 100 bytes of CSV content: %s", csv_text[:100])
 
     # Delimiter detection (whitelisted)
     sample = csv_text[:2048]
-    delim = _sniff_delimiter(sample)
-    logger.debug(f"Detected delimiter: {repr(delim)}")
+    with observe_stage("sniff", table_name):
+        delim = _sniff_delimiter(sample)
+    logger.debug("Detected delimiter: %r", delim)
 
     def _make_reader(text: str, delimiter: str) -> csv.DictReader:
         return csv.DictReader(StringIO(text), delimiter=delimiter)
 
+    mapping_started_at = time.perf_counter()
     reader = _make_reader(csv_text, delim)
 
     if not reader.fieldnames:
@@ -92,7 +101,7 @@ def process_csv(
             header_mapping[csv_header] = csv_header  # keep original
 
     normalized_fieldnames = [header_mapping.get(h, h) for h in csv_headers_raw]
-    logger.debug(f"Normalized CSV fieldnames: {normalized_fieldnames}")
+    logger.debug("Normalized CSV fieldnames: %s", normalized_fieldnames)
 
     # Some tables: Status and/or Date optional
     effective_required = required_columns.copy()
@@ -116,6 +125,9 @@ def process_csv(
     if table_name == "mutual_fund_holding_sheet_test" and "Scheme Code" in effective_required:
         effective_required.remove("Scheme Code")
 
+    # Derived columns (e.g. master sheet prev_*/drawdown) are recomputed after insert
+    effective_required = [c for c in effective_required if c not in DERIVED_COLUMNS.get(table_name, [])]
+
     # If required columns missing, try a safer re-parse with comma (common Excel)
     if not all(col in normalized_fieldnames for col in effective_required):
         missing_once = [c for c in effective_required if c not in normalized_fieldnames]
@@ -128,7 +140,7 @@ def process_csv(
             csv_headers_raw = [h.strip().replace("\ufeff", "") for h in reader.fieldnames]
             header_mapping = {h: next((c for c in required_columns if c.lower() == h.lower()), h) for h in csv_headers_raw}
             normalized_fieldnames = [header_mapping.get(h, h) for h in csv_headers_raw]
-            logger.debug(f"Normalized (retry) CSV fieldnames: {normalized_fieldnames}")
+            logger.debug("Normalized (retry) CSV fieldnames: %s", normalized_fieldnames)
 
     # Final required check
     if not all(col in normalized_fieldnames for col in effective_required):
@@ -140,6 +152,8 @@ def process_csv(
             f"\nDetected columns: {normalized_fieldnames}"
         )
 
+    record_stage("header_mapping", table_name, time.perf_counter() - mapping_started_at)
+
     # Date field (display label) - Skip for equity_holding and equity_holding_test as date is set programmatically
     if table_name not in ("equity_holding", "equity_holding_test"):
         date_field = SHARED_TABLE_CONFIGS[table_name].get("dateField", "Date")
@@ -180,11 +194,15 @@ def process_csv(
             "Quantity", "Avg Price", "NAV", "Buy Value", "Value as of Today", "PNL Amount"
         ],
         "capital_in_out": ["Capital In/Out"],
-    }.get(table_name, [])
+    }.get(TABLE_CONFIG_ALIASES.get(table_name, table_name), [])
 
     # Iterate rows
+    validation_started_at = time.perf_counter()
+    row_log = RowLogSampler(logger, logging.ERROR)
     row_iter = _make_reader(csv_text, delim) if isinstance(reader, csv.DictReader) and reader.fieldnames is None else reader
     for row_num, row in enumerate(row_iter, start=2):  # header is row 1
+        if progress and row_num % ProgressConfig.ROW_STEP == 0:
+            progress.parsed(len(data), len(failed_rows))
         try:
             # Normalize column names to your displayNames
             normalized_row = {
@@ -247,11 +265,20 @@ def process_csv(
             data.append(normalized_row)
 
         except Exception as e:
-            logger.error(f"Error processing row {row_num}: {str(e)}, row={row}")
+            row_log.log("Error processing row %d: %s, row=%s", row_num, e, row)
             failed_rows.append({
                 "row_index": row_num,
                 "error": str(e),
                 "row": row,
             })
 
+    row_log.summary("Rows failed validation for %s", table_name)
+    validation_seconds = time.perf_counter() - validation_started_at
+    record_stage("validation", table_name, validation_seconds)
+    record_throughput("validation", table_name, len(data) + len(failed_rows), validation_seconds)
+    INGEST_ROWS.labels(table_name, "parsed").inc(len(data))
+    INGEST_ROWS.labels(table_name, "rejected").inc(len(failed_rows))
+
+    if progress:
+        progress.parsed(len(data), len(failed_rows))
     return data, failed_rows
\ No newline at end of file
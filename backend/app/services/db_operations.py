@@ -1,5 +1,20 @@
 from prisma import Prisma
 from app.models.schemas import MasterSheet
+from app.services.master_sheet_series import recompute_master_sheet_series
+from app.services.rollups import ROLLUP_TABLES, refresh_rollups
+from app.services.progress import UploadProgress
+from app.config.logging_config import RowLogSampler
+from app.services.admission import get_admission_controller
+from app.services.write_locks import WriteLockTimeout, write_lock
+from app.services.metrics import (
+    BATCH_FALLBACKS,
+    BATCH_INSERT_SECONDS,
+    BATCH_RETRIES,
+    INGEST_ROWS,
+    observe_stage,
+    record_stage,
+    record_throughput,
+)
 import logging
 from typing import List, Dict, Any, Tuple, Optional
 from prisma.errors import PrismaError
@@ -7,6 +22,7 @@ from datetime import datetime, date, timezone
 from decimal import Decimal, InvalidOperation
 from pydantic import ValidationError as PydanticValidationError
 import asyncio
+import time
 from contextlib import asynccontextmanager
 
 # NEW: timezone support for "today" in Asia/Kolkata
@@ -91,7 +107,7 @@ def serialize_date(value: Any) -> Optional[str]:
 
         return value.isoformat()
     except (ValueError, TypeError) as e:
-        logger.warning(f"Failed to serialize date value {value}: {e}")
+        logger.warning("Failed to serialize date value %s: %s", value, e)
         return None
 
 def safe_decimal(value: Any, field_name: str, row_index: int) -> Optional[Decimal]:
@@ -407,30 +423,35 @@ async def process_batch_with_retry(
     failed_rows: List[Dict[str, Any]] = []
 
     for attempt in range(max_retries):
+        started_at = time.perf_counter()
         try:
             await getattr(db, table_name).create_many(data=batch_data, skip_duplicates=True)
             success_count = len(batch_data)
             break
         except PrismaError as e:
             if attempt < max_retries - 1:
+                BATCH_RETRIES.labels(table_name).inc()
                 logger.warning(
-                    f"Batch insert failed for {table_name} batch {batch_number}, attempt {attempt + 1}: {str(e)}. Retrying..."
+                    "Batch insert failed for %s batch %d, attempt %d: %s. Retrying...",
+                    table_name, batch_number, attempt + 1, e,
                 )
                 await asyncio.sleep(DatabaseConfig.RETRY_DELAY * (attempt + 1))
                 continue
 
             # Final attempt failed, try individual inserts
+            BATCH_FALLBACKS.labels(table_name).inc()
             logger.warning(
-                f"Batch insert failed for {table_name} batch {batch_number}: {str(e)}. Trying individual inserts."
+                "Batch insert failed for %s batch %d: %s. Trying individual inserts.", table_name, batch_number, e
             )
 
+            row_log = RowLogSampler(logger)
             for j, item in enumerate(batch_data):
                 try:
                     await getattr(db, table_name).create(data=item)
                     success_count += 1
                 except Exception as individual_error:
-                    logger.warning(
-                        f"Individual insert failed for item {j + 1} in batch {batch_number}: {str(individual_error)}"
+                    row_log.log(
+                        "Individual insert failed for item %d in batch %d: %s", j + 1, batch_number, individual_error
                     )
                     failed_rows.append(
                         {
@@ -439,7 +460,10 @@ async def process_batch_with_retry(
                             "error": str(individual_error),
                         }
                     )
+            row_log.summary("Individual inserts failed in %s batch %d", table_name, batch_number)
             break
+        finally:
+            BATCH_INSERT_SECONDS.labels(table_name).observe(time.perf_counter() - started_at)
 
     return success_count, failed_rows
 
@@ -449,9 +473,13 @@ async def insert_data(
     table_name: str,
     qcode: str,
     batch_size: Optional[int] = None,
+    progress: Optional[UploadProgress] = None,
+    recompute_from: Optional[str] = None,
 ) -> Tuple[int, List[Dict[str, Any]]]:
     """
     Generic function to insert data into a specified table with batch processing and validation.
+    When progress is given, it is advanced once per batch. recompute_from (YYYY-MM-DD)
+    moves the master sheet series recompute back to cover rows the caller deleted.
     """
     if not data:
         logger.info("No data provided for insertion")
@@ -464,27 +492,41 @@ async def insert_data(
     account = await validate_qcode(db, qcode)
 
     batch_size = batch_size or DatabaseConfig.BATCH_SIZE
+    batches = (len(data) + batch_size - 1) // batch_size
     success_count = 0
     failed_rows: List[Dict[str, Any]] = []
+    date_field = DATE_FIELD_MAPPING.get(table_name, "date")
+    touched_dates: set = set()
 
     # Log initial state
     initial_count = await get_table_count(db, table_name, qcode)
     logger.info(f"Starting insert operation - {table_name}: {initial_count} existing records")
+    if progress:
+        progress.batches_total = batches
+        progress.set_stage("inserting")
 
-    async with database_transaction(db):
+    insert_started_at = time.perf_counter()
+    serialization_seconds = 0.0
+    row_log = RowLogSampler(logger)
+
+    # Serialize with other writers of this qcode; other accounts keep inserting in parallel
+    async with write_lock(db, table_name, qcode, batches=batches), database_transaction(db):
         # Process data in batches
         for i in range(0, len(data), batch_size):
             batch = data[i : i + batch_size]
             batch_data: List[Dict[str, Any]] = []
             batch_number = i // batch_size + 1
+            serialization_started_at = time.perf_counter()
 
             # Validate and serialize each item in the batch
             for index, item in enumerate(batch, start=i + 1):
                 try:
                     serialized_item = serialize_table_item(item, table_name, qcode, account, index)
                     batch_data.append(serialized_item)
+                    if serialized_item.get(date_field):
+                        touched_dates.add(serialized_item[date_field][:10])
                 except (DataValidationError, ValueError) as e:
-                    logger.warning(f"Validation failed for row {index} in {table_name}: {str(e)}")
+                    row_log.log("Validation failed for row %d in %s: %s", index, table_name, e)
                     failed_rows.append(
                         {
                             "row_index": index,
@@ -494,7 +536,7 @@ async def insert_data(
                     )
                     continue
                 except Exception as e:
-                    logger.error(f"Unexpected error for row {index} in {table_name}: {str(e)}")
+                    logger.error("Unexpected error for row %d in %s: %s", index, table_name, e)
                     failed_rows.append(
                         {
                             "row_index": index,
@@ -504,14 +546,41 @@ async def insert_data(
                     )
                     continue
 
+            serialization_seconds += time.perf_counter() - serialization_started_at
+
             # Insert batch if there's valid data
+            batch_success, batch_failed = 0, []
             if batch_data:
-                logger.debug(f"Processing batch {batch_number} with {len(batch_data)} rows for {table_name}")
-                batch_success, batch_failed = await process_batch_with_retry(
-                    db, table_name, batch_data, batch_number
-                )
+                logger.debug("Processing batch %d with %d rows for %s", batch_number, len(batch_data), table_name)
+                # Writer slots are shared by all ingests so concurrent uploads cannot flood the pool
+                async with get_admission_controller().db_writer():
+                    batch_success, batch_failed = await process_batch_with_retry(
+                        db, table_name, batch_data, batch_number
+                    )
                 success_count += batch_success
                 failed_rows.extend(batch_failed)
+            if progress:
+                progress.batch_inserted(batch_success, len(batch) - len(batch_data) + len(batch_failed))
+
+        if progress and touched_dates:
+            progress.set_stage("finalizing")
+
+        row_log.summary("Rows failed serialization for %s", table_name)
+        record_stage("serialization", table_name, serialization_seconds)
+        record_stage("insert", table_name, time.perf_counter() - insert_started_at)
+        record_throughput("insert", table_name, success_count, time.perf_counter() - insert_started_at)
+        INGEST_ROWS.labels(table_name, "inserted").inc(success_count)
+        INGEST_ROWS.labels(table_name, "failed").inc(len(failed_rows))
+
+        with observe_stage("finalize", table_name):
+            # Derived master sheet columns only need the suffix from the earliest touched date
+            recompute_dates = touched_dates | ({recompute_from} if recompute_from else set())
+            if table_name == "master_sheet_test" and recompute_dates:
+                await recompute_master_sheet_series(db, qcode, min(recompute_dates))
+
+            # Refresh only the rollup buckets this upload touched
+            if table_name in ROLLUP_TABLES and touched_dates:
+                await refresh_rollups(db, table_name, qcode, dates=touched_dates)
 
     # Log final state
     final_count = await get_table_count(db, table_name, qcode)
@@ -544,10 +613,17 @@ async def delete_data(db: Prisma, qcode: str, start_date: str, end_date: str, ta
             f'DELETE FROM "{table_name}" WHERE qcode = $1 AND {date_field} >= $2::date AND {date_field} <= $3::date'
         )
 
-        result = await db.execute_raw(delete_query, qcode, start_date, end_date)
-        logger.info(
-            f"Deleted {result} records from {table_name} for qcode {qcode} between {start_date} and {end_date}"
-        )
+        async with write_lock(db, table_name, qcode):
+            result = await db.execute_raw(delete_query, qcode, start_date, end_date)
+            logger.info(
+                f"Deleted {result} records from {table_name} for qcode {qcode} between {start_date} and {end_date}"
+            )
+
+            if table_name == "master_sheet_test" and result:
+                await recompute_master_sheet_series(db, qcode, start_date)
+            if table_name in ROLLUP_TABLES and result:
+                await refresh_rollups(db, table_name, qcode, start_date=start_date, end_date=end_date)
+
         return result
 
     except PrismaError as e:
@@ -560,6 +636,7 @@ async def replace_data(
     table_name: str,
     qcode: str,
     batch_size: Optional[int] = None,
+    progress: Optional[UploadProgress] = None,
 ) -> Tuple[int, List[Dict[str, Any]]]:
     """
     Replace all records in the specified table for the qcode with new data.
@@ -571,20 +648,29 @@ async def replace_data(
     await validate_qcode(db, qcode)
 
     try:
-        async with database_transaction(db):
+        # The nested insert_data runs under the same lock, so no other write can land in between
+        batch_size = batch_size or DatabaseConfig.BATCH_SIZE
+        batches = (len(data) + batch_size - 1) // batch_size
+        async with write_lock(db, table_name, qcode, batches=batches), database_transaction(db):
             # Delete all existing records for the qcode
             delete_query = f'DELETE FROM "{table_name}" WHERE qcode = $1'
             deleted_count = await db.execute_raw(delete_query, qcode)
             logger.info(f"Deleted {deleted_count} existing records from {table_name} for qcode {qcode}")
 
             # Insert new data
-            success_count, failed_rows = await insert_data(db, data, table_name, qcode, batch_size)
+            success_count, failed_rows = await insert_data(db, data, table_name, qcode, batch_size, progress)
+
+            # Buckets that only existed in the deleted data must be dropped as well
+            if table_name in ROLLUP_TABLES:
+                await refresh_rollups(db, table_name, qcode)
             logger.info(
                 f"Replaced data in {table_name} for qcode {qcode}: {success_count} inserted, {len(failed_rows)} failed"
             )
 
             return success_count, failed_rows
 
+    except WriteLockTimeout:
+        raise
     except Exception as e:
         logger.error(f"Error replacing records in {table_name}: {str(e)}")
         raise DatabaseOperationError(f"Failed to replace records: {str(e)}")
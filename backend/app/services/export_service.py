@@ -0,0 +1,221 @@
+from prisma import Prisma
+import asyncio
+import logging
+from typing import List, Dict, Any, Optional, AsyncIterator, Tuple
+from datetime import datetime, date
+from decimal import Decimal
+from io import BytesIO
+from app.services.db_operations import DATE_FIELD_MAPPING, DatabaseOperationError
+
+logger = logging.getLogger(__name__)
+
+class ExportConfig:
+    BATCH_SIZE = 50_000
+    PARQUET_COMPRESSION = "zstd"
+
+# Column layout per exportable table: (column, kind, precision, scale).
+# Decimal precision/scale mirror the Prisma schema so values round-trip exactly.
+EXPORT_COLUMNS: Dict[str, List[Tuple[str, str, Optional[int], Optional[int]]]] = {
+    "master_sheet_test": [
+        ("id", "int", None, None),
+        ("qcode", "string", None, None),
+        ("date", "date", None, None),
+        ("portfolio_value", "decimal", 20, 4),
+        ("capital_in_out", "decimal", 20, 4),
+        ("nav", "decimal", 20, 4),
+        ("prev_nav", "decimal", 20, 4),
+        ("pnl", "decimal", 20, 4),
+        ("daily_p_l", "decimal", 20, 4),
+        ("exposure_value", "decimal", 20, 4),
+        ("prev_portfolio_value", "decimal", 20, 4),
+        ("prev_exposure_value", "decimal", 20, 4),
+        ("prev_pnl", "decimal", 20, 4),
+        ("drawdown", "decimal", 20, 4),
+        ("system_tag", "string", None, None),
+    ],
+    "tradebook": [
+        ("id", "int", None, None),
+        ("qcode", "string", None, None),
+        ("timestamp_entry", "timestamp", None, None),
+        ("system_tag_entry", "string", None, None),
+        ("action_entry", "string", None, None),
+        ("symbol_entry", "string", None, None),
+        ("price_entry", "decimal", 15, 2),
+        ("qty_entry", "int", None, None),
+        ("contract_value_entry", "decimal", 15, 2),
+        ("timestamp_exit", "timestamp", None, None),
+        ("system_tag_exit", "string", None, None),
+        ("action_exit", "string", None, None),
+        ("symbol_exit", "string", None, None),
+        ("price_exit", "decimal", 15, 2),
+        ("qty_exit", "int", None, None),
+        ("contract_value_exit", "decimal", 15, 2),
+        ("pnl_amount", "decimal", 15, 2),
+        ("pnl_amount_settlement", "decimal", 15, 2),
+        ("status", "string", None, None),
+    ],
+}
+
+EXPORT_FORMATS = {"parquet", "arrow"}
+
+def _import_pyarrow():
+    """Import pyarrow lazily so the rest of the API does not pay for it."""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:  # pragma: no cover
+        raise DatabaseOperationError(f"Columnar export requires pyarrow: {e}")
+    return pa, pq
+
+def build_arrow_schema(table_name: str):
+    """Build the typed Arrow schema for an exportable table."""
+    pa, _ = _import_pyarrow()
+    fields = []
+    for column, kind, precision, scale in EXPORT_COLUMNS[table_name]:
+        if kind == "decimal":
+            arrow_type = pa.decimal128(precision, scale)
+        elif kind == "int":
+            arrow_type = pa.int64()
+        elif kind == "date":
+            arrow_type = pa.date32()
+        elif kind == "timestamp":
+            arrow_type = pa.timestamp("us")
+        else:
+            arrow_type = pa.string()
+        fields.append(pa.field(column, arrow_type))
+    return pa.schema(fields)
+
+def _to_decimal(value: Any, scale: int) -> Optional[Decimal]:
+    if value is None:
+        return None
+    return Decimal(str(value)).quantize(Decimal(1).scaleb(-scale))
+
+def _to_date(value: Any) -> Optional[date]:
+    if value is None or (isinstance(value, date) and not isinstance(value, datetime)):
+        return value
+    if isinstance(value, datetime):
+        return value.date()
+    return date.fromisoformat(str(value)[:10])
+
+def _to_timestamp(value: Any) -> Optional[datetime]:
+    if value is None:
+        return None
+    if not isinstance(value, datetime):
+        value = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    # Timestamp(6) columns are stored without a zone
+    return value.replace(tzinfo=None)
+
+def rows_to_record_batch(rows: List[Dict[str, Any]], table_name: str, schema):
+    """Convert one page of raw query rows into a typed Arrow record batch."""
+    pa, _ = _import_pyarrow()
+    arrays = []
+    for column, kind, _precision, scale in EXPORT_COLUMNS[table_name]:
+        values = [row.get(column) for row in rows]
+        if kind == "decimal":
+            values = [_to_decimal(v, scale) for v in values]
+        elif kind == "date":
+            values = [_to_date(v) for v in values]
+        elif kind == "timestamp":
+            values = [_to_timestamp(v) for v in values]
+        elif kind == "int":
+            values = [int(v) if v is not None else None for v in values]
+        arrays.append(pa.array(values, type=schema.field(column).type))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+def _write_page(writer, rows: List[Dict[str, Any]], table_name: str, schema) -> None:
+    writer.write_batch(rows_to_record_batch(rows, table_name, schema))
+
+async def iter_export_pages(
+    db: Prisma,
+    table_name: str,
+    qcodes: List[str],
+    start_date: Optional[str],
+    end_date: Optional[str],
+    batch_size: Optional[int] = None,
+) -> AsyncIterator[List[Dict[str, Any]]]:
+    """
+    Page through a table with keyset pagination on id, one DB round trip per page.
+    """
+    if table_name not in EXPORT_COLUMNS:
+        raise DatabaseOperationError(f"Table {table_name} does not support columnar export")
+
+    batch_size = batch_size or ExportConfig.BATCH_SIZE
+    date_field = DATE_FIELD_MAPPING.get(table_name, "date")
+    columns = ", ".join(f'"{column}"' for column, *_ in EXPORT_COLUMNS[table_name])
+    query = (
+        f'SELECT {columns} FROM "{table_name}" '
+        f"WHERE qcode = ANY($1::text[]) "
+        f"AND ($2::date IS NULL OR {date_field} >= $2::date) "
+        f"AND ($3::date IS NULL OR {date_field} < $3::date + 1) "
+        f"AND id > $4 ORDER BY id LIMIT $5"
+    )
+
+    last_id = 0
+    while True:
+        rows = await db.query_raw(query, qcodes, start_date, end_date, last_id, batch_size)
+        if not rows:
+            break
+        yield rows
+        if len(rows) < batch_size:
+            break
+        last_id = rows[-1]["id"]
+
+async def write_parquet(
+    db: Prisma,
+    table_name: str,
+    qcodes: List[str],
+    start_date: Optional[str],
+    end_date: Optional[str],
+    path: str,
+) -> int:
+    """
+    Write the selected rows to a compressed Parquet file, one row group per page.
+    Converting, compressing and writing each page runs in a worker thread so
+    the event loop keeps serving requests during a large export.
+    """
+    _, pq = _import_pyarrow()
+    schema = build_arrow_schema(table_name)
+    row_count = 0
+
+    writer = await asyncio.to_thread(
+        pq.ParquetWriter, path, schema, compression=ExportConfig.PARQUET_COMPRESSION
+    )
+    try:
+        async for rows in iter_export_pages(db, table_name, qcodes, start_date, end_date):
+            await asyncio.to_thread(_write_page, writer, rows, table_name, schema)
+            row_count += len(rows)
+    finally:
+        # Closing writes the footer
+        await asyncio.to_thread(writer.close)
+
+    logger.info(f"Exported {row_count} rows from {table_name} to Parquet for {len(qcodes)} qcode(s)")
+    return row_count
+
+async def stream_arrow_ipc(
+    db: Prisma,
+    table_name: str,
+    qcodes: List[str],
+    start_date: Optional[str],
+    end_date: Optional[str],
+) -> AsyncIterator[bytes]:
+    """Yield an Arrow IPC stream, flushing the encoded bytes after every page."""
+    pa, _ = _import_pyarrow()
+    schema = build_arrow_schema(table_name)
+    sink = BytesIO()
+    row_count = 0
+
+    def drain() -> bytes:
+        chunk = sink.getvalue()
+        sink.seek(0)
+        sink.truncate()
+        return chunk
+
+    with pa.ipc.new_stream(sink, schema) as writer:
+        async for rows in iter_export_pages(db, table_name, qcodes, start_date, end_date):
+            await asyncio.to_thread(_write_page, writer, rows, table_name, schema)
+            row_count += len(rows)
+            yield drain()
+    # Closing the writer appends the end-of-stream marker
+    yield drain()
+
+    logger.info(f"Streamed {row_count} rows from {table_name} as Arrow IPC for {len(qcodes)} qcode(s)")
@@ -0,0 +1,215 @@
+import asyncio
+import logging
+import math
+import os
+import shutil
+import tempfile
+import time
+import traceback
+import uuid
+from collections import deque
+from typing import Any, Awaitable, BinaryIO, Callable, Deque, Dict, List, Optional
+from app.services.admission import AdmissionConfig, AdmissionRejected
+from app.services.progress import UploadProgress
+
+logger = logging.getLogger(__name__)
+
+class JobQueueConfig:
+    WORKERS = int(os.getenv("UPLOAD_JOB_WORKERS", "2"))
+    SPOOL_DIR = os.getenv("UPLOAD_JOB_SPOOL_DIR", os.path.join(tempfile.gettempdir(), "upload_jobs"))
+    # Finished jobs are kept this long for status polling, then forgotten
+    RETENTION_SECONDS = int(os.getenv("UPLOAD_JOB_RETENTION_SECONDS", "3600"))
+    # Jobs waiting for a worker before submissions are rejected; each holds a spooled upload on disk
+    MAX_QUEUED = int(os.getenv("UPLOAD_JOB_MAX_QUEUED", "32"))
+    # Recent job durations kept for the Retry-After estimate
+    DURATION_SAMPLES = 50
+
+class JobState:
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+
+JobHandler = Callable[["Job"], Awaitable[Dict[str, Any]]]
+
+class Job:
+    """An enqueued upload: the spooled files, the handler that processes them and its outcome."""
+
+    def __init__(
+        self,
+        kind: str,
+        handler: JobHandler,
+        spool_paths: Dict[str, str],
+        size: int,
+        params: Dict[str, Any],
+        progress: Optional[UploadProgress] = None,
+    ):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.handler = handler
+        self.spool_paths = spool_paths
+        self.size = size
+        self.params = params
+        self.progress = progress
+        self.state = JobState.QUEUED
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+
+    def read_spool(self, name: str) -> bytes:
+        with open(self.spool_paths[name], "rb") as f:
+            return f.read()
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Job status; until the result is in, the row counts come from the upload's progress tracker."""
+        result = self.result or {}
+        snapshot = self.progress.snapshot() if self.progress else None
+        if self.result is None and snapshot:
+            result = {
+                "total_rows": snapshot["total_rows"],
+                "inserted_rows": snapshot["rows_inserted"],
+                "failed_count": snapshot["rows_failed"],
+            }
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "state": self.state,
+            "params": self.params,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "duration_ms": round((self.finished_at - self.started_at) * 1000, 2)
+            if self.started_at and self.finished_at else None,
+            "total_rows": result.get("total_rows"),
+            "inserted_rows": result.get("inserted_rows"),
+            "failed_count": len(result["failed_rows"]) if "failed_rows" in result else result.get("failed_count"),
+            "progress": snapshot,
+            "result": self.result,
+            "error": self.error,
+        }
+
+class JobQueue:
+    """
+    In-process asyncio job queue. Uploads are spooled to disk, so a queued job
+    only holds their paths; WORKERS jobs run at once and at most max_queued wait,
+    beyond which submit raises AdmissionRejected. Jobs live in memory and do
+    not survive a restart.
+    """
+
+    def __init__(self, workers: int, spool_dir: str, max_queued: int):
+        self.workers = workers
+        self.spool_dir = spool_dir
+        self.max_queued = max_queued
+        self._queue: "asyncio.Queue[Job]" = asyncio.Queue()
+        self._durations: Deque[float] = deque(maxlen=JobQueueConfig.DURATION_SAMPLES)
+        self._jobs: Dict[str, Job] = {}
+        self._tasks: List[asyncio.Task] = []
+        os.makedirs(spool_dir, exist_ok=True)
+
+    def start(self) -> None:
+        if self._tasks:
+            return
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+        logger.info(f"Started {self.workers} upload job workers")
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def submit(
+        self,
+        kind: str,
+        handler: JobHandler,
+        uploads: Dict[str, BinaryIO],
+        params: Dict[str, Any],
+        progress: Optional[UploadProgress] = None,
+    ) -> Job:
+        """
+        Spool the named uploads to disk and enqueue a job that runs handler on
+        them; rejects when the queue is full. progress, when given, supplies the
+        row counts reported while the job runs.
+        """
+        self._prune()
+        if self._queue.qsize() >= self.max_queued:
+            raise AdmissionRejected(
+                f"Too many background uploads waiting ({self._queue.qsize()} queued)", self.retry_after()
+            )
+        spool_paths: Dict[str, str] = {}
+        size = 0
+        try:
+            for name, upload in uploads.items():
+                fd, spool_paths[name] = tempfile.mkstemp(dir=self.spool_dir, suffix=".upload")
+                with os.fdopen(fd, "wb") as spool:
+                    upload.seek(0)
+                    await asyncio.to_thread(shutil.copyfileobj, upload, spool)
+                    size += spool.tell()
+        except BaseException:
+            self._remove_spools(spool_paths)
+            raise
+
+        job = Job(kind, handler, spool_paths, size, params, progress)
+        self._jobs[job.id] = job
+        await self._queue.put(job)
+        logger.info(f"Queued job {job.id} ({kind}), {self._queue.qsize()} waiting")
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    def retry_after(self) -> int:
+        """Rough seconds until the queue has drained a round, from recent job durations."""
+        if not self._durations:
+            return AdmissionConfig.MIN_RETRY_AFTER
+        average = sum(self._durations) / len(self._durations)
+        rounds = (self._queue.qsize() + 1) / max(self.workers, 1)
+        return max(AdmissionConfig.MIN_RETRY_AFTER, math.ceil(average * rounds))
+
+    async def _worker(self, number: int) -> None:
+        while True:
+            job = await self._queue.get()
+            job.state = JobState.RUNNING
+            job.started_at = time.time()
+            logger.info(f"Worker {number} running job {job.id} ({job.kind})")
+            try:
+                job.result = await job.handler(job)
+                job.state = JobState.SUCCEEDED
+            except asyncio.CancelledError:
+                job.state = JobState.FAILED
+                job.error = "Cancelled during shutdown"
+                raise
+            except Exception as e:
+                logger.error(f"Job {job.id} failed: {str(e)}\n{traceback.format_exc()}")
+                job.state = JobState.FAILED
+                job.error = getattr(e, "detail", None) or str(e)
+            finally:
+                job.finished_at = time.time()
+                self._durations.append(job.finished_at - job.started_at)
+                self._remove_spools(job.spool_paths)
+                self._queue.task_done()
+
+    def _prune(self) -> None:
+        cutoff = time.time() - JobQueueConfig.RETENTION_SECONDS
+        expired = [job_id for job_id, job in self._jobs.items() if job.finished_at and job.finished_at < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    @staticmethod
+    def _remove_spools(spool_paths: Dict[str, str]) -> None:
+        for path in spool_paths.values():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+_job_queue: Optional[JobQueue] = None
+
+def get_job_queue() -> JobQueue:
+    """Return the process-wide job queue, creating it on first use."""
+    global _job_queue
+    if _job_queue is None:
+        _job_queue = JobQueue(JobQueueConfig.WORKERS, JobQueueConfig.SPOOL_DIR, JobQueueConfig.MAX_QUEUED)
+    return _job_queue
@@ -0,0 +1,96 @@
+from prisma import Prisma
+from prisma.errors import PrismaError
+import logging
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Recompute the derived master sheet columns for every row on or after $2 in a
+# single statement. The last row before $2 (per system_tag) anchors the series:
+# its nav/portfolio_value/pnl/exposure_value seed the prev_* columns of the first
+# recomputed row and its persisted peak_nav seeds the running peak, so earlier
+# history is never re-read. Rows written before peak_nav existed have it NULL;
+# for those the peak is taken from the tag's history before $2 instead. With
+# $2 = NULL the whole series is rebuilt.
+RECOMPUTE_SERIES_QUERY = """
+WITH last_before AS (
+    SELECT DISTINCT ON (system_tag)
+        system_tag, nav, portfolio_value, pnl, exposure_value, peak_nav
+    FROM master_sheet_test
+    WHERE qcode = $1 AND $2::date IS NOT NULL AND date < $2::date
+    ORDER BY system_tag, date DESC, id DESC
+),
+anchor AS (
+    SELECT
+        l.system_tag, l.nav, l.portfolio_value, l.pnl, l.exposure_value,
+        COALESCE(l.peak_nav, (
+            SELECT MAX(h.nav)
+            FROM master_sheet_test h
+            WHERE h.qcode = $1 AND h.date < $2::date
+                AND h.system_tag IS NOT DISTINCT FROM l.system_tag
+        )) AS peak_nav
+    FROM last_before l
+),
+suffix AS (
+    SELECT
+        id,
+        system_tag,
+        nav,
+        ROW_NUMBER() OVER w AS rn,
+        LAG(nav) OVER w AS lag_nav,
+        LAG(portfolio_value) OVER w AS lag_portfolio_value,
+        LAG(pnl) OVER w AS lag_pnl,
+        LAG(exposure_value) OVER w AS lag_exposure_value,
+        MAX(nav) OVER w AS running_peak
+    FROM master_sheet_test
+    WHERE qcode = $1 AND ($2::date IS NULL OR date >= $2::date)
+    WINDOW w AS (PARTITION BY system_tag ORDER BY date, id)
+),
+series AS (
+    SELECT
+        s.id,
+        s.nav,
+        CASE WHEN s.rn = 1 THEN a.nav ELSE s.lag_nav END AS prev_nav,
+        CASE WHEN s.rn = 1 THEN a.portfolio_value ELSE s.lag_portfolio_value END AS prev_portfolio_value,
+        CASE WHEN s.rn = 1 THEN a.pnl ELSE s.lag_pnl END AS prev_pnl,
+        CASE WHEN s.rn = 1 THEN a.exposure_value ELSE s.lag_exposure_value END AS prev_exposure_value,
+        GREATEST(s.running_peak, a.peak_nav) AS peak_nav
+    FROM suffix s
+    LEFT JOIN anchor a ON a.system_tag IS NOT DISTINCT FROM s.system_tag
+)
+UPDATE master_sheet_test m SET
+    prev_nav = series.prev_nav,
+    prev_portfolio_value = series.prev_portfolio_value,
+    prev_pnl = series.prev_pnl,
+    prev_exposure_value = series.prev_exposure_value,
+    daily_p_l = CASE
+        WHEN series.prev_nav > 0 AND series.nav IS NOT NULL
+        THEN ROUND((series.nav / series.prev_nav - 1) * 100, 4)
+        ELSE 0
+    END,
+    drawdown = CASE
+        WHEN series.peak_nav > 0 AND series.nav IS NOT NULL
+        THEN ROUND((series.peak_nav - series.nav) / series.peak_nav * 100, 4)
+        ELSE 0
+    END,
+    peak_nav = series.peak_nav
+FROM series
+WHERE m.id = series.id
+"""
+
+async def recompute_master_sheet_series(db: Prisma, qcode: str, from_date: Optional[str] = None) -> int:
+    """
+    Derive prev_nav, prev_portfolio_value, prev_pnl, prev_exposure_value, daily_p_l,
+    drawdown and the running peak_nav for master_sheet_test rows of a qcode.
+
+    Only rows dated on or after from_date (YYYY-MM-DD) are rewritten; pass None to
+    rebuild the full history. Drawdown is the percentage decline of nav from its
+    running peak, matching the consolidated sheet.
+    """
+    try:
+        updated = await db.execute_raw(RECOMPUTE_SERIES_QUERY, qcode, from_date)
+        logger.info(f"Recomputed {updated} master_sheet_test rows for qcode {qcode} from {from_date or 'start'}")
+        return updated
+    except PrismaError as e:
+        logger.error(f"Error recomputing master sheet series for {qcode}: {str(e)}")
+        raise
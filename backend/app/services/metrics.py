@@ -0,0 +1,80 @@
+import os
+import time
+from contextlib import contextmanager
+from typing import Tuple
+from app.services.tracing import record_span
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+# Stage latencies span sub-millisecond sniffs to multi-minute inserts
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+THROUGHPUT_BUCKETS = (100, 500, 1_000, 5_000, 10_000, 25_000, 50_000, 100_000, 250_000, 500_000)
+
+INGEST_STAGE_SECONDS = Histogram(
+    "ingest_stage_seconds",
+    "Time spent in each ingest stage",
+    ["stage", "table"],
+    buckets=STAGE_BUCKETS,
+)
+INGEST_ROWS = Counter(
+    "ingest_rows_total",
+    "Rows seen by the ingest pipeline, by outcome (parsed, rejected, inserted, failed)",
+    ["table", "outcome"],
+)
+INGEST_ROWS_PER_SECOND = Histogram(
+    "ingest_rows_per_second",
+    "Throughput of one upload through a stage",
+    ["stage", "table"],
+    buckets=THROUGHPUT_BUCKETS,
+)
+BATCH_INSERT_SECONDS = Histogram(
+    "ingest_batch_insert_seconds",
+    "Latency of one create_many attempt",
+    ["table"],
+    buckets=STAGE_BUCKETS,
+)
+BATCH_RETRIES = Counter(
+    "ingest_batch_retries_total",
+    "create_many attempts that failed and were retried",
+    ["table"],
+)
+BATCH_FALLBACKS = Counter(
+    "ingest_batch_fallbacks_total",
+    "Batches that fell back to row-by-row inserts after exhausting retries",
+    ["table"],
+)
+
+def record_stage(stage: str, table: str, seconds: float) -> None:
+    """Observe a stage latency; it is also added as a span of the current request trace."""
+    INGEST_STAGE_SECONDS.labels(stage, table).observe(seconds)
+    record_span(stage, seconds, table=table)
+
+@contextmanager
+def observe_stage(stage: str, table: str):
+    """Time the block into ingest_stage_seconds{stage, table}, also when it raises."""
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, table, time.perf_counter() - started_at)
+
+def record_throughput(stage: str, table: str, rows: int, seconds: float) -> None:
+    if rows and seconds > 0:
+        INGEST_ROWS_PER_SECOND.labels(stage, table).observe(rows / seconds)
+
+def render_metrics() -> Tuple[bytes, str]:
+    """
+    Exposition payload and content type. Under several worker processes set
+    PROMETHEUS_MULTIPROC_DIR so every worker's samples are merged.
+    """
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
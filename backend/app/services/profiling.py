@@ -0,0 +1,186 @@
+import hmac
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Optional
+from starlette.requests import Request
+
+logger = logging.getLogger(__name__)
+
+class ProfilingConfig:
+    # Profiling is disabled unless a token is configured
+    TOKEN = os.getenv("PROFILING_TOKEN", "")
+    DIR = os.getenv("PROFILES_DIR", "profiles")
+    HEADER = "X-Profile"
+    QUERY_PARAM = "profile"
+    # "cpu", "memory" or "all"; tracemalloc slows allocation-heavy code several times
+    # over, so CPU samples taken alongside it overstate Python-level work
+    MODE_HEADER = "X-Profile-Mode"
+    MODE_QUERY_PARAM = "profile_mode"
+    MODES = {"cpu", "memory", "all"}
+    SAMPLE_INTERVAL = float(os.getenv("PROFILING_SAMPLE_INTERVAL", "0.005"))
+    # How often traced memory is checked for a new high worth snapshotting
+    MEMORY_CHECK_INTERVAL = 0.1
+    TOP_ALLOCATIONS = 50
+    # Frames kept per allocation site in the tracemalloc report; each one adds overhead
+    ALLOCATION_FRAMES = int(os.getenv("PROFILING_TRACEMALLOC_FRAMES", "1"))
+
+def profiling_requested(request: Request) -> Optional[str]:
+    """The requested profiling mode when the request carries the profiling token, else None."""
+    if not ProfilingConfig.TOKEN:
+        return None
+    supplied = request.headers.get(ProfilingConfig.HEADER) or request.query_params.get(ProfilingConfig.QUERY_PARAM)
+    # Compared as bytes: compare_digest raises TypeError on non-ASCII str
+    if not supplied or not hmac.compare_digest(supplied.encode(), ProfilingConfig.TOKEN.encode()):
+        return None
+    mode = request.headers.get(ProfilingConfig.MODE_HEADER) or request.query_params.get(ProfilingConfig.MODE_QUERY_PARAM)
+    return mode if mode in ProfilingConfig.MODES else "all"
+
+class StackSampler(threading.Thread):
+    """
+    Samples the stacks of all other threads every SAMPLE_INTERVAL and counts
+    them in folded form (root;...;leaf), the input format of flamegraph.pl and
+    speedscope. Covers the event loop and to_thread workers such as
+    process_csv; chunks aggregated in the consolidation process pool are not sampled.
+    """
+
+    def __init__(self, interval: float):
+        super().__init__(name="stack-sampler", daemon=True)
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self) -> None:
+        own_id = threading.get_ident()
+        while not self._stop_event.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.samples[";".join(reversed(stack))] += 1
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        self.join()
+
+class PeakSnapshotter(threading.Thread):
+    """
+    Keeps the tracemalloc snapshot taken closest to peak traced memory, so the
+    report shows what was live at the high-water mark rather than at the end,
+    when the request's data has mostly been freed.
+    """
+
+    def __init__(self, interval: float):
+        super().__init__(name="memory-snapshotter", daemon=True)
+        self.interval = interval
+        self.snapshot: Optional[tracemalloc.Snapshot] = None
+        self._snapshot_size = 0
+        self._stop_event = threading.Event()
+
+    def check(self) -> None:
+        current, _ = tracemalloc.get_traced_memory()
+        # Snapshots cost time proportional to live blocks; only retake on a clear new high
+        if current > self._snapshot_size * 1.1:
+            self.snapshot = tracemalloc.take_snapshot()
+            self._snapshot_size = current
+
+    def run(self) -> None:
+        while not self._stop_event.wait(self.interval):
+            self.check()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        self.join()
+        self.check()
+
+class ProfileResult:
+    def __init__(self, request_id: str):
+        self.request_id = request_id
+        self.started_at = time.time()
+        self.files: Dict[str, str] = {}
+
+_session_lock = threading.Lock()
+
+@contextmanager
+def profile_session(request_id: str, mode: str = "all"):
+    """
+    Run the block under the stack sampler and/or tracemalloc, per mode, and
+    save <request_id>.folded and <request_id>.alloc.txt in PROFILES_DIR.
+    Only one session runs at a time (tracemalloc is process-wide); when one is
+    active this yields None and the block runs unprofiled.
+    """
+    if not _session_lock.acquire(blocking=False):
+        logger.warning("Profiling already active, running %s unprofiled", request_id)
+        yield None
+        return
+
+    result = ProfileResult(request_id)
+    sampler = StackSampler(ProfilingConfig.SAMPLE_INTERVAL) if mode in ("cpu", "all") else None
+    snapshotter = PeakSnapshotter(ProfilingConfig.MEMORY_CHECK_INTERVAL) if mode in ("memory", "all") else None
+    started_tracemalloc = snapshotter is not None and not tracemalloc.is_tracing()
+    try:
+        if started_tracemalloc:
+            tracemalloc.start(ProfilingConfig.ALLOCATION_FRAMES)
+        if snapshotter:
+            tracemalloc.reset_peak()
+            snapshotter.start()
+        if sampler:
+            sampler.start()
+        try:
+            yield result
+        finally:
+            if sampler:
+                sampler.stop()
+                _save_samples(result, sampler.samples)
+            if snapshotter:
+                snapshotter.stop()
+                _, peak = tracemalloc.get_traced_memory()
+                if started_tracemalloc:
+                    tracemalloc.stop()
+                _save_allocations(result, snapshotter.snapshot, peak)
+            logger.info("Saved %s profile of %s to %s", mode, request_id, ProfilingConfig.DIR)
+    finally:
+        _session_lock.release()
+
+def _profile_path(result: ProfileResult, suffix: str) -> Path:
+    directory = Path(ProfilingConfig.DIR)
+    directory.mkdir(parents=True, exist_ok=True)
+    return directory / f"{result.request_id}{suffix}"
+
+def _save_samples(result: ProfileResult, samples: Counter) -> None:
+    folded_path = _profile_path(result, ".folded")
+    with open(folded_path, "w") as f:
+        for stack, count in samples.most_common():
+            f.write(f"{stack} {count}\n")
+    result.files["folded"] = str(folded_path)
+
+def _save_allocations(result: ProfileResult, snapshot: Optional[tracemalloc.Snapshot], peak: int) -> None:
+    if snapshot is None:
+        return
+    elapsed = time.time() - result.started_at
+    alloc_path = _profile_path(result, ".alloc.txt")
+    snapshot = snapshot.filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__),
+    ])
+    with open(alloc_path, "w") as f:
+        f.write(f"request {result.request_id}: {elapsed:.3f}s, peak traced memory {peak / 1024 / 1024:.1f} MiB\n")
+        f.write("top allocation sites live at the largest snapshot taken:\n\n")
+        for stat in snapshot.statistics("traceback")[:ProfilingConfig.TOP_ALLOCATIONS]:
+            f.write(f"{stat.size / 1024:.1f} KiB in {stat.count} blocks\n")
+            for line in stat.traceback.format():
+                f.write(f"{line}\n")
+            f.write("\n")
+    result.files["allocations"] = str(alloc_path)
@@ -0,0 +1,116 @@
+import logging
+import os
+import threading
+import time
+import uuid
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+class ProgressConfig:
+    # Seconds between progress events on an SSE stream
+    EMIT_INTERVAL = float(os.getenv("UPLOAD_PROGRESS_INTERVAL", "0.5"))
+    # Parsers publish their row counters once per this many rows
+    ROW_STEP = 1000
+    # How long a stream waits for an upload that has not started yet
+    WAIT_FOR_START = 30.0
+    # Comment line sent on idle streams so proxies keep the connection open
+    HEARTBEAT_SECONDS = 15.0
+    # Finished uploads stay queryable this long
+    RETENTION_SECONDS = 600
+
+class UploadProgress:
+    """
+    Counters for one upload. Writers (the parser thread, insert_data) only bump
+    plain attributes; readers take snapshot() on their own schedule, so
+    reporting never adds work per row.
+    """
+
+    def __init__(self, upload_id: str):
+        self.upload_id = upload_id
+        self.stage = "queued"
+        self.rows_parsed = 0
+        self.rows_failed = 0
+        self.rows_inserted = 0
+        self.total_rows: Optional[int] = None
+        self.batches_done = 0
+        self.batches_total: Optional[int] = None
+        self.error: Optional[str] = None
+        self.started_at = time.time()
+        self.stage_started_at = self.started_at
+        self.finished_at: Optional[float] = None
+
+    @property
+    def done(self) -> bool:
+        return self.finished_at is not None
+
+    def set_stage(self, stage: str) -> None:
+        self.stage = stage
+        self.stage_started_at = time.time()
+
+    def parsed(self, rows: int, failed: int) -> None:
+        self.rows_parsed = rows
+        self.rows_failed = failed
+
+    def batch_inserted(self, inserted: int, failed: int) -> None:
+        self.rows_inserted += inserted
+        self.rows_failed += failed
+        self.batches_done += 1
+
+    def finish(self, error: Optional[str] = None) -> None:
+        self.error = error
+        self.set_stage("failed" if error else "done")
+        self.finished_at = self.stage_started_at
+
+    def snapshot(self) -> Dict[str, Any]:
+        now = self.finished_at or time.time()
+        stage_elapsed = max(now - self.stage_started_at, 1e-6)
+        stage_rows = {"parsing": self.rows_parsed, "inserting": self.rows_inserted}.get(self.stage)
+        return {
+            "upload_id": self.upload_id,
+            "stage": self.stage,
+            "rows_parsed": self.rows_parsed,
+            "rows_inserted": self.rows_inserted,
+            "rows_failed": self.rows_failed,
+            "total_rows": self.total_rows,
+            "batches_done": self.batches_done,
+            "batches_total": self.batches_total,
+            "rows_per_second": round(stage_rows / stage_elapsed, 1) if stage_rows is not None else None,
+            "elapsed_ms": round((now - self.started_at) * 1000, 2),
+            "done": self.done,
+            "error": self.error,
+        }
+
+class UploadIdInUse(Exception):
+    """Raised when a client-supplied upload_id belongs to an upload still in progress."""
+
+    def __init__(self, upload_id: str):
+        super().__init__(f"Upload {upload_id} is still in progress; use a different upload_id")
+        self.upload_id = upload_id
+
+_trackers: Dict[str, UploadProgress] = {}
+_lock = threading.Lock()
+
+def create_progress(upload_id: Optional[str] = None) -> UploadProgress:
+    """
+    Register a tracker under upload_id (or a new id), replacing any finished one
+    with that id. An unfinished one is kept and UploadIdInUse raised, so a
+    reused id cannot take over another upload's progress stream.
+    """
+    upload_id = upload_id or uuid.uuid4().hex
+    with _lock:
+        _prune()
+        existing = _trackers.get(upload_id)
+        if existing is not None and not existing.done:
+            raise UploadIdInUse(upload_id)
+        progress = UploadProgress(upload_id)
+        _trackers[upload_id] = progress
+    return progress
+
+def get_progress(upload_id: str) -> Optional[UploadProgress]:
+    return _trackers.get(upload_id)
+
+def _prune() -> None:
+    cutoff = time.time() - ProgressConfig.RETENTION_SECONDS
+    for upload_id in [k for k, p in _trackers.items() if p.finished_at and p.finished_at < cutoff]:
+        del _trackers[upload_id]
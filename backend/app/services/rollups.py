@@ -0,0 +1,148 @@
+from prisma import Prisma
+from prisma.errors import PrismaError
+import logging
+from typing import List, Dict, Any, Optional, Iterable, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Each rollup is rebuilt per (qcode, bucket date): the bucket rows are deleted and
+# re-aggregated from the raw table, so inserts, deletes and replaces all
+# invalidate the same way.
+ROLLUP_DEFINITIONS: Dict[str, Dict[str, str]] = {
+    "tradebook": {
+        "rollup_table": "tradebook_pnl_rollup",
+        "bucket_column": "trade_date",
+        "source_bucket": "timestamp_entry::date",
+        "insert": """
+            INSERT INTO tradebook_pnl_rollup (qcode, trade_date, symbol, realized_pnl, trade_count, updated_at)
+            SELECT qcode, timestamp_entry::date, symbol_entry, COALESCE(SUM(pnl_amount), 0), COUNT(*), NOW()
+            FROM tradebook
+            WHERE qcode = $1 AND {source_filter}
+            GROUP BY qcode, timestamp_entry::date, symbol_entry
+        """,
+    },
+    "equity_holding": {
+        "rollup_table": "holding_exposure_rollup",
+        "bucket_column": "date",
+        "source_bucket": "date",
+        "insert": """
+            INSERT INTO holding_exposure_rollup (qcode, date, source_table, mastersheet_tag, exposure, row_count, updated_at)
+            SELECT qcode, date, 'equity_holding', mastersheet_tag, COALESCE(SUM(exposure), 0), COUNT(*), NOW()
+            FROM equity_holding
+            WHERE qcode = $1 AND {source_filter}
+            GROUP BY qcode, date, mastersheet_tag
+        """,
+    },
+    "gold_tradebook": {
+        "rollup_table": "holding_exposure_rollup",
+        "bucket_column": "date",
+        "source_bucket": "date",
+        "insert": """
+            INSERT INTO holding_exposure_rollup (qcode, date, source_table, mastersheet_tag, exposure, row_count, updated_at)
+            SELECT qcode, date, 'gold_tradebook', mastersheet_tag, COALESCE(SUM(exposure), 0), COUNT(*), NOW()
+            FROM gold_tradebook
+            WHERE qcode = $1 AND {source_filter}
+            GROUP BY qcode, date, mastersheet_tag
+        """,
+    },
+}
+
+ROLLUP_TABLES = set(ROLLUP_DEFINITIONS)
+
+def _bucket_filter(
+    column: str,
+    dates: Optional[Iterable[str]],
+    start_date: Optional[str],
+    end_date: Optional[str],
+) -> Tuple[str, List[Any]]:
+    """Build the bucket predicate (params start at $2) for a date list, a range, or everything."""
+    if dates is not None:
+        return f"{column} = ANY($2::date[])", [sorted(dates)]
+    if start_date and end_date:
+        return f"{column} BETWEEN $2::date AND $3::date", [start_date, end_date]
+    return "TRUE", []
+
+async def refresh_rollups(
+    db: Prisma,
+    table_name: str,
+    qcode: str,
+    dates: Optional[Iterable[str]] = None,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+) -> int:
+    """
+    Recompute the rollup buckets a write to table_name touched.
+
+    Pass the touched dates (YYYY-MM-DD) after an insert, the deleted range after a
+    delete, or neither to rebuild every bucket of the qcode.
+    """
+    definition = ROLLUP_DEFINITIONS.get(table_name)
+    if not definition:
+        return 0
+    if dates is not None:
+        dates = set(dates)
+        if not dates:
+            return 0
+
+    rollup_filter, params = _bucket_filter(definition["bucket_column"], dates, start_date, end_date)
+    source_filter, _ = _bucket_filter(definition["source_bucket"], dates, start_date, end_date)
+
+    delete_query = f'DELETE FROM "{definition["rollup_table"]}" WHERE qcode = $1 AND {rollup_filter}'
+    if definition["rollup_table"] == "holding_exposure_rollup":
+        delete_query += f" AND source_table = '{table_name}'"
+
+    try:
+        await db.execute_raw(delete_query, qcode, *params)
+        inserted = await db.execute_raw(definition["insert"].format(source_filter=source_filter), qcode, *params)
+        logger.info(f"Refreshed {inserted} {definition['rollup_table']} rows for {table_name} qcode {qcode}")
+        return inserted
+    except PrismaError as e:
+        logger.error(f"Error refreshing rollups for {table_name} qcode {qcode}: {str(e)}")
+        raise
+
+async def rebuild_all_rollups(db: Prisma, qcode: str) -> Dict[str, int]:
+    """Rebuild every rollup bucket for a qcode, e.g. to backfill existing history."""
+    return {table_name: await refresh_rollups(db, table_name, qcode) for table_name in ROLLUP_DEFINITIONS}
+
+async def get_tradebook_pnl_summary(
+    db: Prisma,
+    qcode: str,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+) -> List[Dict[str, Any]]:
+    """Realized PnL per day and symbol, read from the rollup table."""
+    return await db.query_raw(
+        """
+        SELECT trade_date, symbol, realized_pnl, trade_count
+        FROM tradebook_pnl_rollup
+        WHERE qcode = $1
+          AND ($2::date IS NULL OR trade_date >= $2::date)
+          AND ($3::date IS NULL OR trade_date <= $3::date)
+        ORDER BY trade_date, symbol
+        """,
+        qcode,
+        start_date,
+        end_date,
+    )
+
+async def get_exposure_summary(
+    db: Prisma,
+    qcode: str,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+) -> List[Dict[str, Any]]:
+    """Exposure per day and mastersheet_tag across holding sources, read from the rollup table."""
+    return await db.query_raw(
+        """
+        SELECT date, mastersheet_tag, SUM(exposure) AS exposure, SUM(row_count) AS row_count
+        FROM holding_exposure_rollup
+        WHERE qcode = $1
+          AND ($2::date IS NULL OR date >= $2::date)
+          AND ($3::date IS NULL OR date <= $3::date)
+        GROUP BY date, mastersheet_tag
+        ORDER BY date, mastersheet_tag
+        """,
+        qcode,
+        start_date,
+        end_date,
+    )
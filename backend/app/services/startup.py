@@ -0,0 +1,73 @@
+import asyncio
+import importlib
+import logging
+import os
+import sys
+import time
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+class StartupConfig:
+    # Import heavy modules in a background thread once the server is up, so the
+    # first consolidated upload does not pay for them; off, they load on first use
+    WARMUP = os.getenv("STARTUP_WARMUP", "true").lower() == "true"
+    # Loaded in order; optional Excel engines are skipped when not installed
+    WARMUP_MODULES = ["app.services.consolidated_processor"]
+    OPTIONAL_WARMUP_MODULES = ["openpyxl", "xlrd"]
+
+class StartupTimer:
+    """Durations of the startup phases, reported in one log line once the app is up."""
+
+    def __init__(self, started_at: float):
+        self.started_at = started_at
+        self.phases: Dict[str, float] = {}
+        self._last = started_at
+
+    def mark(self, phase: str) -> None:
+        """Record the time since the previous mark as `phase`."""
+        now = time.perf_counter()
+        self.phases[phase] = now - self._last
+        self._last = now
+
+    def report(self, routes: int) -> None:
+        total = time.perf_counter() - self.started_at
+        phases = ", ".join(f"{phase} {seconds * 1000:.0f}ms" for phase, seconds in self.phases.items())
+        logger.info("Startup took %.0fms (%s), %d routes registered", total * 1000, phases, routes)
+
+def _import_modules() -> List[str]:
+    loaded = []
+    for name in StartupConfig.WARMUP_MODULES + StartupConfig.OPTIONAL_WARMUP_MODULES:
+        if name in sys.modules:
+            continue
+        try:
+            importlib.import_module(name)
+            loaded.append(name)
+        except ImportError:
+            if name not in StartupConfig.OPTIONAL_WARMUP_MODULES:
+                raise
+    return loaded
+
+async def warm_up() -> None:
+    """Import the heavy modules off the event loop; requests are served meanwhile."""
+    started_at = time.perf_counter()
+    try:
+        loaded = await asyncio.to_thread(_import_modules)
+    except Exception as e:
+        logger.warning("Startup warm-up failed, modules will load on first use: %s", e)
+        return
+    logger.info("Warm-up loaded %s in %.0fms", ", ".join(loaded) or "nothing", (time.perf_counter() - started_at) * 1000)
+
+_warmup_task: Optional[asyncio.Task] = None
+
+def start_warm_up() -> None:
+    global _warmup_task
+    if StartupConfig.WARMUP and _warmup_task is None:
+        _warmup_task = asyncio.create_task(warm_up())
+
+async def stop_warm_up() -> None:
+    """Let a running warm-up finish; an import cannot be interrupted midway."""
+    global _warmup_task
+    if _warmup_task is not None:
+        await _warmup_task
+        _warmup_task = None
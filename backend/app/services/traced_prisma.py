@@ -0,0 +1,153 @@
+import inspect
+import logging
+import os
+import re
+import time
+from typing import Any, Dict, Optional
+from prisma import Prisma
+from app.services.tracing import Trace, current_trace
+
+logger = logging.getLogger(__name__)
+# Separate logger so slow queries can be routed or silenced on their own
+slow_query_logger = logging.getLogger(f"{__name__}.slow")
+
+class QueryLogConfig:
+    # Queries slower than this are logged with redacted SQL; 0 disables the log
+    SLOW_QUERY_MS = float(os.getenv("DB_SLOW_QUERY_MS", "250"))
+    # Round trips per request, bulk inserts excluded, before a warning lists them; 0 disables
+    ROUND_TRIP_BUDGET = int(os.getenv("DB_ROUND_TRIP_BUDGET", "20"))
+    # Actions whose count scales with the upload size rather than request overhead
+    BULK_ACTIONS = {"create_many"}
+    # SQL kept in the slow-query log, and on spans and per-request call counts
+    SQL_LOG_CHARS = 500
+    SQL_PREVIEW_CHARS = 120
+
+RAW_QUERY_METHODS = {"query_raw", "query_first", "execute_raw"}
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"(?<![\w$.])-?\d+(?:\.\d+)?\b")
+
+def redact_sql(query: str, limit: int = QueryLogConfig.SQL_LOG_CHARS) -> str:
+    """
+    SQL with whitespace collapsed and inline string and number literals
+    replaced by ?. Bound parameters ($1, $2, ...) are never logged, so this
+    only guards against values interpolated into the query text.
+    """
+    query = _STRING_LITERAL.sub("?", " ".join(query.split()))
+    return _NUMBER_LITERAL.sub("?", query)[:limit]
+
+def _describe_args(kwargs: Dict[str, Any]) -> str:
+    """Shape of model action arguments without their values: where keys, row counts."""
+    parts = []
+    for key, value in kwargs.items():
+        if isinstance(value, dict):
+            parts.append(f"{key}=[{', '.join(value)}]")
+        elif isinstance(value, (list, tuple)):
+            parts.append(f"{key}={len(value)} items")
+        else:
+            parts.append(f"{key}=?")
+    return ", ".join(parts)
+
+def _record(trace: Optional[Trace], key: str, op: str, started_at: float, statement: str) -> None:
+    """Account one database round trip on the request trace and the slow-query log."""
+    seconds = time.perf_counter() - started_at
+    if trace is not None:
+        trace.db_round_trips += 1
+        if not op.startswith("tx."):
+            trace.db_queries += 1
+        if key:
+            trace.db_calls[key] += 1
+        trace.add("db", started_at, seconds, {"op": op, "sql": statement[:QueryLogConfig.SQL_PREVIEW_CHARS]})
+    if QueryLogConfig.SLOW_QUERY_MS and seconds * 1000 >= QueryLogConfig.SLOW_QUERY_MS:
+        slow_query_logger.warning("Slow query %.0fms %s: %s", seconds * 1000, op, statement)
+
+class _TracedActions:
+    """Model delegate (db.<model>) whose async actions are recorded as db calls."""
+
+    def __init__(self, model: str, actions: Any):
+        self._model = model
+        self._actions = actions
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self._actions, name)
+        if not inspect.iscoroutinefunction(attr):
+            return attr
+        op = f"{self._model}.{name}"
+        # Bulk inserts are counted as round trips but kept out of the per-operation
+        # counts the budget is checked against
+        key = "" if name in QueryLogConfig.BULK_ACTIONS else op
+
+        async def traced(*args, **kwargs):
+            trace = current_trace()
+            started_at = time.perf_counter()
+            try:
+                return await attr(*args, **kwargs)
+            finally:
+                _record(trace, key, op, started_at, f"{op}({_describe_args(kwargs)})")
+        return traced
+
+class _TracedTransaction:
+    """db.tx() wrapper: begin and commit count as round trips, queries in it are traced."""
+
+    def __init__(self, manager: Any):
+        self._manager = manager
+
+    async def __aenter__(self) -> "TracedPrisma":
+        trace = current_trace()
+        started_at = time.perf_counter()
+        try:
+            client = await self._manager.__aenter__()
+        finally:
+            _record(trace, "tx.begin", "tx.begin", started_at, "BEGIN")
+        return TracedPrisma(client)
+
+    async def __aexit__(self, exc_type, exc, tb) -> Any:
+        trace = current_trace()
+        started_at = time.perf_counter()
+        statement = "COMMIT" if exc_type is None else "ROLLBACK"
+        try:
+            return await self._manager.__aexit__(exc_type, exc, tb)
+        finally:
+            _record(trace, f"tx.{statement.lower()}", f"tx.{statement.lower()}", started_at, statement)
+
+class TracedPrisma:
+    """
+    Transparent proxy over a Prisma client that accounts every raw query,
+    model action and transaction boundary on the current request trace (as
+    "db" spans, per-operation counts and round trips) and logs slow ones.
+    """
+
+    def __init__(self, client: Prisma):
+        self._client = client
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self._client, name)
+        if name in RAW_QUERY_METHODS:
+            async def traced(query: str, *args):
+                trace = current_trace()
+                started_at = time.perf_counter()
+                try:
+                    return await attr(query, *args)
+                finally:
+                    statement = redact_sql(query)
+                    key = f"{name}: {statement[:QueryLogConfig.SQL_PREVIEW_CHARS]}"
+                    _record(trace, key, name, started_at, statement)
+            return traced
+        if name == "tx":
+            return lambda *args, **kwargs: _TracedTransaction(attr(*args, **kwargs))
+        if type(attr).__module__ == "prisma.actions":
+            return _TracedActions(name, attr)
+        return attr
+
+def check_round_trip_budget(trace: Trace, method: str, path: str) -> None:
+    """Warn when a request made more round trips than its budget, listing repeated calls first."""
+    budget = QueryLogConfig.ROUND_TRIP_BUDGET
+    overhead = sum(trace.db_calls.values())
+    if not budget or overhead <= budget:
+        return
+    db_seconds = trace.totals.get("db", [0.0, 0])[0]
+    logger.warning(
+        "%s %s made %d database round trips (%d excluding bulk inserts, budget %d) taking %.0fms: %s",
+        method, path, trace.db_round_trips, overhead, budget, db_seconds * 1000,
+        "; ".join(f"{count}x {key}" for key, count in trace.db_calls.most_common()),
+    )
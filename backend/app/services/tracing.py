@@ -0,0 +1,133 @@
+import json
+import logging
+import os
+import re
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+class TracingConfig:
+    # Requests slower than this get their full span list logged
+    SLOW_REQUEST_MS = float(os.getenv("TRACE_SLOW_REQUEST_MS", "2000"))
+    # Spans kept per request for the slow dump; timings are aggregated past it
+    MAX_SPANS = int(os.getenv("TRACE_MAX_SPANS", "500"))
+    REQUEST_ID_HEADER = "X-Request-ID"
+
+REQUEST_ID_PATTERN = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+
+class Trace:
+    """Spans recorded while serving one request, plus per-name totals for Server-Timing."""
+
+    def __init__(self, request_id: str):
+        self.request_id = request_id
+        self.started_at = time.perf_counter()
+        self.spans: List[Dict[str, Any]] = []
+        self.dropped = 0
+        # name -> [total seconds, count]
+        self.totals: Dict[str, List[float]] = {}
+        # Database calls by operation (bulk inserts excluded), queries, and round
+        # trips, which also count transaction begin/commit
+        self.db_calls: Counter = Counter()
+        self.db_queries = 0
+        self.db_round_trips = 0
+
+    def add(self, name: str, started_at: float, seconds: float, attrs: Dict[str, Any]) -> None:
+        total = self.totals.setdefault(name, [0.0, 0])
+        total[0] += seconds
+        total[1] += 1
+        if len(self.spans) >= TracingConfig.MAX_SPANS:
+            self.dropped += 1
+            return
+        self.spans.append({
+            "name": name,
+            "start_ms": round((started_at - self.started_at) * 1000, 2),
+            "duration_ms": round(seconds * 1000, 2),
+            **attrs,
+        })
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self.started_at) * 1000
+
+    def server_timing(self) -> str:
+        """Server-Timing header value: one entry per span name plus the total."""
+        entries = [
+            f'{_metric_name(name)};dur={seconds * 1000:.1f};desc="{int(count)}x"'
+            for name, (seconds, count) in self.totals.items()
+        ]
+        entries.append(f"total;dur={self.elapsed_ms():.1f}")
+        return ", ".join(entries)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "request_id": self.request_id,
+            "elapsed_ms": round(self.elapsed_ms(), 2),
+            "totals_ms": {name: round(seconds * 1000, 2) for name, (seconds, _) in self.totals.items()},
+            "db": {
+                "queries": self.db_queries,
+                "round_trips": self.db_round_trips,
+                "calls": dict(self.db_calls.most_common()),
+            },
+            "spans": self.spans,
+            "dropped_spans": self.dropped,
+        }
+
+def _metric_name(name: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", name)
+
+_current_trace: ContextVar[Optional[Trace]] = ContextVar("current_trace", default=None)
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+def current_request_id() -> Optional[str]:
+    trace = _current_trace.get()
+    return trace.request_id if trace else None
+
+def start_trace(request_id: Optional[str] = None) -> Trace:
+    """Begin a trace for the current context; an invalid or missing id is replaced."""
+    if not request_id or not REQUEST_ID_PATTERN.match(request_id):
+        request_id = uuid.uuid4().hex
+    trace = Trace(request_id)
+    _current_trace.set(trace)
+    return trace
+
+def record_span(name: str, seconds: float, **attrs: Any) -> None:
+    """Add an already-timed span to the current trace, if there is one."""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(name, time.perf_counter() - seconds, seconds, attrs)
+
+@contextmanager
+def span(name: str, **attrs: Any):
+    """Time the block as a span of the current trace; a no-op outside a request."""
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(name, started_at, time.perf_counter() - started_at, attrs)
+
+def finish_trace(trace: Trace, method: str, path: str, status_code: int) -> None:
+    """Dump the trace when the request exceeded SLOW_REQUEST_MS."""
+    elapsed_ms = trace.elapsed_ms()
+    if elapsed_ms >= TracingConfig.SLOW_REQUEST_MS:
+        logger.warning(
+            "Slow request %s %s -> %d in %.0fms: %s",
+            method, path, status_code, elapsed_ms, json.dumps(trace.to_dict(), default=str),
+        )
+
+class RequestIdFilter(logging.Filter):
+    """Stamp records with the current request id so log lines can be correlated."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not hasattr(record, "request_id"):
+            record.request_id = current_request_id() or "-"
+        return True
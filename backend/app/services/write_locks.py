@@ -0,0 +1,117 @@
+import asyncio
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from datetime import timedelta
+from typing import FrozenSet, Optional, Tuple
+from prisma import Prisma
+from prisma.errors import TransactionExpiredError
+
+logger = logging.getLogger(__name__)
+
+class WriteLockConfig:
+    # Longest a writer waits for another write to the same (table, qcode)
+    WAIT_TIMEOUT = float(os.getenv("WRITE_LOCK_WAIT_TIMEOUT", "60"))
+    POLL_INTERVAL = float(os.getenv("WRITE_LOCK_POLL_INTERVAL", "0.25"))
+    # Lifetime of the transaction holding the lock: at least HOLD_TIMEOUT, and
+    # HOLD_SECONDS_PER_BATCH for every insert batch the writer announces. The
+    # holder pins a pool connection while the write runs; when it expires the
+    # lock is released early, which is logged but does not fail the write
+    HOLD_TIMEOUT = float(os.getenv("WRITE_LOCK_HOLD_TIMEOUT", "300"))
+    HOLD_SECONDS_PER_BATCH = float(os.getenv("WRITE_LOCK_HOLD_SECONDS_PER_BATCH", "5"))
+
+class WriteLockTimeout(Exception):
+    """Raised when another writer kept the (table, qcode) lock past the wait timeout."""
+
+    def __init__(self, table_name: str, qcode: str, waited: float):
+        super().__init__(
+            f"Timed out after {waited:.1f}s waiting for another write to {table_name} for qcode {qcode}"
+        )
+        self.table_name = table_name
+        self.qcode = qcode
+
+# Locks held by the current task, so nested writes (replace_data -> insert_data) do not wait on themselves
+_held: ContextVar[FrozenSet[Tuple[str, str]]] = ContextVar("write_locks_held", default=frozenset())
+
+@asynccontextmanager
+async def write_lock(
+    db: Prisma,
+    table_name: str,
+    qcode: str,
+    timeout: Optional[float] = None,
+    batches: int = 0,
+):
+    """
+    Hold the Postgres advisory lock for (table_name, qcode) for the block.
+    Pass the number of insert batches the block writes so the holder outlives it.
+
+    The query engine pools connections, so a session-level lock could be taken
+    and released on different connections. Instead a dedicated transaction
+    takes pg_try_advisory_xact_lock and stays open while the block runs its
+    writes through db; ending it releases the lock, also when the block fails
+    or the process dies. Writers to other tables or qcodes never wait.
+
+    Each active writer therefore holds one connection of the query engine's pool
+    (connection_limit in DATABASE_URL, by default 2 x CPUs + 1) for the whole
+    write, in addition to the connections its inserts use, and a waiting writer
+    holds one while it polls. Keep ADMISSION_MAX_INGESTS (which caps concurrent
+    uploads, background jobs included) well below the pool size, or writers
+    starve their own inserts until the holder expires.
+
+    The writes do not run inside the holder, so its expiry cannot undo them: a
+    holder that expired before the block finished only means exclusion was lost
+    for the remainder, which is logged. Errors from the block itself propagate.
+    """
+    key = (table_name, qcode)
+    if key in _held.get():
+        yield
+        return
+
+    timeout = WriteLockConfig.WAIT_TIMEOUT if timeout is None else timeout
+    hold_timeout = max(WriteLockConfig.HOLD_TIMEOUT, batches * WriteLockConfig.HOLD_SECONDS_PER_BATCH)
+    started_at = time.time()
+    acquired_at: Optional[float] = None
+    failure: Optional[BaseException] = None
+    try:
+        async with db.tx(
+            max_wait=timedelta(seconds=timeout),
+            timeout=timedelta(seconds=timeout + hold_timeout),
+        ) as holder:
+            while True:
+                row = await holder.query_first(
+                    "SELECT pg_try_advisory_xact_lock(hashtext($1), hashtext($2)) AS locked",
+                    table_name,
+                    qcode,
+                )
+                if row and row["locked"]:
+                    break
+                waited = time.time() - started_at
+                if waited >= timeout:
+                    logger.warning(f"Gave up on write lock for {table_name}/{qcode} after {waited:.2f}s")
+                    raise WriteLockTimeout(table_name, qcode, waited)
+                await asyncio.sleep(WriteLockConfig.POLL_INTERVAL)
+
+            acquired_at = time.time()
+            if acquired_at - started_at > 1:
+                logger.info(f"Acquired write lock for {table_name}/{qcode} after waiting {acquired_at - started_at:.2f}s")
+
+            token = _held.set(_held.get() | {key})
+            try:
+                yield
+            except BaseException as e:
+                failure = e
+                raise
+            finally:
+                _held.reset(token)
+    except TransactionExpiredError:
+        if acquired_at is None:
+            raise
+        logger.error(
+            f"Write lock for {table_name}/{qcode} expired before its write finished "
+            f"({time.time() - acquired_at:.0f}s, hold timeout {hold_timeout:.0f}s); "
+            f"other writers were not excluded for the remainder"
+        )
+        if failure is not None:
+            raise failure
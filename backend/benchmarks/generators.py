@@ -0,0 +1,166 @@
+"""
+Synthetic upload files for the benchmarks.
+
+Table CSVs follow tableConfigs.json: every non-derived column, aliases (when a
+column has any) and varied header case to exercise header mapping, the date
+formats process_csv accepts for the table, and messy numerics (thousands
+separators, percent signs, padding). A bad_fraction of rows carries an
+invalid date or number. Generation is seeded, so a size always yields the
+same bytes.
+"""
+import csv
+import io
+import random
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, List, Tuple
+
+from app.config.constants import DERIVED_COLUMNS, SHARED_TABLE_CONFIGS, TABLE_CONFIG_ALIASES
+
+# Database table uploads are processed under, per tableConfigs.json entry
+UPLOAD_TABLES = {
+    config_name: next((table for table, source in TABLE_CONFIG_ALIASES.items() if source == config_name), config_name)
+    for config_name in SHARED_TABLE_CONFIGS
+    if config_name not in TABLE_CONFIG_ALIASES
+}
+
+TRADEBOOK_DATE_FORMATS = ["%Y-%m-%d %H:%M:%S", "%d/%m/%Y %H:%M:%S", "%d-%m-%Y %H:%M:%S", "%Y-%m-%d"]
+DATE_COLUMNS = {"Date", "Timestamp Entry", "Timestamp Exit", "Expiry", "As of Date"}
+INTEGER_COLUMNS = {"Qty Entry", "Qty Exit", "Quantity", "Lotsize", "No of Lots"}
+PERCENT_COLUMNS = {"% PNL", "Daily P/L %", "Drawdown %"}
+DECIMAL_COLUMNS = {
+    "Portfolio Value", "Cash In/Out", "NAV", "PnL", "Exposure Value",
+    "Price Entry", "Contract Value Entry", "Price Exit", "Contract Value Exit",
+    "Pnl Amount", "Pnl Amount Settlement", "Capital In/Out", "Price", "Exposure",
+    "Avg Price", "LTP", "Buy Value", "Value as of Today", "PNL Amount",
+}
+TEXT_VALUES = {
+    "Status": ["P"],
+    "Trade Type": ["Buy", "Sell"],
+    "Action Entry": ["BUY", "SELL"],
+    "Action Exit": ["SELL", "BUY", ""],
+    "Exchange": ["NSE", "BSE", "MCX"],
+    "Broker": ["Zerodha", "ICICI", "Kotak"],
+    "Debt Equity": ["Debt", "Equity"],
+    "Debt/Equity": ["Debt", "Equity"],
+    "Collateral": ["Yes", "No"],
+}
+SYMBOLS = ["NIFTY", "BANKNIFTY", "GOLDBEES", "LIQUIDBEES", "RELIANCE", "HDFCBANK", "INFY", "TCS"]
+
+def _decimal(rng: random.Random, low: float = -1e6, high: float = 1e7) -> str:
+    value = rng.uniform(low, high)
+    style = rng.random()
+    if style < 0.2:
+        return f"{value:,.2f}"
+    if style < 0.3:
+        return f" {value:.4f} "
+    return f"{value:.2f}"
+
+def _date_value(rng: random.Random, day: date, formats: List[str]) -> str:
+    moment = datetime.combine(day, datetime.min.time()) + timedelta(seconds=rng.randrange(9 * 3600, 16 * 3600))
+    return moment.strftime(rng.choice(formats))
+
+def _value_factory(column: str, table: str) -> Callable[[random.Random, int, date], str]:
+    """Generator of valid cells for a column, from its display name."""
+    formats = TRADEBOOK_DATE_FORMATS if table == "tradebook" else ["%Y-%m-%d"]
+    if column in DATE_COLUMNS:
+        return lambda rng, i, day: _date_value(rng, day, formats)
+    if column in INTEGER_COLUMNS:
+        return lambda rng, i, day: str(rng.randint(1, 5000))
+    if column in PERCENT_COLUMNS:
+        return lambda rng, i, day: f"{rng.uniform(-50, 50):.2f}%"
+    if column in DECIMAL_COLUMNS:
+        return lambda rng, i, day: _decimal(rng)
+    if column in TEXT_VALUES:
+        return lambda rng, i, day: rng.choice(TEXT_VALUES[column])
+    if "Symbol" in column:
+        return lambda rng, i, day: rng.choice(SYMBOLS)
+    if column == "ISIN":
+        return lambda rng, i, day: f"INE{rng.randrange(10**8):08d}"
+    return lambda rng, i, day: f"{column.split()[0].upper()}_{rng.randrange(50)}"
+
+def _header(column: Dict[str, str], rng: random.Random) -> str:
+    aliases = column.get("aliases") or []
+    if aliases and rng.random() < 0.5:
+        return rng.choice(aliases)
+    name = column["displayName"]
+    return rng.choice([name, name, name.lower(), name.upper()])
+
+def generate_table_csv(config_name: str, rows: int, bad_fraction: float = 0.01, seed: int = 0) -> bytes:
+    """A CSV upload of `rows` data rows for a tableConfigs.json entry."""
+    rng = random.Random(f"{config_name}-{rows}-{seed}")
+    table = UPLOAD_TABLES[config_name]
+    config = SHARED_TABLE_CONFIGS[config_name]
+    columns = [c for c in config["requiredColumns"] if c["displayName"] not in DERIVED_COLUMNS.get(table, [])]
+    factories = [_value_factory(c["displayName"], table) for c in columns]
+    breakable = [
+        i for i, c in enumerate(columns)
+        if c["displayName"] in DATE_COLUMNS | DECIMAL_COLUMNS and c["displayName"] not in ("Timestamp Exit", "Expiry")
+    ]
+
+    out = io.StringIO()
+    writer = csv.writer(out, lineterminator="\n")
+    writer.writerow(_header(c, rng) for c in columns)
+    start = date(2020, 1, 1)
+    for i in range(rows):
+        day = start + timedelta(days=i % 2000)
+        values = [factory(rng, i, day) for factory in factories]
+        if breakable and rng.random() < bad_fraction:
+            values[rng.choice(breakable)] = rng.choice(["n/a", "12..5", "31/02/2024x", "abc"])
+        writer.writerow(values)
+    return out.getvalue().encode()
+
+def generate_consolidated_dumps(
+    rows: int,
+    accounts: int = 0,
+    bad_fraction: float = 0.01,
+    seed: int = 0
+) -> Tuple[bytes, bytes]:
+    """
+    Transaction and holding CSV dumps for the consolidated processor: `rows`
+    holding rows (a few securities per account and day) and about a tenth as
+    many transactions, with padded account codes, extra columns, day-first
+    dates and a bad_fraction of unparseable dates and market values.
+    """
+    rng = random.Random(f"consolidated-{rows}-{accounts}-{seed}")
+    accounts = accounts or max(1, rows // 1000)
+    start = date(2020, 1, 1)
+
+    holdings = io.StringIO()
+    writer = csv.writer(holdings, lineterminator="\n")
+    writer.writerow([
+        "WS CLIENT ID", "WS Account Code", "CLIENT NAME", "HOLDINGDATE", "HOLDING QTY",
+        "UNITCOST", "MKTVALUE", "SECURITY NAME", "ASTCLS", "REMARKS",
+    ])
+    per_account = max(1, rows // accounts)
+    for i in range(rows):
+        account = i // per_account % accounts
+        day = start + timedelta(days=i % per_account // 3)
+        holding_date = day.strftime("%d-%m-%Y")
+        market_value = f"{rng.uniform(1_000, 1_000_000):.2f}"
+        if rng.random() < bad_fraction:
+            if rng.random() < 0.5:
+                holding_date = "notadate"
+            else:
+                market_value = "abc"
+        writer.writerow([
+            account, f" ACC{account:05d} ", f" Client {account} ", holding_date, rng.randint(1, 1000),
+            f"{rng.uniform(10, 5000):.2f}", market_value, rng.choice(SYMBOLS), "EQ", "",
+        ])
+
+    transactions = io.StringIO()
+    writer = csv.writer(transactions, lineterminator="\n")
+    writer.writerow([
+        "WS CLIENT ID", "WS ACCOUNT CODE", "CLIENT NAME", "TRANDATE", "QTY", "RATE",
+        "NET AMOUNT", "SECURITY NAME", "SECURITY TYPE", "ISIN",
+    ])
+    for _ in range(max(1, rows // 10)):
+        account = rng.randrange(accounts)
+        day = start + timedelta(days=rng.randrange(max(1, per_account // 3)))
+        trade_date = day.strftime("%d/%m/%Y") if rng.random() >= bad_fraction else "32/13/2020"
+        writer.writerow([
+            account, f"ACC{account:05d}", f"Client {account}", trade_date, rng.randint(1, 100),
+            f"{rng.uniform(10, 5000):.2f}", f"{rng.uniform(-50_000, 50_000):.2f}",
+            rng.choice(SYMBOLS), "EQ", f"INE{rng.randrange(10**8):08d}",
+        ])
+
+    return transactions.getvalue().encode(), holdings.getvalue().encode()
@@ -0,0 +1,275 @@
+"""
+Ingest benchmarks: process_csv and serialize_table_item per table config,
+and on consolidated dumps the path consolidate_uploads serves: _aggregate_file
+on the holdings dump, and both dumps aggregated and turned into metrics.
+
+Run from backend/:
+
+    python -m benchmarks.run --sizes 1k,10k,100k
+    python -m benchmarks.run --sizes 1m --tables tradebook --bench process_csv
+    python -m benchmarks.run --save-baseline     # store results as the baseline
+
+Each case runs in a fresh interpreter that loads its pre-generated input, so
+the peak RSS growth it reports is not hidden by memory an earlier case freed
+but the allocator kept. Rows per second is from the best of --repeat runs.
+When a baseline file exists, results are compared with it; none is shipped,
+since numbers are only comparable on the machine that recorded them.
+"""
+import argparse
+import gc
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from app.services.csv_processor import process_csv
+from app.services.db_operations import serialize_table_item
+from app.services.consolidated_processor import (
+    _aggregate_file,
+    _metrics_from_totals,
+    shutdown_process_pool,
+)
+from benchmarks.generators import UPLOAD_TABLES, generate_consolidated_dumps, generate_table_csv
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+BENCHES = ["process_csv", "serialize", "aggregate_file", "consolidate"]
+QCODE = "bench_qcode"
+
+def parse_size(text: str) -> int:
+    text = text.strip().lower()
+    multiplier = {"k": 1_000, "m": 1_000_000}.get(text[-1], 1)
+    return int(float(text.rstrip("km")) * multiplier)
+
+def _proc_status_kb(field: str) -> Optional[int]:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+def _reset_peak_rss() -> bool:
+    """Reset VmHWM (Linux 4.0+) so the next reading covers only the timed call."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+def measure(
+    fn: Callable[[], Any],
+    repeat: int,
+    count_rows: Callable[[Any], int]
+) -> Tuple[int, float, Optional[float]]:
+    """Rows handled, best wall time over `repeat` calls and peak RSS growth (MiB) of the first call."""
+    best = float("inf")
+    peak_mib = None
+    rows = 0
+    for attempt in range(repeat):
+        gc.collect()
+        tracked = attempt == 0 and _reset_peak_rss()
+        rss_before = _proc_status_kb("VmRSS") if tracked else None
+        started_at = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - started_at)
+        if tracked and rss_before is not None:
+            peak = _proc_status_kb("VmHWM")
+            peak_mib = max(0, peak - rss_before) / 1024 if peak is not None else None
+        if attempt == 0:
+            rows = count_rows(result)
+        del result
+    return rows, best, peak_mib
+
+def _serialize_all(rows: List[Dict[str, Any]], table: str, account: Any) -> int:
+    failed = 0
+    for index, item in enumerate(rows, start=1):
+        try:
+            serialize_table_item(item, table, QCODE, account, index)
+        except Exception:
+            failed += 1
+    return failed
+
+def _read(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+def _count_rows(path: str) -> int:
+    with open(path, "rb") as f:
+        return sum(1 for _ in f) - 1
+
+def _aggregate_dump(path: str, table_name: str):
+    # Read from the file, like the spooled UploadFile the endpoint aggregates
+    with open(path, "rb") as f:
+        return _aggregate_file(f, os.path.basename(path), table_name)
+
+def _consolidate(paths: Dict[str, str]):
+    portfolio_value, _ = _aggregate_dump(paths["holdings"], "holding_asset_class")
+    capital_flows, _ = _aggregate_dump(paths["transactions"], "transaction_class")
+    return _metrics_from_totals(portfolio_value, capital_flows)
+
+def run_case(bench: str, table: str, paths: Dict[str, str], repeat: int, log_level: str) -> Tuple[int, float, Optional[float]]:
+    """Run one benchmark in this (fresh) process; returns (rows measured, seconds, peak MiB)."""
+    logging.basicConfig(level=log_level, stream=sys.stderr)
+    if bench == "process_csv":
+        content = _read(paths["csv"])
+        return measure(
+            lambda: process_csv(content, QCODE, table, None, None),
+            repeat,
+            lambda result: len(result[0]) + len(result[1]),
+        )
+
+    if bench == "serialize":
+        data, _ = process_csv(_read(paths["csv"]), QCODE, table, None, None)
+        account = SimpleNamespace(qcode=QCODE, account_name="Benchmark Account")
+        return measure(lambda: _serialize_all(data, table, account), repeat, lambda _: len(data))
+
+    try:
+        if bench == "aggregate_file":
+            rows = _count_rows(paths["holdings"])
+            return measure(lambda: _aggregate_dump(paths["holdings"], "holding_asset_class"), repeat, lambda _: rows)
+
+        rows = _count_rows(paths["holdings"]) + _count_rows(paths["transactions"])
+        return measure(lambda: _consolidate(paths), repeat, lambda _: rows)
+    finally:
+        shutdown_process_pool()
+
+def _run_isolated(bench: str, table: str, paths: Dict[str, str], args) -> Tuple[int, float, Optional[float]]:
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as executor:
+        return executor.submit(run_case, bench, table, paths, args.repeat, args.log_level.upper()).result()
+
+def _write(directory: str, name: str, content: bytes) -> str:
+    path = os.path.join(directory, name)
+    with open(path, "wb") as f:
+        f.write(content)
+    return path
+
+def run_table_benches(config_name: str, rows: int, workdir: str, args) -> List[Dict[str, Any]]:
+    table = UPLOAD_TABLES[config_name]
+    paths = {"csv": _write(workdir, f"{config_name}-{rows}.csv", generate_table_csv(config_name, rows, args.bad_fraction, args.seed))}
+    results = []
+    for bench in ("process_csv", "serialize"):
+        if bench in args.bench:
+            measured_rows, seconds, peak = _run_isolated(bench, table, paths, args)
+            results.append(_result(bench, config_name, measured_rows, seconds, peak))
+    os.remove(paths["csv"])
+    return results
+
+def run_consolidated_benches(rows: int, workdir: str, args) -> List[Dict[str, Any]]:
+    transactions, holdings = generate_consolidated_dumps(rows, bad_fraction=args.bad_fraction, seed=args.seed)
+    paths = {
+        "transactions": _write(workdir, f"transactions-{rows}.csv", transactions),
+        "holdings": _write(workdir, f"holdings-{rows}.csv", holdings),
+    }
+    del transactions, holdings
+    results = []
+    for bench, label in (("aggregate_file", "holding_asset_class"), ("consolidate", "consolidated")):
+        if bench in args.bench:
+            measured_rows, seconds, peak = _run_isolated(bench, label, paths, args)
+            results.append(_result(bench, label, measured_rows, seconds, peak))
+    for path in paths.values():
+        os.remove(path)
+    return results
+
+def _result(bench: str, table: str, rows: int, seconds: float, peak_mib: Optional[float]) -> Dict[str, Any]:
+    return {
+        "key": f"{bench}|{table}|{rows}",
+        "bench": bench,
+        "table": table,
+        "rows": rows,
+        "seconds": round(seconds, 4),
+        "rows_per_second": round(rows / seconds, 1) if seconds > 0 else None,
+        "peak_mib": round(peak_mib, 1) if peak_mib is not None else None,
+    }
+
+def _change(current: Optional[float], previous: Optional[float]) -> str:
+    if not current or not previous:
+        return ""
+    return f"{(current - previous) / previous * 100:+.1f}%"
+
+def print_report(results: List[Dict[str, Any]], baseline: Optional[Dict[str, Any]]) -> None:
+    previous = {r["key"]: r for r in baseline["results"]} if baseline else {}
+    header = f"{'bench':<22}{'table':<32}{'rows':>10}{'rows/s':>14}{'peak MiB':>10}"
+    if baseline:
+        header += f"{'rows/s vs base':>16}{'peak vs base':>14}"
+    print(header)
+    for r in results:
+        line = (
+            f"{r['bench']:<22}{r['table']:<32}{r['rows']:>10}"
+            f"{r['rows_per_second'] or 0:>14,.0f}"
+            f"{r['peak_mib'] if r['peak_mib'] is not None else 'n/a':>10}"
+        )
+        base = previous.get(r["key"])
+        if base:
+            line += f"{_change(r['rows_per_second'], base['rows_per_second']):>16}"
+            line += f"{_change(r['peak_mib'], base['peak_mib']):>14}"
+        print(line)
+    if baseline:
+        print(f"\nBaseline recorded {baseline['recorded_at']} on {baseline['machine']}")
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1k,10k,100k", help="Comma-separated row counts, e.g. 1k,10k,100k,1m")
+    parser.add_argument("--tables", default="", help="Comma-separated tableConfigs.json entries (default: all)")
+    parser.add_argument("--bench", default=",".join(BENCHES), help=f"Comma-separated subset of {BENCHES}")
+    parser.add_argument("--bad-fraction", type=float, default=0.01, help="Fraction of rows with invalid values")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per case; the best is reported")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Baseline file to compare with or save to")
+    parser.add_argument("--save-baseline", action="store_true", help="Store these results as the baseline")
+    parser.add_argument("--json", help="Also write the results to this file")
+    parser.add_argument("--log-level", default="ERROR", help="Level for app loggers while benchmarking")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=args.log_level.upper(), stream=sys.stderr)
+    args.bench = [b.strip() for b in args.bench.split(",") if b.strip()]
+    unknown = set(args.bench) - set(BENCHES)
+    if unknown:
+        parser.error(f"Unknown benchmarks: {sorted(unknown)}")
+    tables = [t.strip() for t in args.tables.split(",") if t.strip()] or list(UPLOAD_TABLES)
+    missing = [t for t in tables if t not in UPLOAD_TABLES]
+    if missing:
+        parser.error(f"Unknown tables: {missing}; choose from {list(UPLOAD_TABLES)}")
+
+    results: List[Dict[str, Any]] = []
+    with tempfile.TemporaryDirectory(prefix="ingest-bench-") as workdir:
+        for rows in (parse_size(s) for s in args.sizes.split(",")):
+            if {"process_csv", "serialize"} & set(args.bench):
+                for config_name in tables:
+                    results.extend(run_table_benches(config_name, rows, workdir, args))
+            if {"aggregate_file", "consolidate"} & set(args.bench):
+                results.extend(run_consolidated_benches(rows, workdir, args))
+
+    baseline = None
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_report(results, baseline)
+
+    payload = {
+        "recorded_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "machine": f"{platform.node()} ({platform.processor() or platform.machine()}, "
+                   f"{os.cpu_count()} CPUs, Python {platform.python_version()})",
+        "args": {"bad_fraction": args.bad_fraction, "seed": args.seed, "repeat": args.repeat},
+        "results": results,
+    }
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(payload, f, indent=2)
+        print(f"\nSaved baseline to {args.baseline}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(payload, f, indent=2)
+
+if __name__ == "__main__":
+    main()
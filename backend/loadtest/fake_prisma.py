@@ -0,0 +1,161 @@
+"""
+In-process stand-in for the Prisma client calls the ingest paths make.
+
+It keeps row counts per (table, qcode, day) in memory, emulates the advisory locks
+taken in write_lock transactions, and sleeps a configurable latency per call
+plus a per-row cost for batch inserts, so concurrency, batching and admission
+behave like they would against a database without needing one. It is not a
+SQL engine: raw queries are recognised by what they touch and answered with
+plausible results.
+"""
+import asyncio
+import re
+from collections import Counter, defaultdict
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from app.services.db_operations import DATE_FIELD_MAPPING
+
+class FakeDatabase:
+    """State shared by all FakePrisma clients of one load test."""
+
+    def __init__(self, qcodes: Iterable[str], query_latency: float = 0.002, row_cost: float = 0.00002):
+        self.accounts = {
+            qcode: SimpleNamespace(qcode=qcode, account_name=f"Load Test {qcode}", account_id=i)
+            for i, qcode in enumerate(qcodes, start=1)
+        }
+        # Consolidated dumps use ACC<n> account codes; map them onto the seeded qcodes
+        self.custodian_codes = {f"ACC{i:05d}": qcode for i, qcode in enumerate(self.accounts)}
+        self.query_latency = query_latency
+        self.row_cost = row_cost
+        # (table, qcode) -> rows per day of the table's date field, so range deletes are exact
+        self.rows: Dict[Tuple[str, str], Counter] = defaultdict(Counter)
+        self.locks: Dict[Tuple[int, int], object] = {}
+        self.queries = 0
+        # Every row ever inserted, to check against what the responses report
+        self.inserted = 0
+
+    async def wait(self, rows: int = 0) -> None:
+        self.queries += 1
+        await asyncio.sleep(self.query_latency + rows * self.row_cost)
+
+    def add_row(self, table: str, row: Dict[str, Any]) -> None:
+        value = row.get(DATE_FIELD_MAPPING.get(table, "date"))
+        self.rows[(table, row.get("qcode"))][str(value)[:10] if value else None] += 1
+        self.inserted += 1
+
+    def count(self, table: str, qcode: Optional[str] = None) -> int:
+        if qcode is not None:
+            return sum(self.rows[(table, qcode)].values())
+        return sum(sum(days.values()) for (name, _), days in self.rows.items() if name == table)
+
+    def delete(self, table: str, qcode: str, start: Optional[str] = None, end: Optional[str] = None) -> int:
+        days = self.rows[(table, qcode)]
+        doomed = [day for day in days if start is None or (day is not None and start <= day <= end)]
+        return sum(days.pop(day) for day in doomed)
+
+class FakeModel:
+    """db.<model> actions used by the app: create_many, create, find_first, count."""
+
+    def __init__(self, database: FakeDatabase, name: str):
+        self._database = database
+        self._name = name
+
+    async def create_many(self, data: List[Dict[str, Any]], skip_duplicates: bool = False) -> int:
+        await self._database.wait(len(data))
+        for row in data:
+            self._database.add_row(self._name, row)
+        return len(data)
+
+    async def create(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        await self._database.wait(1)
+        self._database.add_row(self._name, data)
+        return data
+
+    async def find_first(self, where: Optional[Dict[str, Any]] = None, **kwargs) -> Any:
+        await self._database.wait()
+        if self._name == "accounts":
+            return self._database.accounts.get((where or {}).get("qcode"))
+        return None
+
+    async def count(self, where: Optional[Dict[str, Any]] = None, **kwargs) -> int:
+        await self._database.wait()
+        return self._database.count(self._name, (where or {}).get("qcode"))
+
+class FakeTransaction:
+    """The holder transaction of write_lock: advisory xact locks live until it ends."""
+
+    def __init__(self, database: FakeDatabase):
+        self._database = database
+        self.held: Set[Tuple[int, int]] = set()
+
+    async def query_first(self, query: str, *args) -> Optional[Dict[str, Any]]:
+        await self._database.wait()
+        if "pg_try_advisory_xact_lock" in query:
+            key = (hash(args[0]), hash(args[1]))
+            owner = self._database.locks.get(key)
+            if owner is not None and owner is not self:
+                return {"locked": False}
+            self._database.locks[key] = self
+            self.held.add(key)
+            return {"locked": True}
+        return None
+
+    def release(self) -> None:
+        for key in self.held:
+            self._database.locks.pop(key, None)
+        self.held.clear()
+
+class FakePrisma:
+    def __init__(self, database: FakeDatabase):
+        self._database = database
+        self._models: Dict[str, FakeModel] = {}
+
+    async def connect(self) -> None:
+        pass
+
+    async def disconnect(self) -> None:
+        pass
+
+    def __getattr__(self, name: str) -> FakeModel:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        if name not in self._models:
+            self._models[name] = FakeModel(self._database, name)
+        return self._models[name]
+
+    @asynccontextmanager
+    async def tx(self, **kwargs):
+        transaction = FakeTransaction(self._database)
+        try:
+            yield transaction
+        finally:
+            transaction.release()
+
+    async def query_first(self, query: str, *args) -> Optional[Dict[str, Any]]:
+        await self._database.wait()
+        if "information_schema.tables" in query:
+            return {"exists": True}
+        if "COUNT(*)" in query:
+            table = re.search(r'FROM "?(\w+)"?', query).group(1)
+            return {"count": self._database.count(table, args[0] if args else None)}
+        return None
+
+    async def query_raw(self, query: str, *args) -> List[Dict[str, Any]]:
+        await self._database.wait()
+        if "account_custodian_codes" in query:
+            codes = args[0] if args else []
+            return [
+                {"custodian_code": code, "qcode": self._database.custodian_codes[code]}
+                for code in codes if code in self._database.custodian_codes
+            ]
+        return []
+
+    async def execute_raw(self, query: str, *args) -> int:
+        await self._database.wait()
+        match = re.match(r'\s*DELETE FROM "?(\w+)"?', query)
+        if match and args:
+            # Range deletes bind qcode, start and end dates in that order
+            return self._database.delete(match.group(1), *args[:3])
+        return 0
@@ -0,0 +1,357 @@
+"""
+Load test for the upload, replace and consolidated endpoints.
+
+By default the app runs in-process behind httpx's ASGI transport with get_db
+(and the background job sessions) served by loadtest.fake_prisma, so no
+database is needed. With --base-url, requests go to a running server instead;
+its database must already hold the accounts passed with --qcodes.
+
+Run from backend/:
+
+    python -m loadtest.run --mix upload:master_sheet=3,replace:master_sheet=1 --rate 10 --duration 30
+    python -m loadtest.run --mix consolidated --concurrency 4 --requests 40 --rows 50k
+    python -m loadtest.run --base-url http://localhost:8000 --qcodes qac00001,qac00002 --mix upload:tradebook
+
+--rate sends requests open-loop at that many per second (latency then includes
+queueing in the app); --rate 0 runs --concurrency closed-loop workers. With
+--background, each accepted job is followed on its progress stream until it
+finishes, so latency covers the whole ingest rather than just the enqueue.
+
+In-process runs end by checking the rows the fake database received against
+the inserted_rows the responses reported, and fail when a write scenario
+succeeded without writing anything.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import random
+import sys
+import time
+from collections import Counter, defaultdict
+from contextlib import asynccontextmanager
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import httpx
+
+from benchmarks.generators import UPLOAD_TABLES, generate_consolidated_dumps, generate_table_csv
+from benchmarks.run import parse_size
+
+UPLOAD_ROUTES = {
+    "master_sheet": "/api/upload/master-sheet/",
+    "tradebook": "/api/upload/tradebook/",
+    "slippage": "/api/upload/slippage/",
+    "mutual_fund_holding": "/api/upload/mutual-fund-holding/",
+    "gold_tradebook": "/api/upload/gold-tradebook/",
+    "liquidbees_tradebook": "/api/upload/liquidbees-tradebook/",
+    "equity_holding": "/api/upload/equity-holding/",
+    "equity_holding_test": "/api/upload/equity-holding-test/",
+    "mutual_fund_holding_sheet_test": "/api/upload/mutual-fund-holding-test/",
+}
+SCENARIOS = (
+    [f"upload:{name}" for name in UPLOAD_ROUTES]
+    + ["replace:master_sheet", "delete:master_sheet", "consolidated", "consolidated:persist"]
+)
+# Scenarios whose successful responses must have written rows
+WRITE_SCENARIOS = {name for name in SCENARIOS if name.startswith(("upload:", "replace:"))} | {"consolidated:persist"}
+
+RequestSpec = Dict[str, Any]
+
+class Payloads:
+    """Pre-generated request bodies; `variants` differing files per scenario are cycled."""
+
+    def __init__(self, rows: int, variants: int, bad_fraction: float):
+        self.rows = rows
+        self.variants = variants
+        self.bad_fraction = bad_fraction
+        self._cache: Dict[str, List[Any]] = {}
+
+    def get(self, key: str, build: Callable[[int], Any]) -> Any:
+        if key not in self._cache:
+            self._cache[key] = [build(seed) for seed in range(self.variants)]
+        return random.choice(self._cache[key])
+
+    def table_csv(self, config_name: str) -> bytes:
+        return self.get(config_name, lambda seed: generate_table_csv(config_name, self.rows, self.bad_fraction, seed))
+
+    def consolidated(self) -> Tuple[bytes, bytes]:
+        return self.get("consolidated", lambda seed: generate_consolidated_dumps(self.rows, bad_fraction=self.bad_fraction, seed=seed))
+
+def build_request(scenario: str, payloads: Payloads, qcode: str, background: bool, system_tag: str) -> RequestSpec:
+    kind, _, target = scenario.partition(":")
+    form = {"qcode": qcode, "background": str(background).lower()}
+    if kind == "upload":
+        if UPLOAD_ROUTES[target].endswith("-test/"):
+            # The dated holding snapshots take an as-of date instead of a range
+            form["date"] = "2024-03-31"
+        return {
+            "method": "POST",
+            "url": UPLOAD_ROUTES[target],
+            "files": {"file": (f"{target}.csv", payloads.table_csv(target), "text/csv")},
+            "data": form,
+        }
+    if kind == "replace":
+        return {
+            "method": "POST",
+            "url": "/api/replace/master-sheet/",
+            "files": {"file": ("master_sheet.csv", payloads.table_csv("master_sheet"), "text/csv")},
+            "data": form,
+        }
+    if kind == "delete":
+        return {
+            "method": "POST",
+            "url": "/api/replace/delete/",
+            "json": {"qcode": qcode, "startDate": "2020-01-01", "endDate": "2020-06-30", "table": UPLOAD_TABLES[target]},
+        }
+    transactions, holdings = payloads.consolidated()
+    return {
+        "method": "POST",
+        "url": "/upload/consolidated-sheet/",
+        "params": {"persist": "true", "system_tag": system_tag, "background": str(background).lower()}
+        if target == "persist" else {},
+        "files": {
+            "transaction_file": ("transactions.csv", transactions, "text/csv"),
+            "holding_file": ("holdings.csv", holdings, "text/csv"),
+        },
+    }
+
+def parse_mix(text: str) -> List[Tuple[str, int]]:
+    mix = []
+    for part in filter(None, (p.strip() for p in text.split(","))):
+        name, _, weight = part.partition("=")
+        if name not in SCENARIOS:
+            raise ValueError(f"Unknown scenario {name!r}; choose from {SCENARIOS}")
+        mix.append((name, int(weight or 1)))
+    return mix
+
+class Recorder:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.statuses: Dict[str, Counter] = defaultdict(Counter)
+        self.bytes_sent: Dict[str, int] = defaultdict(int)
+        self.inserted: Dict[str, int] = defaultdict(int)
+        self.started_at = time.perf_counter()
+        self.finished_at: Optional[float] = None
+
+    def record(self, scenario: str, seconds: float, status: str, sent: int, inserted: int = 0) -> None:
+        self.latencies[scenario].append(seconds)
+        self.statuses[scenario][status] += 1
+        self.bytes_sent[scenario] += sent
+        self.inserted[scenario] += inserted
+
+def _percentile(ordered: List[float], fraction: float) -> float:
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+def summarize(recorder: Recorder, rows_per_request: int, problems: List[str]) -> Dict[str, Any]:
+    elapsed = (recorder.finished_at or time.perf_counter()) - recorder.started_at
+    summary = {"elapsed_seconds": round(elapsed, 2), "scenarios": {}, "problems": problems}
+    for scenario, latencies in sorted(recorder.latencies.items()):
+        ordered = sorted(latencies)
+        statuses = recorder.statuses[scenario]
+        ok = sum(count for status, count in statuses.items() if status.startswith("2"))
+        rows = 0 if scenario.startswith("delete:") else rows_per_request
+        summary["scenarios"][scenario] = {
+            "requests": len(ordered),
+            "throughput_rps": round(len(ordered) / elapsed, 2),
+            "rows_per_second": round(ok * rows / elapsed, 1),
+            "inserted_rows": recorder.inserted[scenario],
+            "error_rate": round(1 - ok / len(ordered), 4),
+            "statuses": dict(statuses),
+            "latency_ms": {
+                "p50": round(_percentile(ordered, 0.50) * 1000, 1),
+                "p90": round(_percentile(ordered, 0.90) * 1000, 1),
+                "p95": round(_percentile(ordered, 0.95) * 1000, 1),
+                "p99": round(_percentile(ordered, 0.99) * 1000, 1),
+                "max": round(ordered[-1] * 1000, 1),
+            },
+        }
+    return summary
+
+def print_summary(summary: Dict[str, Any]) -> None:
+    print(f"{'scenario':<40}{'reqs':>7}{'req/s':>9}{'rows/s':>11}{'err%':>7}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}  statuses")
+    for scenario, s in summary["scenarios"].items():
+        lat = s["latency_ms"]
+        print(
+            f"{scenario:<40}{s['requests']:>7}{s['throughput_rps']:>9}{s['rows_per_second']:>11,.0f}"
+            f"{s['error_rate'] * 100:>7.1f}{lat['p50']:>9}{lat['p95']:>9}{lat['p99']:>9}{lat['max']:>9}  {s['statuses']}"
+        )
+    print(f"\nElapsed {summary['elapsed_seconds']}s (latencies in ms)")
+    for problem in summary["problems"]:
+        print(f"PROBLEM: {problem}")
+
+async def wait_for_job(client: httpx.AsyncClient, progress_url: str) -> Tuple[str, int]:
+    """Follow a background upload's progress stream to its final event; returns (status, rows inserted)."""
+    event = None
+    async with client.stream("GET", progress_url) as response:
+        async for line in response.aiter_lines():
+            if line.startswith("event: "):
+                event = line[len("event: "):]
+            elif line.startswith("data: ") and event in ("done", "error"):
+                snapshot = json.loads(line[len("data: "):])
+                return ("202" if event == "done" else "job_failed"), snapshot["rows_inserted"]
+    return "job_lost", 0
+
+async def send(client: httpx.AsyncClient, scenario: str, spec: RequestSpec, recorder: Recorder) -> None:
+    sent = sum(len(f[1]) for f in spec.get("files", {}).values())
+    started_at = time.perf_counter()
+    inserted = 0
+    try:
+        response = await client.request(**spec)
+        # Read streamed bodies (consolidated CSV) so latency covers the whole response
+        await response.aread()
+        status = str(response.status_code)
+        if response.headers.get("content-type", "").startswith("application/json"):
+            body = response.json()
+            if response.status_code == 202 and "progress_url" in body:
+                status, inserted = await wait_for_job(client, body["progress_url"])
+            elif response.is_success and isinstance(body, dict):
+                inserted = body.get("inserted_rows") or 0
+    except httpx.HTTPError as e:
+        status = type(e).__name__
+    recorder.record(scenario, time.perf_counter() - started_at, status, sent, inserted)
+
+def check_writes(recorder: Recorder, database: Any) -> List[str]:
+    """Compare what the responses reported with what the fake database received."""
+    problems = []
+    for scenario in sorted(WRITE_SCENARIOS & set(recorder.statuses)):
+        ok = sum(count for status, count in recorder.statuses[scenario].items() if status.startswith("2"))
+        if ok and not recorder.inserted[scenario]:
+            problems.append(f"{scenario}: {ok} successful responses but no rows inserted")
+    reported = sum(recorder.inserted.values())
+    if reported != database.inserted:
+        problems.append(f"responses reported {reported} inserted rows, the database received {database.inserted}")
+    return problems
+
+async def drive(client: httpx.AsyncClient, args, payloads: Payloads, qcodes: List[str]) -> Recorder:
+    mix = parse_mix(args.mix)
+    names = [name for name, _ in mix]
+    weights = [weight for _, weight in mix]
+    recorder = Recorder()
+    deadline = time.perf_counter() + args.duration
+    issued = itertools.count()
+
+    def next_request() -> Optional[Tuple[str, RequestSpec]]:
+        number = next(issued)
+        if (args.requests and number >= args.requests) or (not args.requests and time.perf_counter() >= deadline):
+            return None
+        scenario = random.choices(names, weights)[0]
+        return scenario, build_request(scenario, payloads, random.choice(qcodes), args.background, args.system_tag)
+
+    if args.rate > 0:
+        # Open loop: issue on schedule regardless of completions, up to --concurrency in flight
+        in_flight = asyncio.Semaphore(args.concurrency)
+        tasks = []
+
+        async def limited(scenario: str, spec: RequestSpec) -> None:
+            async with in_flight:
+                await send(client, scenario, spec, recorder)
+
+        while (item := next_request()) is not None:
+            tasks.append(asyncio.create_task(limited(*item)))
+            await asyncio.sleep(random.expovariate(args.rate))
+        await asyncio.gather(*tasks)
+    else:
+        async def worker() -> None:
+            while (item := next_request()) is not None:
+                await send(client, *item, recorder)
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+
+    recorder.finished_at = time.perf_counter()
+    return recorder
+
+@asynccontextmanager
+async def in_process_client(args, qcodes: List[str]):
+    """The app behind an ASGI transport, with every database session served by FakePrisma."""
+    from app.config.logging_config import LoggingConfig
+    # Importing app.main runs setup_logging, which sets the root level from LoggingConfig
+    LoggingConfig.LEVEL = args.log_level.upper()
+    from app.main import app
+    from app.config.database import get_db
+    from app.services.consolidated_cache import CacheConfig
+    from app.services.traced_prisma import TracedPrisma
+    import app.routers.upload as upload_router
+    from loadtest.fake_prisma import FakeDatabase, FakePrisma
+
+    database = FakeDatabase(qcodes, args.db_latency_ms / 1000, args.db_row_us / 1_000_000)
+
+    async def fake_db():
+        yield TracedPrisma(FakePrisma(database))
+
+    @asynccontextmanager
+    async def fake_session():
+        yield FakePrisma(database)
+
+    app.dependency_overrides[get_db] = fake_db
+    upload_router.db_session = fake_session
+    # Identical payload variants would otherwise be served from the result cache
+    CacheConfig.ENABLED = args.consolidated_cache
+
+    await app.router.startup()
+    try:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=args.timeout) as client:
+            yield client, database
+        print(f"Fake database served {database.queries} queries and received {database.inserted} rows")
+    finally:
+        await app.router.shutdown()
+
+async def main_async(args) -> Dict[str, Any]:
+    random.seed(args.seed)
+    qcodes = [q.strip() for q in args.qcodes.split(",") if q.strip()] if args.qcodes else [
+        f"loadtest_{i:04d}" for i in range(1, args.accounts + 1)
+    ]
+    payloads = Payloads(parse_size(args.rows), args.variants, args.bad_fraction)
+
+    problems: List[str] = []
+    if args.base_url:
+        if not args.qcodes:
+            raise SystemExit("--qcodes is required with --base-url: they must exist in the target database")
+        async with httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout) as client:
+            recorder = await drive(client, args, payloads, qcodes)
+    else:
+        async with in_process_client(args, qcodes) as (client, database):
+            recorder = await drive(client, args, payloads, qcodes)
+        problems = check_writes(recorder, database)
+    return summarize(recorder, payloads.rows, problems)
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mix", default="upload:master_sheet", help=f"scenario[=weight],... from {SCENARIOS}")
+    parser.add_argument("--rate", type=float, default=0, help="Requests per second (open loop); 0 for closed loop")
+    parser.add_argument("--concurrency", type=int, default=4, help="Workers (closed loop) or max in flight (open loop)")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds to issue requests for")
+    parser.add_argument("--requests", type=int, default=0, help="Stop after this many requests instead of --duration")
+    parser.add_argument("--rows", default="1k", help="Rows per uploaded file (holding rows for consolidated)")
+    parser.add_argument("--variants", type=int, default=4, help="Distinct generated files per scenario")
+    parser.add_argument("--bad-fraction", type=float, default=0.01)
+    parser.add_argument("--background", action="store_true", help="Submit uploads as background jobs and wait for them")
+    parser.add_argument("--system-tag", default="Load Test", help="System Tag sent with consolidated:persist")
+    parser.add_argument("--accounts", type=int, default=20, help="Accounts seeded in the fake database")
+    parser.add_argument("--qcodes", help="Comma-separated qcodes to upload against (required with --base-url)")
+    parser.add_argument("--base-url", help="Target a running server instead of the in-process app")
+    parser.add_argument("--db-latency-ms", type=float, default=2.0, help="Fake database latency per call")
+    parser.add_argument("--db-row-us", type=float, default=20.0, help="Fake database cost per inserted row")
+    parser.add_argument("--consolidated-cache", action="store_true", help="Keep the consolidated result cache on")
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Also write the summary to this file")
+    parser.add_argument("--log-level", default="ERROR", help="Level for app loggers during the run (written to LOG_FILE)")
+    args = parser.parse_args(argv)
+
+    try:
+        parse_mix(args.mix)
+    except ValueError as e:
+        parser.error(str(e))
+    logging.basicConfig(level=args.log_level.upper(), stream=sys.stderr)
+
+    summary = asyncio.run(main_async(args))
+    print_summary(summary)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=2)
+    if summary["problems"]:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()